@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Adaptive (sub-annual) time stepping of morQuest with local error control
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import numpy as np
+
+import Forcing
+import Kernel
+from morQuest import morquest_set_input, scalar, result_series, result_meta, result_params, MorquestResult
+
+# Run_morquest advances the model by one year per step. run_adaptive uses the same step of Kernel.py with a
+# variable step dt: short steps (down to days) where the state changes quickly, e.g. when the intertidal area
+# drowns or sea level rise sets in, and long steps (up to dt_max years) where it changes slowly. The error of a
+# step of dt is estimated by step doubling, comparing it with two steps of dt / 2: the step is accepted (keeping
+# the two half steps) when the difference is within rtol of the state, and the next dt is scaled by
+# 0.9 / sqrt(error), between 0.2 and 5 times the last one. The transports are not in the error norm: they jump
+# where the model switches terms and clamps, and controlling them forces steps of dt_min. The largest of these
+# jumps is the loss of the intertidal area (drowning, or its volume running empty), where the clamps set the
+# transports of the last step from its length; that step is refined like a failed one until it is dt_min long.
+# Steps end on the years where the model switches terms on (year 2 for the height-width terms, slrst and
+# slrst + 1 for sea level rise) and at dur. Between the years, the sea level follows its slrtype curve and the
+# river discharge and ssc are interpolated linearly.
+#
+# The steps are first order, so the error of a run is larger than rtol and falls about with its square root.
+# Against steps of 0.005 yr (Alsea Bay and drowning, eroding and accelerated rise variants), the largest error
+# relative to the range of each series before the intertidal area is lost, and the error of the year of the loss:
+#   rtol    Ai, Vi, Vc    transports (Qci)    year of the loss
+#   1e-3    6e-3 - 1e-2   0.2 - 0.4           up to 0.4 yr early
+#   1e-4    2e-3 - 4e-3   0.05 - 0.3          up to 0.13 yr early
+#   1e-5    6e-4 - 1.5e-3 0.01 - 0.06         up to 0.04 yr early
+# The transport errors are those of the first years, where they relax to the adaptation timescale.
+
+#Variables whose local error is controlled
+ERROR_ROWS = [Kernel.AI, Kernel.AC, Kernel.VC, Kernel.VI, Kernel.VD, Kernel.VS, Kernel.VI_SED]
+
+#Rows holding the change over a step (the other rows are levels or rates per year)
+INCREMENT_ROWS = [Kernel.DAI_SL, Kernel.DAI, Kernel.DAC, Kernel.DVC_SL, Kernel.DVC, Kernel.DVI_SL, Kernel.DVI,
+                  Kernel.DVI_SED_SL, Kernel.DVI_SED, Kernel.DVS, Kernel.DVD, Kernel.DVOUT, Kernel.DS, Kernel.DBR]
+
+
+def _resample(tt, S, grid):
+    # State rows on the output times: levels and rates interpolated, changes per step turned into the change per
+    # year over each output interval (the last interval repeated at the end)
+    out = np.empty((len(S), len(grid)))
+    for row in range(len(S)):
+        if row in INCREMENT_ROWS:
+            total = np.interp(grid, tt, np.concatenate([[0], np.cumsum(S[row, :-1])]))
+            rate = np.diff(total) / np.diff(grid)
+            out[row] = np.concatenate([rate, rate[-1:]])
+        else:
+            out[row] = np.interp(grid, tt, S[row])
+    return out
+
+
+def _sea_level(slrtype, slr, dur, slrst, slrr):
+    # Sea level at any time of the run, m: the slrtype curve between the years (yearly rates held within the year)
+    definition = Forcing._definition(slrtype)
+    if definition.get('rate'):
+        rise = np.concatenate([[0], np.cumsum(slrr)])
+        return lambda t: float(np.interp(t, np.arange(dur + 1.0), rise))
+
+    def curve(t):
+        if 'function' in definition:
+            return float(np.asarray(definition['function'](np.array([t]), dur, slrst), dtype=float)[0])
+        return float(np.interp(t, definition['years'], definition['values']))
+    if slrtype in Forcing.BUILTIN:
+        return lambda t: slr * curve(t)
+    start, end = curve(0), curve(dur)
+    if definition['scaled']:
+        return lambda t: slr * (curve(t) - start) / (end - start)
+    return lambda t: curve(t) - start
+
+
+def run_adaptive(input, rtol=1e-4, dt0=1.0, dt_min=1 / 365, dt_max=10.0, output=None, backend='auto'):
+    """
+    Run morQuest with adaptive time steps.
+
+    Parameters:
+    - input (dict): morquest_set_input dictionary (or its keyword values).
+    - rtol (float): Local error tolerance per step, relative to the magnitude of Ai, Ac, Vc, Vi, Vd, Vs and sedVi.
+      The error of the run is larger, about 0.3 * sqrt(rtol) for the areas and volumes (see above).
+    - dt0 (float): First step, yr.
+    - dt_min (float): Smallest step, yr; a step of dt_min is accepted whatever its error.
+    - dt_max (float): Largest step, yr.
+    - output (array): Output times, yr (default: every year, 0..dur).
+    - backend (str): Kernel backend, see Run_morquest.
+
+    Returns:
+    - tuple: (MorquestResult on the output times, with the d-series as changes per year; dict of step statistics:
+      'accepted', 'rejected' and 'forced' steps, 'evaluations' of the model step, 'dt_min', 'dt_max' and the
+      step 'times').
+    """
+    input = dict(input) if 'plottimeres' in input else morquest_set_input(**input)
+    dur = int(input['dur'])
+    initialize, step = Kernel.get_step(backend)[:2]
+
+    # Yearly forcing, as in Run_morquest
+    slrr_yearly, slrst = Forcing.slr_forcing(input['slrtype'], scalar(input['slr']), dur, input.get('slrst'))[1:]
+    slrr_yearly = np.asarray(slrr_yearly, dtype=float)
+    level = _sea_level(input['slrtype'], scalar(input['slr']), dur, slrst, slrr_yearly)
+    years = np.arange(dur + 1.0)
+    ssc = np.asarray(Forcing.river_forcing(input.get('ssc_series'), scalar(input['ssc']), scalar(input['fssc']), years,
+                                           1, input.get('start')))
+    Qr = np.asarray(Forcing.river_forcing(input.get('Qr_series'), scalar(input['Qr']), scalar(input['fQr']), years,
+                                          1, input.get('start')))
+    p = Kernel.pack_params(input)
+    volume = 3600 * 24 * 365 / p[Kernel.P_RHO] / (1 - p[Kernel.P_POR])
+
+    def supply(t):
+        # River sediment supply, m3/yr; Qr and ssc are interpolated separately (exact for linear growth)
+        return np.interp(t, years, Qr) * np.interp(t, years, ssc) * volume
+
+    breaks = sorted({float(b) for b in (2, slrst, slrst + 1, dur) if 0 < b <= dur})  #switches of the model
+
+    size = 256
+    S, tt, dt, slrr = Kernel.new_state(size), np.zeros(size), np.zeros(size), np.zeros(size)
+    S[Kernel.QRC, 0] = supply(0.0)
+    initialize(p, S, slrr_yearly, Qr, ssc)                              #Qcieq per year of the first year
+    Ab = p[Kernel.P_AC] + p[Kernel.P_AI]                                #basin area, m2
+    scale0 = np.abs(S[ERROR_ROWS, 0])
+    counts = Kernel.new_counts()                                        #clamps of all trial steps, not reported
+
+    def trial(k, t0, t1, itp, ref):
+        # One model step from column k (time t0) to column k + 1 (time t1)
+        tt[k], tt[k + 1], dt[k] = t0, t1, t1 - t0
+        slrr[k] = level(t1) - level(t0)
+        slrr[k + 1] = slrr_yearly[min(int(t1), dur - 1)]                #only tested for zero (no rise)
+        S[:, k + 1] = 0
+        S[Kernel.QRC, k + 1] = supply(t1)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):  #both values of the kernel's selects
+            return step(p, S, slrr, slrst, k, itp, Ab, tt, dt, ref if ref >= 0 else k + 1, counts)
+
+    stats, steps = {'accepted': 0, 'rejected': 0, 'forced': 0, 'evaluations': 0}, []
+    k, t, h, itp, grow = 0, 0.0, float(dt0), 1, 5.0
+    ref = 0 if slrst + 1 <= 0 else -1                                   #column of year slrst + 1, once reached
+    while t < dur:
+        t1 = min(t + min(h, dt_max), next(b for b in breaks if b > t))
+        h = t1 - t
+        if k + 3 > len(tt):
+            S = np.concatenate([S, Kernel.new_state(len(tt))], axis=1)
+            tt, dt, slrr = (np.concatenate([a, np.zeros(len(a))]) for a in (tt, dt, slrr))
+        saved = S[:, k].copy()
+
+        trial(k, t, t1, itp, ref)                                       #one step of h
+        full = S[ERROR_ROWS, k + 1].copy()
+        S[:, k] = saved
+        half = trial(k, t, t + 0.5 * h, itp, ref)                       #two steps of h / 2
+        half = trial(k + 1, t + 0.5 * h, t1, half, ref)
+        stats['evaluations'] += 3
+        with np.errstate(invalid='ignore'):
+            error = np.abs(S[ERROR_ROWS, k + 2] - full) / (rtol * np.maximum(scale0, np.abs(full)) + np.finfo(float).tiny)
+        error = float(np.max(np.nan_to_num(error, nan=np.inf)))
+        if half != itp or (S[Kernel.AI, k] > 0 and S[Kernel.AI, k + 2] <= 0):
+            error = np.inf                                              #intertidal area lost within the step
+
+        factor = min(grow, max(0.2, 0.9 / np.sqrt(error))) if error > 0 else grow
+        if error <= 1 or h <= dt_min * (1 + 1e-9):
+            stats['forced' if error > 1 else 'accepted'] += 1
+            if ref < 0 and t1 >= slrst + 1:
+                ref = k + 2
+            k, t, itp, grow = k + 2, t1, half, 5.0
+            steps.append(h)
+        else:
+            stats['rejected'] += 1
+            S[:, k] = saved
+            grow = 1.0                                                  #no growth right after a rejection
+        h = max(h * factor, dt_min)
+
+    # Output on the requested times
+    tt, S = tt[:k + 1], S[:, :k + 1]
+    grid = years if output is None else np.asarray(output, dtype=float)
+    state = dict(zip(Kernel.STATE, _resample(tt, S, grid)))
+    rise = np.array([level(t) for t in grid])
+    series = result_series(state, grid, rise, np.diff(rise), np.interp(grid, years, Qr * ssc))
+    stats.update({'dt_min': min(steps), 'dt_max': max(steps), 'times': tt.copy()})
+    return MorquestResult(series, result_meta(input), result_params(input)), stats
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Performance benchmarks of the MorQuest model
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import argparse
+import contextlib
+import fnmatch
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+
+import Kernel
+from morQuest import morquest_set_input, Run_morquest, Run_morquest_batch
+
+# Benchmark suite: `python Benchmark.py suite` times the cases of CASES, each in a fresh process working in a
+# temporary copy of the repository layout (the Data folder and code linked, an empty results folder), so caches
+# start cold and the peak resident memory is that of the case alone. Per case it records the first call, the best
+# of the repeated calls, the time per simulated year-step (model runs), the peak RSS and the peak of the Python
+# allocations (tracemalloc, one extra call). Every suite run is appended to HISTORY; with --save-baseline it also
+# becomes the BASELINE, and later runs flag the metrics that grew by more than --threshold against it.
+HISTORY = 'results/benchmarks/history.jsonl'
+BASELINE = 'results/benchmarks/baseline.json'
+METRICS = ['time_s', 'peak_rss_mb', 'alloc_peak_mb']                  #compared with the baseline
+
+#Modules timed by the startup benchmark: the solver core, what sweep and pipeline workers import, and the tools
+STARTUP_MODULES = ['morQuest', 'Sweep', 'Pipeline', 'Calibration', 'Surrogate']
+#Optional dependencies reported when importing a module loads them (the core needs numpy only)
+HEAVY = ['pandas', 'scipy', 'matplotlib', 'numba', 'geopandas']
+
+#Alsea Bay case of morQuest_Simple.ipynb
+ALSEA_BAY = dict(Ac=8557507, Ai=5310447, dH=2.46, Qr=38.95, fQr=0, ssc=0.1, fssc=0, slr=0.53, lsys=5503, cl=1e6,
+                 betas=0.01, cd=21.7, fd=1.5, du=10, por=0.4, rho=2650, dur=100, T=43200, slrtype='linear', incAi=0,
+                 tr=0, erc=0.5, ecs=0.5, fis=0.5, si=0.10, fs=0.5, faw=0.5)
+
+
+def _kernel_inputs(input):
+    # Same forcing and preprocessing as Run_morquest, for timing the time loop alone
+    dur = int(input['dur'])
+    slrr = input['slr'] / dur * np.ones(dur)
+    Qr = np.full(dur + 1, float(input['Qr']))
+    ssc = np.full(dur + 1, float(input['ssc']))
+    params = Kernel.pack_params(input)
+    Qs = Qr * ssc * 3600 * 24 * 365 / params[Kernel.P_RHO] / (1 - params[Kernel.P_POR])
+    return params, slrr, Qr, ssc, Qs, dur
+
+
+def time_kernel(backend='python', dur=1000, repeat=5, **kwargs):
+    """
+    Time the yearly loop kernel alone.
+
+    Parameters:
+    - backend (str): Kernel backend, see Kernel.get_kernel.
+    - dur (int): Number of simulated years.
+    - repeat (int): Number of timed runs; the best one is reported.
+
+    Returns:
+    - float: Best wall time per year-step, in microseconds.
+    """
+    kernel = Kernel.get_kernel(backend)
+    params, slrr, Qr, ssc, Qs, dur = _kernel_inputs(morquest_set_input(**dict(ALSEA_BAY, dur=dur, **kwargs)))
+    S = Kernel.new_state(dur + 1)
+    events = Kernel.pack_events()[1]
+    best = np.inf
+    with np.errstate(all='ignore'):
+        for _ in range(repeat + 1):                          # first run warms up (and compiles numba)
+            S[:] = 0
+            S[Kernel.QRC] = Qs
+            t0 = time.perf_counter()
+            kernel(params, S, slrr, Qr, ssc, -1, dur, Kernel.new_counts(), *events)
+            best = min(best, time.perf_counter() - t0)
+    return best / dur * 1e6
+
+
+def kernel_parity(backend='numba', inputs=None):
+    """
+    Compare every output series of a backend with the pure-Python kernel.
+
+    Returns:
+    - dict: 'identical' (bit-for-bit equal for all series) and 'max_rel_diff' (largest relative deviation).
+    """
+    inputs = inputs or [dict(ALSEA_BAY), dict(ALSEA_BAY, slr=3.0, slrtype='accel'), dict(ALSEA_BAY, fQr=0.02, fssc=-0.005, tr=0.01),
+                        dict(ALSEA_BAY, slr=20.0, si=0.05)]
+    identical, worst = True, 0.0
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        warnings.simplefilter('ignore')
+        for values in inputs:
+            input = morquest_set_input(**values)
+            reference = Run_morquest(input, backend='python')
+            other = Run_morquest(input, backend=backend)
+            for key, value in reference.series.items():
+                if not np.array_equal(value, other[key], equal_nan=True):
+                    identical = False
+                    scale = np.maximum(np.abs(value), np.finfo(float).tiny)
+                    worst = max(worst, float(np.nanmax(np.abs(other[key] - value) / scale)))
+    return {'identical': identical, 'max_rel_diff': worst}
+
+
+def benchmark_kernel(durations=(100, 1000, 10000)):
+    print(f"{'dur':>8} {'python us/yr':>14} {'numba us/yr':>14} {'speedup':>9}")
+    for dur in durations:
+        python = time_kernel('python', dur, repeat=1 if dur > 1000 else 3)
+        if Kernel.numba_available():
+            compiled = time_kernel('numba', dur)
+            print(f"{dur:>8} {python:>14.2f} {compiled:>14.3f} {python / compiled:>8.0f}x")
+        else:
+            print(f"{dur:>8} {python:>14.2f} {'n/a':>14} {'':>9}")
+    if Kernel.numba_available():
+        parity = kernel_parity('numba')
+        print(f"numba parity with python kernel: identical={parity['identical']} max_rel_diff={parity['max_rel_diff']:.2e}")
+    else:
+        print("numba is not installed; only the pure-Python kernel was timed")
+
+
+_IMPORT = ('import json, sys, time; start = time.perf_counter(); import {module}; '
+           'print(json.dumps([time.perf_counter() - start, [name for name in {heavy!r} if name in sys.modules]]))')
+
+
+def time_import(module, repeat=5):
+    """
+    Cold import time of a module, each time in a new interpreter.
+
+    Parameters:
+    - module (str): Module name, e.g. 'morQuest'.
+    - repeat (int): Interpreters started; the best time is reported.
+
+    Returns:
+    - dict: 'import_s' (best time of the import itself), 'process_s' (best wall time of the whole interpreter run)
+      and 'loaded' (the HEAVY dependencies the import loaded).
+    """
+    best, process = np.inf, np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', _IMPORT.format(module=module, heavy=HEAVY)], capture_output=True,
+                             text=True, check=True)
+        process = min(process, time.perf_counter() - start)
+        elapsed, loaded = json.loads(out.stdout.splitlines()[-1])
+        best = min(best, elapsed)
+    return {'import_s': best, 'process_s': process, 'loaded': loaded}
+
+
+def _start_worker(module):
+    # Task of a fresh pool worker: the imports of a sweep or pipeline task
+    importlib.import_module(module)
+    return os.getpid()
+
+
+def time_workers(workers=64, module='Sweep'):
+    """
+    Time until a spawned process pool has run its first task in every worker.
+
+    Parameters:
+    - workers (int): Pool size.
+    - module (str): Module imported by each worker task (Sweep for run_sweep, Pipeline for run_pipeline).
+
+    Returns:
+    - float: Wall time, s.
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        list(pool.map(_start_worker, [module] * workers))
+    return time.perf_counter() - start
+
+
+def benchmark_startup(modules=STARTUP_MODULES, workers=64):
+    print(f"{'module':<14} {'import ms':>10} {'process ms':>11}  loads")
+    for module in modules:
+        result = time_import(module)
+        print(f"{module:<14} {result['import_s'] * 1e3:10.1f} {result['process_s'] * 1e3:11.1f}  "
+              f"{', '.join(result['loaded']) or 'numpy only'}")
+    if workers:
+        elapsed = time_workers(workers)
+        print(f"{workers} spawned sweep workers ready in {elapsed:.2f} s ({elapsed / workers * 1e3:.0f} ms per worker, "
+              f"{os.cpu_count()} CPUs)")
+
+
+def _run_case(dur, backend='python'):
+    # Single scenario over dur years, at the sea level rise rate of the Alsea Bay case
+    input = morquest_set_input(**dict(ALSEA_BAY, dur=dur, slr=ALSEA_BAY['slr'] * dur / ALSEA_BAY['dur']))
+    return lambda: Run_morquest(input, backend=backend), dur
+
+
+def _batch_case(size, **options):
+    # Ensemble of size scenarios (sea level rise 0.1 to 2 m over 100 years)
+    input = dict(morquest_set_input(**ALSEA_BAY), slr=np.linspace(0.1, 2.0, size))
+    return lambda: Run_morquest_batch(input), size * ALSEA_BAY['dur']
+
+
+def _analysis_case(step, **options):
+    # analyze_* preprocessing of Alsea Bay on the Data folder, without figures; each call starts without the
+    # in-memory tables (the disk cache of results/cache is built by the first call)
+    import Loader
+    from Channel_analysis import analyze_channel_area
+    from Hydrology_analysis import analyze_hydrology
+    from Intertidal_analysis import analyze_intertidal_area
+    from Nearshore_Slopes_analysis import analyze_nearshore_data
+    from Tidal import analyze_tidal_data
+    analyses = {'intertidal': lambda: analyze_intertidal_area(Loader.INTERTIDAL, 'Alsea_bay', plot=False),
+                'hydrology': lambda: analyze_hydrology('Alsea_bay', plot=False),
+                'tidal': lambda: analyze_tidal_data('d575a', 'Alsea_bay', plot=False),
+                'channel': lambda: analyze_channel_area('Alsea_bay'),
+                'nearshore': lambda: analyze_nearshore_data('Alsea_bay')}
+
+    def run():
+        Loader._memory.clear()
+        return analyses[step]()
+    return run, None
+
+
+def _notebook_case(**options):
+    # morQuest_CaseStudy.ipynb for Alsea Bay without a display: every analysis with its figure, the model run and
+    # its figures, from empty caches (the intertidal map needs geopandas and is skipped without it)
+    import Loader
+    import Pipeline
+    from Hydrology_analysis import analyze_hydrology
+    from Intertidal_analysis import analyze_intertidal_area
+    from Report import plot_result
+    from Tidal import analyze_tidal_data
+
+    def run():
+        Loader._memory.clear()
+        shutil.rmtree(Loader.CACHE_DIR, ignore_errors=True)
+        analyze_intertidal_area(Loader.INTERTIDAL, 'Alsea_bay', plot=importlib.util.find_spec('geopandas') is not None)
+        analyze_hydrology('Alsea_bay')
+        analyze_tidal_data('d575a', 'Alsea_bay')
+        inputs = Pipeline.run_estuary('Alsea_bay', targets=('inputs',), cache_dir=tempfile.mkdtemp(dir='results'))
+        data = {key: value for key, value in inputs['inputs'].items() if key != 'Year'}
+        result = Run_morquest(morquest_set_input(**dict(Pipeline.MODEL_DEFAULTS, **data)))
+        plot_result(result, 'Alsea_bay')
+    return run, None
+
+
+def _import_case(module, **options):
+    # New interpreter importing module, as a CLI call or a spawned pool worker does
+    return lambda: subprocess.run([sys.executable, '-c', f'import {module}'], check=True), None
+
+
+def _spawn_case(workers, **options):
+    # Spawned pool whose workers each import Sweep, as run_sweep does
+    return lambda: time_workers(workers), None
+
+
+def _pipeline_case(**options):
+    # All stages of Pipeline.py for Alsea Bay, from an empty stage cache
+    import Loader
+    import Pipeline
+
+    def run():
+        Loader._memory.clear()
+        Pipeline._digests.clear()
+        return Pipeline.run_estuary('Alsea_bay', cache_dir=tempfile.mkdtemp(dir='results'))
+    return run, None
+
+
+#Case name -> setup function and its arguments; a setup returns the timed callable and its number of year-steps
+CASES = {'run_dur100': (_run_case, 100), 'run_dur1000': (_run_case, 1000), 'run_dur10000': (_run_case, 10000),
+         'batch_1': (_batch_case, 1), 'batch_100': (_batch_case, 100), 'batch_10000': (_batch_case, 10000),
+         'analyze_intertidal': (_analysis_case, 'intertidal'), 'analyze_hydrology': (_analysis_case, 'hydrology'),
+         'analyze_tidal': (_analysis_case, 'tidal'), 'analyze_channel': (_analysis_case, 'channel'),
+         'analyze_nearshore': (_analysis_case, 'nearshore'), 'pipeline_alsea': (_pipeline_case,),
+         'notebook_alsea': (_notebook_case,), 'import_core': (_import_case, 'morQuest'),
+         'import_pipeline': (_import_case, 'Pipeline'), 'spawn_16': (_spawn_case, 16)}
+QUICK = [name for name in CASES if name not in ('run_dur10000', 'batch_10000')]
+
+
+def _rss_mb():
+    # Peak resident memory of this process so far, MB (ru_maxrss is in kB on Linux and in bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** (2 if sys.platform == 'darwin' else 1)
+
+
+def _measure(name, repeat, options, root):
+    # Runs in a fresh worker process: one case in a temporary working directory
+    workdir = tempfile.mkdtemp(prefix='morquest-bench-')
+    for entry in os.listdir(root):
+        if entry != 'results':
+            os.symlink(os.path.join(root, entry), os.path.join(workdir, entry))
+    os.makedirs(os.path.join(workdir, 'results'))
+    os.chdir(workdir)
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        with warnings.catch_warnings(), np.errstate(all='ignore'), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            setup, *args = CASES[name]
+            run, steps = setup(*args, **options)
+            base = _rss_mb()
+            start = time.perf_counter()
+            run()
+            first = time.perf_counter() - start
+            best = first
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - start)
+            peak = _rss_mb()
+            tracemalloc.start()
+            run()
+            allocated = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return {'time_s': best, 'first_s': first, 'per_step_us': best / steps * 1e6 if steps else None,
+                'peak_rss_mb': peak, 'base_rss_mb': base, 'alloc_peak_mb': allocated / 1024 ** 2, 'repeat': repeat}
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+    finally:
+        os.chdir(root)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _meta(options):
+    # Code version and machine of a suite run
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                    text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    numba = importlib.util.find_spec('numba') is not None
+    return {'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': commit, 'dirty': dirty,
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'numba': __import__('numba').__version__ if numba else None, 'machine': platform.machine(),
+            'host': platform.node(), 'cpus': os.cpu_count(), 'options': options}
+
+
+def run_suite(cases=None, repeat=3, backend='python'):
+    """
+    Run the benchmark cases, each in its own process.
+
+    Parameters:
+    - cases (list): Case names or patterns (e.g. 'analyze_*'); default: all of CASES.
+    - repeat (int): Timed calls after the first one; the best is reported.
+    - backend (str): Kernel backend of the single scenario runs (run_dur*), see Run_morquest.
+
+    Returns:
+    - dict: 'meta' (time, commit, versions, machine) and 'results' (case -> metrics, or 'error').
+    """
+    patterns = cases or ['*']
+    unknown = [pattern for pattern in patterns if not fnmatch.filter(CASES, pattern)]
+    if unknown:
+        raise ValueError(f"No benchmark case matches {unknown}; cases are {list(CASES)}")
+    names = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+    options = {'backend': backend}
+    results = {}
+    for name in names:
+        case_options = options if name.startswith('run_') else {}
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results[name] = pool.submit(_measure, name, repeat, case_options, os.getcwd()).result()
+    return {'meta': _meta(options), 'results': results}
+
+
+def compare(suite, baseline, threshold=0.2, min_time=1e-3):
+    """
+    Metrics of a suite run that grew by more than threshold against a baseline run.
+
+    Parameters:
+    - suite, baseline (dict): Outputs of run_suite.
+    - threshold (float): Relative growth flagged as a regression (0.2: 20 %).
+    - min_time (float): Times below min_time seconds are not compared (timer noise).
+
+    Returns:
+    - list: One dict per regression: case, metric, baseline, value and ratio.
+    """
+    regressions = []
+    for name, result in suite['results'].items():
+        reference = baseline['results'].get(name, {})
+        for metric in METRICS:
+            old, new = reference.get(metric), result.get(metric)
+            if old is None or new is None or old <= 0 or (metric == 'time_s' and max(old, new) < min_time):
+                continue
+            if new > old * (1 + threshold):
+                regressions.append({'case': name, 'metric': metric, 'baseline': old, 'value': new, 'ratio': new / old})
+    return regressions
+
+
+def _report(suite, baseline):
+    print(f"{'case':<20} {'time ms':>10} {'first ms':>10} {'us/step':>10} {'RSS MB':>8} {'alloc MB':>9} {'vs base':>8}")
+    for name, result in suite['results'].items():
+        if 'error' in result:
+            print(f"{name:<20} {result['error']}")
+            continue
+        old = (baseline or {}).get('results', {}).get(name, {}).get('time_s')
+        step = f"{result['per_step_us']:10.3f}" if result['per_step_us'] is not None else f"{'':>10}"
+        change = f"{result['time_s'] / old:7.2f}x" if old else f"{'':>8}"
+        print(f"{name:<20} {result['time_s'] * 1e3:10.2f} {result['first_s'] * 1e3:10.2f} {step} "
+              f"{result['peak_rss_mb']:8.1f} {result['alloc_peak_mb']:9.2f} {change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Performance benchmarks of the MorQuest model.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('kernel', help='time per simulated year of the kernels and numba parity (default)')
+    startup = commands.add_parser('startup', help='cold import time of the modules and start of a spawned pool')
+    startup.add_argument('modules', nargs='*', default=STARTUP_MODULES, help='modules to import')
+    startup.add_argument('--workers', type=int, default=64, help='spawned pool size (default: 64; 0 skips it)')
+    suite = commands.add_parser('suite', help='benchmark suite with history and regression check')
+    suite.add_argument('cases', nargs='*', help=f"case names or patterns (default: all): {', '.join(CASES)}")
+    suite.add_argument('--quick', action='store_true', help='skip the 10 000-year run and the 10 000-scenario batch')
+    suite.add_argument('--repeat', type=int, default=3, help='timed calls after the first one (default: 3)')
+    suite.add_argument('--backend', default='python', help='kernel backend of the run_dur* cases')
+    suite.add_argument('--history', default=HISTORY, help='JSON lines file the run is appended to')
+    suite.add_argument('--baseline', default=BASELINE, help='baseline run to compare with')
+    suite.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    suite.add_argument('--threshold', type=float, default=0.2,
+                       help='relative growth of a time or memory metric flagged as a regression (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup':
+        benchmark_startup(args.modules, args.workers)
+        return 0
+    if args.command != 'suite':
+        benchmark_kernel()
+        return 0
+    cases = args.cases or (QUICK if args.quick else None)
+    result = run_suite(cases, args.repeat, args.backend)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _report(result, baseline)
+
+    if args.history:
+        os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=1)
+        print(f'Baseline saved to {args.baseline}')
+    elif baseline is not None:
+        regressions = compare(result, baseline, args.threshold)
+        for row in regressions:
+            print(f"REGRESSION {row['case']} {row['metric']}: {row['baseline']:.4g} -> {row['value']:.4g} "
+                  f"({row['ratio']:.2f}x, baseline {baseline['meta'].get('commit')})")
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.threshold:.0%} against baseline {baseline['meta'].get('commit')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Calibration of the MorQuest coefficients against observed areas
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.optimize import differential_evolution, minimize
+
+import Forcing
+import Instrument
+import Loader
+from Derivatives import run_derivatives
+from morQuest import BATCH_KEYS, morquest_set_input, scalar, Run_morquest_batch
+
+#Free coefficients and their search ranges
+BOUNDS = {
+    'lsys': (1000, 20000),          #system length scale, m
+    'si': (0.02, 0.5),              #intertidal edge slope factor, -
+    'fs': (0, 1),                   #it area deposition split width/slope, -
+    'fis': (0, 1),                  #river supply share to it area, -
+    'faw': (0, 1),                  #reduction of fs and fis under lowering Qrc, -
+    'tr': (0, 0.1),                 #channel to shore exchange, -
+    'erc': (0, 1),                  #river supply entrapment river to channel, -
+    'ecs': (0, 1),                  #river supply entrapment channel to shoreline, -
+}
+
+#Model sources; a change in the model invalidates cached calibrations
+MODEL_FILES = ['morQuest.py', 'Kernel.py', 'Forcing.py']
+
+#River series inputs; the cache key and file hold their digest (or name) instead of their values
+SERIES_KEYS = ['Qr_series', 'ssc_series']
+
+
+#Survey year of the channel areas (Loader.CHANNEL)
+CHANNEL_YEAR = 2016
+
+
+def load_observed(selection, results_dir='results', channel=Loader.CHANNEL, channel_year=CHANNEL_YEAR):
+    """
+    Observed intertidal area per year written by Intertidal_analysis.analyze_intertidal_area, or read from the
+    intertidal shapefile (Loader.intertidal_areas) when that file is missing, and the observed channel area.
+
+    The channel area is only surveyed once (2016, after the last intertidal year), so it is added as the 'Ac'
+    observation of channel_year, with no 'Ai' that year; the hindcast then runs on to the survey.
+
+    Parameters:
+    - selection (str): Estuary name, e.g. 'Alsea_bay'.
+    - results_dir (str): Folder holding 00_Input_Intertidal_Area_<selection>.csv.
+    - channel (str): Channel area shapefile (Loader.channel_areas); None to observe Ai only.
+    - channel_year (int): Year of the channel area survey.
+
+    Returns:
+    - DataFrame: Columns 'Year', 'Ai' and, with a channel area of the estuary, 'Ac' (m2, NaN where not observed),
+      sorted by year.
+    """
+    file = os.path.join(results_dir, f'00_Input_Intertidal_Area_{selection}.csv')
+    if os.path.exists(file):
+        df = pd.read_csv(file)
+    else:
+        df = Loader.intertidal_areas()
+        df = df[df['Est'] == selection]
+    df = df.rename(columns={'area': 'Ai'})
+    df['Ai'] = df['Ai'] * 1000000                                           #km2 to m2
+    df = df[['Year', 'Ai']]
+    if channel is not None:
+        areas = Loader.channel_areas(channel)
+        areas = areas[areas['name2'] == selection]
+        if not areas.empty:
+            ac = pd.DataFrame({'Year': [float(channel_year)], 'Ac': [areas['area'].sum() * 1000000]})  #km2 to m2
+            df = pd.merge(df, ac, on='Year', how='outer')
+    return df.sort_values('Year').reset_index(drop=True)
+
+
+def _model_hash():
+    digest = hashlib.sha256()
+    for name in MODEL_FILES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _hindcast(base, observed):
+    # Model set-up covering the observation period, starting from the first observed state
+    years = observed['Year'].to_numpy(dtype=float)
+    input = {key: scalar(value) if key in BATCH_KEYS else value for key, value in base.items()}
+    input['dur'] = int(round(years[-1] - years[0]))
+    input['start'] = years[0]                                           #aligns river series given by year
+    input['plottimeres'] = 1
+    input['Ai'] = float(observed['Ai'].iloc[0])
+    if 'Ac' in observed and np.isfinite(observed['Ac'].iloc[0]):
+        input['Ac'] = float(observed['Ac'].iloc[0])
+    return input, np.rint(years - years[0]).astype(int)
+
+
+def misfit(series, observed, index, weights=None):
+    """
+    Normalized root mean square misfit between simulated and observed areas.
+
+    Parameters:
+    - series (dict): Simulated time series, [scenario, year] arrays (e.g. MorquestResult.series of a batch).
+    - observed (DataFrame): Observed 'Ai' (and optionally 'Ac') per observation year, m2; NaN marks a missing value.
+    - index (array): Model year of every observation.
+    - weights (dict): Weight of each observed variable (default 1).
+
+    Returns:
+    - ndarray: Misfit of every scenario; inf for scenarios that fail (e.g. drowned intertidal area).
+    """
+    total = 0
+    for key in ['Ai', 'Ac']:
+        if key not in observed:
+            continue
+        obs = observed[key].to_numpy(dtype=float)
+        keep = np.isfinite(obs)
+        keep[0] = False                                                     #initial state is imposed
+        if not keep.any():
+            continue
+        sim = np.atleast_2d(series[key])[:, index[keep]]
+        err = (sim - obs[keep]) / np.mean(obs[keep])
+        total = total + (weights or {}).get(key, 1) * np.mean(np.square(err), axis=1)
+    total = np.sqrt(total)
+    return np.where(np.isfinite(total), total, np.inf)
+
+
+def _gradient_fit(input, observed, index, params, bounds, weights, maxiter):
+    # L-BFGS-B from the input values, on coefficients scaled to [0, 1] by their bounds, with exact gradients
+    lower = np.array([bounds[key][0] for key in params], dtype=float)
+    width = np.array([bounds[key][1] for key in params], dtype=float) - lower
+    keys = [key for key in ['Ai', 'Ac'] if key in observed]
+    runs = [0]
+
+    def objective(u):
+        runs[0] += 1
+        with np.errstate(all='ignore'):
+            result, jac = run_derivatives(dict(input, **dict(zip(params, lower + u * width))), params, keys, index)
+        value = misfit({key: result[key] for key in keys}, observed, index, weights)[0]
+        if not np.isfinite(value) or value == 0:
+            return (1e3 if not np.isfinite(value) else 0.0), np.zeros(len(params))
+        grad = np.zeros(len(params))
+        for key in keys:
+            obs = observed[key].to_numpy(dtype=float)
+            keep = np.isfinite(obs)
+            keep[0] = False                                                 #initial state is imposed
+            if not keep.any():
+                continue
+            scale = np.mean(obs[keep])
+            err = (np.ravel(result[key])[index[keep]] - obs[keep]) / scale
+            derivative = jac.loc[key].loc[index[keep]].to_numpy() / scale   #[observation, coefficient]
+            grad += (weights or {}).get(key, 1) * 2 * np.mean(err[:, None] * derivative, axis=0)
+        return value, grad / (2 * value) * width
+
+    u0 = np.clip((np.array([scalar(input[key]) for key in params]) - lower) / width, 0, 1)
+    fit = minimize(objective, u0, jac=True, method='L-BFGS-B', bounds=[(0, 1)] * len(params),
+                   options={'maxiter': maxiter})
+    return lower + fit.x * width, float(fit.fun), runs[0], int(fit.nit), bool(fit.success)
+
+
+def calibrate(base, observed, params=None, bounds=None, weights=None, maxiter=100, popsize=15, seed=0,
+              cache_dir=None, name=None, method='evolution'):
+    """
+    Fit the free coefficients of the model to an observed intertidal area series.
+
+    The model is run from the first to the last observation year, starting from the first observed state, and the
+    misfit of the remaining years is minimized by differential evolution. Each generation is evaluated as one
+    Run_morquest_batch call over the whole population. With method='gradient' the misfit is minimized by L-BFGS-B
+    instead, from the coefficients of base, using the exact derivatives of Derivatives.run_derivatives: a local
+    search that needs far fewer model runs.
+
+    Parameters:
+    - base (dict): morquest_set_input values of the estuary (Ac, dH, Qr, betas, cd, ...). slr is the sea level
+      rise over the observation period; Ai and dur are taken from the observations.
+    - observed (DataFrame): 'Year' and 'Ai' (m2), optionally 'Ac' (m2), e.g. from load_observed.
+    - params (list): Coefficients to fit (default: all keys of BOUNDS).
+    - bounds (dict): Search ranges overriding BOUNDS.
+    - weights (dict): Misfit weight of 'Ai' and 'Ac'.
+    - maxiter, popsize, seed: Differential evolution settings.
+    - cache_dir (str): Folder for cached results; a calibration with unchanged inputs, settings and model code is
+      read from there instead of being recomputed.
+    - name (str): Name of the cached result (default: the input hash).
+    - method (str): 'evolution' (global search) or 'gradient' (local search from base; maxiter bounds the
+      iterations, popsize and seed are not used).
+
+    Returns:
+    - dict: 'params' (fitted values), 'input' (full model input with the fitted values), 'misfit', 'nfev' (model
+      runs), 'nit' (generations), 'success', 'cached'.
+    """
+    params = list(params or BOUNDS)
+    bounds = dict(BOUNDS, **(bounds or {}))
+    observed = observed.sort_values('Year').reset_index(drop=True)
+    input, index = _hindcast(morquest_set_input(**base), observed)
+    series = {key: input[key] for key in SERIES_KEYS if input[key] is not None and not isinstance(input[key], str)}
+    tt = np.arange(0, input['dur'] + 1, input['plottimeres'])
+
+    spec = {'input': {key: Forcing.series_digest(value, tt, input['start']) if key in series else value
+                      for key, value in input.items() if key not in params},
+            'observed': observed.to_dict(orient='list'), 'params': params, 'bounds': [bounds[key] for key in params],
+            'weights': weights, 'maxiter': maxiter, 'popsize': popsize, 'seed': seed, 'method': method,
+            'model': _model_hash(),
+            'forcing': Forcing.fingerprint([input['slrtype']] + [input[key] for key in SERIES_KEYS])}
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True, default=float).encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, f'{name or digest}.json') if cache_dir else None
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached['hash'] == digest:
+            return dict(cached['result'], input=dict(cached['result']['input'], **series), cached=True)
+
+    if method not in ('evolution', 'gradient'):
+        raise ValueError("method must be 'evolution' or 'gradient'")
+    runs = [0]
+
+    def objective(x):
+        #x: [parameter, member] for the whole population
+        x = np.atleast_2d(x.T).T
+        runs[0] += x.shape[1]
+        batch = dict(input, **{key: x[k] for k, key in enumerate(params)})
+        with np.errstate(all='ignore'):
+            result = Run_morquest_batch(batch, output=['Ai', 'Ac'])
+        return misfit(result.series, observed, index, weights)
+
+    if method == 'gradient':
+        x, fun, runs[0], nit, success = _gradient_fit(input, observed, index, params, bounds, weights, maxiter)
+    else:
+        fit = differential_evolution(objective, [bounds[key] for key in params], maxiter=maxiter, popsize=popsize,
+                                     seed=seed, polish=False, vectorized=True, updating='deferred')
+        x, fun, nit, success = fit.x, float(fit.fun), int(fit.nit), bool(fit.success)
+    values = {key: float(value) for key, value in zip(params, x)}
+    result = {'params': values,
+              'input': dict(input, **values),
+              'misfit': fun, 'nfev': runs[0], 'nit': nit, 'success': success,
+              'cached': False}
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file + '.tmp', 'w') as f:
+            stored = dict(result, input={key: value for key, value in result['input'].items() if key not in series})
+            json.dump({'hash': digest, 'result': stored}, f, indent=1, default=float)
+        os.replace(cache_file + '.tmp', cache_file)
+    return result
+
+
+def _calibrate_estuary(selection, base, observed, options, curves, series):
+    Forcing.register_definitions(curves)
+    Forcing.register_shared(series)
+    return selection, calibrate(base, observed, name=selection, **options)
+
+
+def calibrate_estuaries(estuaries, results_dir='results', cache_dir='results/calibration', max_workers=None, **options):
+    """
+    Calibrate several estuaries concurrently, one process per estuary.
+
+    Parameters:
+    - estuaries (dict): Estuary name -> base input (see calibrate). The observed series is read with
+      load_observed(name, results_dir) unless the value is a (base, observed) tuple.
+    - cache_dir (str): Cache folder; unchanged estuaries are not recomputed.
+    - max_workers (int): Pool size (default: number of CPUs).
+    - options: Further arguments of calibrate.
+
+    Returns:
+    - DataFrame: One row per estuary with the fitted coefficients, misfit, evaluations and cache hit.
+    """
+    if not estuaries:
+        columns = ['Est'] + list(options.get('params') or BOUNDS) + ['misfit', 'nfev', 'cached']
+        return pd.DataFrame(columns=columns).set_index('Est')
+    jobs = []
+    for selection, value in estuaries.items():
+        base, observed = value if isinstance(value, tuple) else (value, load_observed(selection, results_dir))
+        jobs.append((selection, base, observed, dict(options, cache_dir=cache_dir),
+                     Forcing.definitions([base.get('slrtype', 'linear')])))
+    #Registered river series are mapped from .npy files in the cache folder (copied without one)
+    names = [base.get(key) for _, base, _, _, _ in jobs for key in SERIES_KEYS]
+    shared = Forcing.share_series(names, os.path.join(cache_dir, 'forcing') if cache_dir else None)
+    jobs = [job + (shared,) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(jobs), os.cpu_count())) as pool:
+        results = dict(map(Instrument.gather, pool.map(Instrument.task(_calibrate_estuary), *zip(*jobs))))
+
+    rows = []
+    for selection, result in results.items():
+        rows.append(dict(Est=selection, **result['params'], misfit=result['misfit'], nfev=result['nfev'],
+                         cached=result['cached']))
+    return pd.DataFrame(rows).set_index('Est')
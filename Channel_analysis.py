@@ -27,21 +27,18 @@
 # building the stack.
 # mreyec@uni.pe
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
 import math
 
-def analyze_channel_area(selection):
-    # Read the data from Shapefile
-    shp_path = 'Data/Channel_Area/Channel_area_2016.shp'
-    channel = gpd.read_file(shp_path, encoding='utf-8')
+import Instrument
+import Loader
 
-    # Group by name2 and calculate sum of areas
-    channel_analysis = channel.groupby(['name2'])['area'].sum() / 1000000
-    channel_analysis = pd.DataFrame(channel_analysis).reset_index()
+@Instrument.timed('analyze.channel')
+def analyze_channel_area(selection):
+    # Sum of areas per estuary, read from the attribute table (cached, see Loader.py)
+    channel_analysis = Loader.channel_areas('Data/Channel_Area/Channel_area_2016.shp')
 
     if selection in channel_analysis['name2'].values:
         print("Valid estuary selected:", selection)
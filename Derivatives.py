@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Exact parameter derivatives of morQuest outputs by forward-mode dual numbers
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import math
+
+import numpy as np
+import pandas as pd
+
+import Forcing
+import Kernel
+from morQuest import BATCH_KEYS, morquest_set_input, scalar, result_series, result_meta, result_params, \
+    MorquestResult
+
+# The pure-Python kernel of Kernel.py is run once on dual numbers: every value carries its derivatives with respect
+# to the chosen parameters, propagated by the chain rule through each yearly update. Comparisons use the values
+# only, so every branch (clamps, drowning, height-width switches) is the one the plain run takes, and its
+# derivative is that of the active branch (a one-sided derivative at the switch itself). One run gives the exact
+# derivatives for all parameters, instead of 2 runs per parameter for central finite differences. Values are
+# computed with the libm power and exp of the kernel, so the run itself equals Run_morquest with either backend.
+
+#Default outputs
+VARIABLES = ['Ai', 'Vc', 'sedVd']
+
+
+class Dual:
+    """
+    Value with its derivatives (gradient array) with respect to a set of parameters.
+
+    Parameters:
+    - value (float): Value.
+    - grad (ndarray): Derivative of the value with respect to each parameter.
+    """
+    __slots__ = ('value', 'grad')
+    __hash__ = None
+
+    def __init__(self, value, grad):
+        self.value = np.float64(value)                                  #numpy semantics for x / 0, nan, ...
+        self.grad = grad
+
+    def __repr__(self):
+        return f'Dual({self.value!r}, {self.grad!r})'
+
+    def __float__(self):
+        return float(self.value)
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value + other.value, self.grad + other.grad)
+        return Dual(self.value + np.float64(other), self.grad)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value - other.value, self.grad - other.grad)
+        return Dual(self.value - np.float64(other), self.grad)
+
+    def __rsub__(self, other):
+        return Dual(np.float64(other) - self.value, -self.grad)
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value * other.value, self.grad * other.value + other.grad * self.value)
+        return Dual(self.value * np.float64(other), self.grad * np.float64(other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            value = self.value / other.value
+            return Dual(value, (self.grad - other.grad * value) / other.value)
+        return Dual(self.value / np.float64(other), self.grad / np.float64(other))
+
+    def __rtruediv__(self, other):
+        value = np.float64(other) / self.value
+        return Dual(value, -self.grad * value / self.value)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.grad)
+
+    def __pos__(self):
+        return self
+
+    def __pow__(self, exponent):
+        if isinstance(exponent, Dual):
+            value = self.value ** exponent.value
+            return Dual(value, value * (exponent.grad * np.log(self.value) + exponent.value * self.grad / self.value))
+        exponent = np.float64(exponent)
+        return Dual(self.value ** exponent, exponent * self.value ** (exponent - 1) * self.grad)
+
+    def __rpow__(self, base):
+        value = np.float64(base) ** self.value
+        return Dual(value, value * np.log(np.float64(base)) * self.grad)
+
+    def exp(self):
+        value = np.float64(math.exp(self.value))
+        return Dual(value, value * self.grad)
+
+    def log(self):
+        return Dual(np.log(self.value), self.grad / self.value)
+
+    def sqrt(self):
+        value = np.sqrt(self.value)
+        return Dual(value, self.grad / (2 * value))
+
+    def square(self):
+        return Dual(self.value * self.value, 2 * self.value * self.grad)
+
+    def __lt__(self, other):
+        return self.value < np.float64(other)
+
+    def __le__(self, other):
+        return self.value <= np.float64(other)
+
+    def __gt__(self, other):
+        return self.value > np.float64(other)
+
+    def __ge__(self, other):
+        return self.value >= np.float64(other)
+
+    def __eq__(self, other):
+        return self.value == np.float64(other)
+
+    def __ne__(self, other):
+        return self.value != np.float64(other)
+
+    #numpy scalars and ufuncs (np.float64 * Dual, np.exp(Dual), np.power(Dual, 1.5), ...): ufunc -> method of the
+    #Dual operand, when it is the first or the second argument
+    _BINARY = {np.add: ('__add__', '__radd__'), np.subtract: ('__sub__', '__rsub__'),
+               np.multiply: ('__mul__', '__rmul__'), np.true_divide: ('__truediv__', '__rtruediv__'),
+               np.power: ('__pow__', '__rpow__'), np.less: ('__lt__', '__gt__'), np.less_equal: ('__le__', '__ge__'),
+               np.greater: ('__gt__', '__lt__'), np.greater_equal: ('__ge__', '__le__'),
+               np.equal: ('__eq__', '__eq__'), np.not_equal: ('__ne__', '__ne__')}
+    _UNARY = {np.exp: 'exp', np.log: 'log', np.sqrt: 'sqrt', np.square: 'square', np.negative: '__neg__',
+              np.positive: '__pos__'}
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs:
+            return NotImplemented
+        if any(isinstance(x, np.ndarray) for x in inputs):
+            #element by element, with this Dual as a 0-d object array
+            return ufunc(*[np.array(x, dtype=object) if isinstance(x, Dual) else x for x in inputs])
+        if ufunc in self._UNARY:
+            return getattr(inputs[0], self._UNARY[ufunc])()
+        if ufunc in self._BINARY:
+            a, b = inputs
+            if isinstance(a, Dual):
+                return getattr(a, self._BINARY[ufunc][0])(b)
+            return getattr(b, self._BINARY[ufunc][1])(a)
+        return NotImplemented
+
+
+class _State(np.ndarray):
+    # Object state buffer keeping the numbers the kernel assigns (e.g. S[AI, yr] = 0) as float64, so that 0 / 0
+    # gives nan as in the float kernel
+    def __setitem__(self, key, value):
+        if not isinstance(value, (Dual, np.ndarray)):
+            value = np.float64(value)
+        super().__setitem__(key, value)
+
+
+def _exp(x):
+    # exp of the kernel for Duals and numbers (math.exp would drop the derivatives)
+    return x.exp() if isinstance(x, Dual) else Kernel._exp(x)
+
+
+#Pure-Python kernel on dual numbers
+_run, _closing_balance = Kernel._make_kernel(Kernel._no_jit, Kernel.SCALAR_OPS[:3] + (_exp,))[:2]
+
+
+def _values(S):
+    # Values of a 2-d object array of Duals and numbers
+    return np.array([[float(x) for x in row] for row in S])
+
+
+def _gradients(S, m):
+    # Derivatives of an object array of Duals and numbers, with the parameters as last axis
+    grad = np.zeros(S.shape + (m,))
+    for index, x in np.ndenumerate(S):
+        if isinstance(x, Dual):
+            grad[index] = x.grad
+    return grad
+
+
+def run_derivatives(input, params=('lsys', 'si', 'fs', 'fis', 'tr'), variables=VARIABLES, years=None):
+    """
+    Run morQuest and return the exact derivatives of selected outputs with respect to input parameters.
+
+    Parameters:
+    - input (dict): morquest_set_input dictionary (or its keyword values).
+    - params (list): Inputs to differentiate with respect to, among BATCH_KEYS; river discharge and ssc given as
+      series (Qr_series, ssc_series) cannot be differentiated by Qr, ssc, fQr or fssc. Inputs the model does not
+      use (e.g. erc, fd) have zero derivatives.
+    - variables (list): Output series to differentiate (any series of Run_morquest, e.g. 'Ai', 'Vc', 'sedVd').
+    - years (list): Model years of the derivatives (default: all years).
+
+    Returns:
+    - tuple: (MorquestResult of the run, as Run_morquest with the python backend; DataFrame of derivatives with
+      one row per variable and year (index 'variable', 'year') and one column per parameter).
+    """
+    input = dict(input) if 'plottimeres' in input else morquest_set_input(**input)
+    params = list(params)
+    unknown = [name for name in params if name not in BATCH_KEYS]
+    if unknown:
+        raise ValueError(f"Cannot differentiate by {unknown}; parameters must be among {BATCH_KEYS}")
+    m = len(params)
+    seed = {name: np.eye(m)[k] for k, name in enumerate(params)}
+    zero = np.zeros(m)
+    dur = int(input['dur'])
+
+    # Forcing and its derivatives, as in Run_morquest
+    slr, slrr, slrst = Forcing.slr_forcing(input['slrtype'], scalar(input['slr']), dur, input.get('slrst'))
+    slr, slrr = np.asarray(slr, dtype=float), np.asarray(slrr, dtype=float)
+    if Forcing._definition(input['slrtype'])['scaled']:
+        unit_slr, unit_slrr = (np.asarray(x, dtype=float) for x in Forcing.slr_forcing(input['slrtype'], 1.0, dur,
+                                                                                         slrst)[:2])
+    else:
+        unit_slr, unit_slrr = np.zeros_like(slr), np.zeros_like(slrr)   #absolute curve, slr is ignored
+    d_slr = seed.get('slr', zero)
+
+    tt = np.arange(0, dur + 1, input['plottimeres'])
+    forcing = {}
+    for key, growth in (('Qr', 'fQr'), ('ssc', 'fssc')):
+        series = input.get(f'{key}_series')
+        if series is not None and (key in seed or growth in seed):
+            raise ValueError(f'{key} is given as a series; it cannot be differentiated by {key} or {growth}')
+        value, rate = scalar(input[key]), scalar(input[growth])
+        values = np.asarray(Forcing.river_forcing(series, value, rate, tt, input['plottimeres'], input.get('start')))
+        #value * (1 + growth * t) for linear growth
+        d_value = np.asarray(Forcing.river_forcing(None, 1.0, rate, tt, input['plottimeres'])) if series is None else 0 * tt
+        d_rate = value * tt if series is None else 0 * tt
+        forcing[key] = np.array([Dual(x, seed.get(key, zero) * a + seed.get(growth, zero) * b)
+                                 for x, a, b in zip(values, d_value, d_rate)], dtype=object)
+
+    # Kernel run on dual numbers
+    values = Kernel.pack_params(input)
+    p = np.array([Dual(x, seed.get(key, zero)) for key, x in zip(Kernel.PARAMS, values)], dtype=object)
+    slrr_d = np.array([Dual(x, d_slr * u) for x, u in zip(slrr, unit_slrr)], dtype=object)
+    S = np.full((len(Kernel.STATE), len(tt)), np.float64(0), dtype=object).view(_State)
+    Qssec = forcing['Qr'] * forcing['ssc']                              #sediment supply, kg/s
+    S[Kernel.QRC] = Qssec * 3600 * 24 * 365 / p[Kernel.P_RHO] / (1 - p[Kernel.P_POR])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        _run(p, S, slrr_d, forcing['Qr'], forcing['ssc'], slrst, dur, Kernel.new_counts(),
+             *Kernel.pack_events()[1])
+        _closing_balance(p, S, slrr_d, dur - 1)
+
+        state = _values(S)
+        result = MorquestResult(result_series(dict(zip(Kernel.STATE, state)), np.arange(0, dur + 1), slr, slrr,
+                                              _values(Qssec[None])[0]),
+                                result_meta(input), result_params(input))
+
+        # Derivative series: the outputs are linear in the state rows
+        grad = _gradients(S, m)
+        d_Qssec = _gradients(Qssec, m)
+        years = np.arange(dur + 1) if years is None else np.atleast_1d(years)
+        columns = {}
+        for k, name in enumerate(params):
+            series = result_series(dict(zip(Kernel.STATE, grad[:, :, k])), np.arange(0, dur + 1),
+                                   unit_slr * d_slr[k], unit_slrr * d_slr[k], d_Qssec[:, k])
+            columns[name] = np.concatenate([np.asarray(series[variable], dtype=float)[years] for variable in variables])
+    index = pd.MultiIndex.from_product([list(variables), years.tolist()], names=['variable', 'year'])
+    return result, pd.DataFrame(columns, index=index)
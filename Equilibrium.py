@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Equilibrium state of morQuest under constant sea level rise and sediment supply
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import numpy as np
+
+import Forcing
+import Kernel
+from morQuest import morquest_set_input, scalar, result_series, result_meta, result_params, MorquestResult, add_clamps
+
+# Under a constant sea level rise rate, river discharge and ssc, every state variable of the yearly loop ends up
+# either at rest (e.g. a drowned intertidal area, or Vc at Vceq + Ac*slrr/tr when tr > 0) or changing at a constant
+# rate (e.g. Vc growing with Ac*slrr when tr = 0). The model is run with a growing horizon (256, 512, ... years)
+# until all variables have settled for at least `window` years, up to the end of the run. The yearly forcing does
+# not depend on the horizon, so the yearly loop is continued on one growing state buffer, and each horizon only
+# adds its final step and closing balance on a copy: the run of each horizon is that of Run_morquest, but no year
+# is simulated twice. A variable is settled when:
+#   criterion 'state': yearly change |dX| <= rtol * max|X|
+#   criterion 'trend': the same, or constant yearly change |ddX| <= rtol * |dX| (dynamic equilibrium)
+# With solver='aitken' the yearly map is treated as a fixed-point iteration: once the ratio of successive changes of
+# a variable is constant (linear convergence), its limit is obtained by Aitken (Steffensen) extrapolation,
+# X* = X + dX * q / (1 - q), instead of integrating until the changes vanish.
+VARIABLES = ['Ai', 'Ac', 'Vc', 'Vi', 'Vd', 'Vs']
+
+
+def _analyze(x, rtol, criterion, aitken):
+    # Per year t (1..len(x)-1): settled flag, limit level and limit rate of one variable
+    with np.errstate(all='ignore'):
+        r = np.diff(x)
+        scale = np.maximum.accumulate(np.abs(x))[1:]
+        tol = rtol * scale + np.finfo(float).tiny
+        q = np.concatenate([[np.nan], np.diff(r)])
+        level, rate = x[1:].copy(), np.zeros(len(r))
+        static = np.abs(r) <= tol
+        settled = static.copy()
+        if aitken:
+            # Level converging linearly: constant ratio of successive changes below 1. A limit beyond zero is not
+            # reached (the clamps of the model stop the variable at zero first), except within the tolerance
+            ratio = np.concatenate([[np.nan], r[1:] / r[:-1]])
+            stable = np.abs(np.concatenate([[np.nan], np.diff(ratio)])) <= rtol
+            limit = x[1:] + r * ratio / (1 - ratio)
+            limit = np.where((limit * x[1:] < 0) & (np.abs(limit) <= tol), 0, limit)
+            converging = stable & (ratio >= 0) & (ratio < 1)
+            linear = ~settled & converging & (limit * x[1:] >= 0)
+            level = np.where(linear, limit, level)
+            settled |= linear
+        if criterion == 'trend':
+            # Constant yearly change, up to rtol of the change (plus rounding of the level)
+            trend = ~settled & (np.abs(q) <= rtol * np.abs(r) + 64 * np.finfo(float).eps * scale)
+            rate = np.where(trend, r, rate)
+            settled |= trend
+            if aitken:
+                # Rate converging linearly to a non-zero value (a level converging to a limit beyond zero is not)
+                ratio = np.concatenate([[np.nan], q[1:] / q[:-1]])
+                stable = np.abs(np.concatenate([[np.nan], np.diff(ratio)])) <= rtol
+                linear = ~settled & ~converging & stable & (ratio >= 0) & (ratio < 1)
+                rate = np.where(linear, r + q * ratio / (1 - ratio), rate)
+                settled |= linear
+    return settled, level, rate
+
+
+def settled_year(result, variables=VARIABLES, rtol=1e-6, window=10, criterion='trend', solver='integrate', years=None):
+    """
+    First year from which all variables of a run stay settled, for at least window years and until the end of the
+    run; the rest of the run confirms the (extrapolated) limits.
+
+    Parameters:
+    - result (MorquestResult): Single run.
+    - variables, rtol, window, criterion, solver: See equilibrium.
+    - years (int): Only consider the first years of the run (default: all).
+
+    Returns:
+    - tuple: (year, state, rates); year is -1 when the run has not settled, state and rates map each variable to
+      its (extrapolated) level and its yearly change at that year.
+    """
+    if criterion not in ('state', 'trend') or solver not in ('integrate', 'aitken'):
+        raise ValueError("criterion must be 'state' or 'trend' and solver 'integrate' or 'aitken'")
+    analysis = {key: _analyze(np.ravel(result[key])[:years], rtol, criterion, solver == 'aitken') for key in variables}
+    settled = np.logical_and.reduce([analysis[key][0] for key in variables])
+    if len(settled) < window or not settled[-window:].all():
+        return -1, {}, {}
+    t = len(settled) - int(np.argmin(settled[::-1])) if not settled.all() else 0     #start of the settled tail
+    t = t + window - 1                                                  #index into the yearly changes
+    return t + 1, {key: float(analysis[key][1][t]) for key in variables}, \
+        {key: float(analysis[key][2][t]) for key in variables}
+
+
+def equilibrium(input, rate=None, variables=VARIABLES, rtol=1e-6, window=10, criterion='trend', solver='integrate',
+                dur=256, max_dur=32768, backend='auto'):
+    """
+    Run morQuest under constant forcing until the state settles.
+
+    Parameters:
+    - input (dict): morquest_set_input dictionary (or its keyword values); river discharge and ssc must be constant
+      (fQr = fssc = 0, no series).
+    - rate (float): Sea level rise rate, m/yr (default: slr / dur of input).
+    - variables (list): State variables that must settle (any output series, e.g. 'Qci_at').
+    - rtol (float): Tolerance relative to the largest magnitude of each variable.
+    - window (int): Number of consecutive settled years required.
+    - criterion (str): 'state' (all variables at rest) or 'trend' (at rest or at a constant rate).
+    - solver (str): 'integrate', or 'aitken' to extrapolate linearly converging variables to their limit.
+    - dur (int): First horizon, doubled until the state settles or max_dur is exceeded.
+    - backend (str): Kernel backend, see Run_morquest.
+
+    Returns:
+    - dict: 'converged', 'year' (first settled year, -1 if none), 'state' and 'rates' (level and yearly change of
+      each variable, m2 or m3 and per year), 'result' (the run over the last horizon), 'runs' (horizons checked) and
+      'years' (simulated years, the last horizon).
+    """
+    input = dict(input) if 'plottimeres' in input else morquest_set_input(**input)
+    if scalar(input['fQr']) != 0 or scalar(input['fssc']) != 0 or input.get('Qr_series') is not None \
+            or input.get('ssc_series') is not None:
+        raise ValueError('An equilibrium needs constant river discharge and ssc (fQr = fssc = 0, no series)')
+    if rate is None:
+        if input['slrtype'] != 'linear':
+            raise ValueError("Give the sea level rise rate for slrtype other than 'linear'")
+        rate = scalar(input['slr']) / input['dur']
+
+    initialize, step, final_step = Kernel.get_step(backend)
+    params = Kernel.pack_params(input)
+    counts = Kernel.new_counts()
+    S, runs, done, itp = None, 0, 0, 1
+    with np.errstate(all='ignore'):
+        while True:
+            run = dict(input, slrtype='linear', slr=rate * dur, dur=dur, plottimeres=1, slrst=None)
+            slr, slrr, slrst = Forcing.slr_forcing('linear', rate * dur, dur)
+            slrr = np.asarray(slrr, dtype=float)
+            tt, dt = np.arange(0, dur + 1) * 1.0, np.ones(dur + 1)              #yearly steps
+            ssc = np.asarray(Forcing.river_forcing(None, scalar(input['ssc']), 0, tt, 1, input.get('start')))
+            Qr = np.asarray(Forcing.river_forcing(None, scalar(input['Qr']), 0, tt, 1, input.get('start')))
+            Qssec = Qr * ssc                                            #sediment supply, kg/s
+
+            # State buffer of the new horizon, holding the years computed so far
+            grown = Kernel.new_state(dur + 1)
+            grown[Kernel.QRC] = Qssec * 3600 * 24 * 365 / params[Kernel.P_RHO] / (1 - params[Kernel.P_POR])
+            if S is None:
+                initialize(params, grown, slrr, Qr, ssc)
+            else:
+                grown[:, :S.shape[1]] = S
+            S = grown
+            Ab = params[Kernel.P_AC] + params[Kernel.P_AI]              #basin area, m2
+            for yr in range(done, dur - 1):
+                itp = step(params, S, slrr, slrst, yr, itp, Ab, tt, dt, slrst + 1, counts)
+            done, runs = dur - 1, runs + 1
+
+            # Final step and closing balance of the horizon on a copy; the yearly loop goes on from S
+            last = S.copy()
+            final_step(params, last, slrr, slrst, dur - 1, tt, dt, counts.copy())
+            Kernel.closing_balance(params, last, slrr, dur - 1)
+            series = result_series(dict(zip(Kernel.STATE, last)), tt, slr, slrr, Qssec)
+            result = MorquestResult(series, result_meta(run), result_params(run))
+            year, state, rates = settled_year(result, variables, rtol, window, criterion, solver, years=dur)  #without final step
+            if year >= 0 or dur * 2 > max_dur:
+                add_clamps(counts)
+                return {'converged': year >= 0, 'year': year, 'state': state, 'rates': rates, 'result': result,
+                        'runs': runs, 'years': dur}
+            dur *= 2
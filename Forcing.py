@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Sea level rise and river forcing for the MorQuest model
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import functools
+import hashlib
+import itertools
+import json
+import os
+import sys
+import numpy as np
+
+# A forcing curve gives the sea level of every model year t = 0..dur, m. Curves are either
+#   scaled:    a shape multiplied by the slr of each scenario (the built-in 'linear', 'accel' and 'timep')
+#   absolute:  a fixed pathway (e.g. an IPCC projection) shared by every scenario; slr is then ignored
+# Every curve is computed once per (slrtype, dur, slrst) and kept read-only in _cache; a batch broadcasts an
+# absolute curve over its members without copying it.
+#
+# River forcing: Qr and ssc grow linearly from their initial value (fQr, fssc), or follow a time series given as
+# 'Qr_series' / 'ssc_series' (see river_forcing). Named series are registered with register_series; share_series
+# writes them to .npy files that worker processes map read-only instead of receiving copies.
+
+
+def _linear(t, dur, slrst):
+    # Constant rate, applied as slr / dur per year (the model's original linear forcing)
+    return np.ones(len(t) - 1)
+
+
+def _accel(t, dur, slrst):
+    # Sine ramp reaching slr after dur years
+    return np.sin(2 * np.pi / (4 * dur) * t - np.pi / 2) + 1
+
+
+def _timep(t, dur, slrst):
+    # No rise before slrst, then the sine ramp of a 100 yr quarter period (slr after 100 yr), held at its top
+    x = np.minimum(t - slrst + 1, 200)
+    return np.where(t >= slrst, np.sin(2 * np.pi / (4 * 100) * x - np.pi / 2) + 1, 0)
+
+
+def polynomial(t, dur, slrst, coefficients=(0, 1)):
+    """
+    Parametric curve c0 + c1 * t + c2 * t**2 + ... of the years since slrst (0 before), e.g. the NRC/IPCC
+    quadratic projections. Register it with fixed coefficients:
+    register_curve('nrc-high', functools.partial(polynomial, coefficients=(0, 0.0017, 1.56e-4))).
+    """
+    x = np.maximum(t - max(slrst, 0), 0)
+    return np.polynomial.polynomial.polyval(x, coefficients)
+
+
+#name -> definition; 'rate' marks a curve given as yearly increments of slr / dur instead of levels
+BUILTIN = {
+    'linear': {'function': _linear, 'scaled': True, 'rate': True, 'slrst': -1},
+    'accel': {'function': _accel, 'scaled': True, 'slrst': -1},
+    'timep': {'function': _timep, 'scaled': True, 'slrst': 200},
+}
+
+_registry = dict(BUILTIN)
+#River series: name -> {'years': years of the values, 'values': [T] or [N, T] array (possibly memory-mapped)}
+_series = {}
+_cache = {}
+_stats = {'hits': 0, 'misses': 0}
+
+
+def register_curve(name, curve, years=None, scaled=False, slrst=-1):
+    """
+    Make a sea level curve available as slrtype=name.
+
+    Parameters:
+    - name (str): slrtype of the curve.
+    - curve (array or callable): Sea level, m. An array holds one value per year from t = 0 (or per entry of
+      years); a callable f(t, dur, slrst) returns the levels of the model years t.
+    - years (array): Years of the array values (e.g. 2020, 2030, ...); the first is model year 0 and the curve
+      is interpolated linearly in between.
+    - scaled (bool): Multiply the curve by the slr of each scenario, after normalizing it to 1 at dur (as for
+      the built-in types). Otherwise the curve is absolute and slr is ignored.
+    - slrst (int): Default year the sea level starts rising, used by the adaptation of the intertidal area;
+      -1 means from the start.
+
+    Absolute curves are taken relative to their value at t = 0.
+    """
+    if name in BUILTIN:
+        raise ValueError(f"slrtype {name} is built in")
+    definition = {'scaled': bool(scaled), 'slrst': int(slrst)}
+    if callable(curve):
+        definition['function'] = curve
+    else:
+        values = np.asarray(curve, dtype=float).reshape(-1)
+        years = np.arange(len(values)) if years is None else np.asarray(years, dtype=float).reshape(-1)
+        if len(years) != len(values):
+            raise ValueError(f"Curve {name} has {len(values)} values for {len(years)} years")
+        definition['years'] = years - years[0]
+        definition['values'] = values
+    _registry[name] = definition
+    for key in [key for key in _cache if key[0] == name]:
+        del _cache[key]
+
+
+def load_pathways(path, year_column='Year', scaled=False, slrst=-1, start=None):
+    """
+    Register every column of a CSV file of sea level pathways (one row per year, one column per pathway, m).
+
+    Parameters:
+    - path (str): CSV file, e.g. with columns Year, SSP1-2.6, SSP2-4.5, SSP5-8.5.
+    - year_column (str): Column holding the calendar years.
+    - scaled, slrst: See register_curve.
+    - start (float): Calendar year of model year 0 (default: first year of the file).
+
+    Returns:
+    - list: The registered slrtype names.
+    """
+    import pandas as pd
+    df = pd.read_csv(path).sort_values(year_column)
+    if start is not None:
+        df = df[df[year_column] >= start]
+    names = [column for column in df.columns if column != year_column]
+    for name in names:
+        keep = df[name].notna()
+        register_curve(name, df.loc[keep, name], years=df.loc[keep, year_column], scaled=scaled, slrst=slrst)
+    return names
+
+
+def _definition(slrtype):
+    if slrtype not in _registry:
+        raise ValueError(f"Unknown slrtype {slrtype}; available: {list(_registry)}")
+    return _registry[slrtype]
+
+
+def slr_curve(slrtype, dur, slrst=None):
+    """
+    Cached unit curve of a slrtype over t = 0..dur.
+
+    Returns:
+    - tuple: (curve, slrst). curve is read-only: levels of length dur + 1 (yearly increments of length dur for
+      'linear'); per m of slr for scaled curves.
+    """
+    definition = _definition(slrtype)
+    dur = int(dur)
+    slrst = definition['slrst'] if slrst is None else int(slrst)
+    key = (slrtype, dur, slrst)
+    if key in _cache:
+        _stats['hits'] += 1
+        return _cache[key], slrst
+    _stats['misses'] += 1
+    if slrst >= dur:
+        raise ValueError(f"SLR start year slrst={slrst} is not within dur={dur}")
+    t = np.arange(dur + 1)
+    if 'function' in definition:
+        curve = np.asarray(definition['function'](t, dur, slrst), dtype=float)
+    else:
+        if definition['years'][-1] < dur:
+            raise ValueError(f"Curve {slrtype} covers {definition['years'][-1]:g} yr, the run needs {dur}")
+        curve = np.interp(t, definition['years'], definition['values'])
+    if slrtype not in BUILTIN:
+        curve = curve - curve[0]
+        if definition['scaled']:
+            curve = curve / curve[-1]
+    curve.flags.writeable = False
+    _cache[key] = curve
+    return curve, slrst
+
+
+def slr_forcing(slrtype, slr, dur, slrst=None):
+    """
+    Sea level and its yearly rise for one scenario or a batch.
+
+    Parameters:
+    - slrtype (str): Built-in ('linear', 'accel', 'timep') or registered curve name.
+    - slr (float or array): Sea level rise after dur years of every scenario, m (ignored by absolute curves).
+    - dur (int): Run length, yr.
+    - slrst (int): Year the sea level starts rising (default: that of the curve, 200 for 'timep').
+
+    Returns:
+    - tuple: (slr, slrr, slrst); slr and slrr have time as first axis and the shape of slr after it. For an
+      absolute curve they are read-only broadcast views of the cached curve.
+    """
+    curve, slrst = slr_curve(slrtype, dur, slrst)
+    definition = _registry[slrtype]
+    amplitude = np.asarray(slr, dtype=float)
+    if definition.get('rate'):
+        slrr = np.multiply.outer(curve, amplitude / int(dur))
+        return np.cumsum(slrr, axis=0), slrr, slrst
+    if definition['scaled']:
+        level = np.multiply.outer(curve, amplitude)
+        return level, np.diff(level, axis=0), slrst
+    rate = _cache.get((slrtype, 'rate', int(dur), slrst))
+    if rate is None:
+        rate = np.diff(curve)
+        rate.flags.writeable = False
+        _cache[(slrtype, 'rate', int(dur), slrst)] = rate
+    shape = amplitude.shape
+    return (np.broadcast_to(curve.reshape(curve.shape + (1,) * len(shape)), curve.shape + shape),
+            np.broadcast_to(rate.reshape(rate.shape + (1,) * len(shape)), rate.shape + shape), slrst)
+
+
+def cache_info():
+    # Number of cached curves and of cache hits and misses (curves computed) in this process
+    return dict(_stats, size=len(_cache))
+
+
+def clear_cache():
+    _cache.clear()
+    _stats.update(hits=0, misses=0)
+
+
+def definitions(names):
+    # Registered (non built-in) curves among names, to hand to register_definitions in another process
+    return {name: _registry[name] for name in dict.fromkeys(names) if name in _registry and name not in BUILTIN}
+
+
+def register_definitions(curves):
+    # Register curves from definitions() that this process does not know yet (a forked worker already has them)
+    for name, definition in curves.items():
+        if name not in _registry:
+            _registry[name] = definition
+
+
+def fingerprint(names):
+    """
+    Hash of the curves and registered river series behind the given names, so cached or resumed work notices a
+    re-registered one. Other values (None, arrays given directly) are skipped.
+    """
+    spec = {}
+    for name in sorted({name for name in names if isinstance(name, str)}):
+        if name in _series:
+            digest = hashlib.sha256(np.ascontiguousarray(_series[name]['values'], dtype=float).tobytes())
+            spec['series:' + name] = [digest.hexdigest(), _series[name]['years'].tolist()]
+            continue
+        definition = dict(_definition(name))
+        function = definition.pop('function', None)
+        if isinstance(function, functools.partial):
+            definition['function'] = [f'{function.func.__module__}.{function.func.__qualname__}', repr(function.args),
+                                      repr(sorted(function.keywords.items()))]
+        elif function is not None:
+            definition['function'] = f'{function.__module__}.{function.__qualname__}'
+        spec[name] = {key: np.asarray(value).tolist() for key, value in definition.items()}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def register_series(name, values, years=None):
+    """
+    Make a river discharge or sediment concentration series available as Qr_series=name / ssc_series=name.
+
+    Parameters:
+    - name (str): Series name.
+    - values (array, Series or str): One value per year from the first year, an [N, T] array of one series per
+      batch member, a pandas Series indexed by year (e.g. Hydrology_analysis.discharge_series), or the path of a
+      .npy file, which is memory-mapped read-only.
+    - years (array): Years of the values (default: the Series index, or 0, 1, 2, ...).
+    """
+    if _is_series(values):
+        years = values.index.to_numpy() if years is None else years
+        values = values.to_numpy()
+    if isinstance(values, str):
+        values = np.load(values, mmap_mode='r')
+    elif not isinstance(values, np.memmap):
+        values = np.array(values, dtype=float)
+        values.flags.writeable = False
+    years = np.arange(values.shape[-1]) if years is None else np.asarray(years, dtype=float).reshape(-1)
+    if len(years) != values.shape[-1]:
+        raise ValueError(f"Series {name} has {values.shape[-1]} values for {len(years)} years")
+    _series[name] = {'years': years, 'values': values}
+    for key in [key for key in _cache if key[0] == ('series', name)]:
+        del _cache[key]
+
+
+def share_series(names, folder):
+    """
+    Write the named series to folder/<name>.npy and map them read-only in this process.
+
+    Returns:
+    - dict: name -> (file, years), for register_shared in worker processes; name -> (values, years) when folder
+      is None, so the values are copied to the workers instead.
+    """
+    shared = {}
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+    for name in dict.fromkeys(name for name in names if isinstance(name, str)):
+        if name not in _series:
+            continue
+        definition = _series[name]
+        if folder is None:
+            shared[name] = (definition['values'], definition['years'])
+            continue
+        file = os.path.join(folder, f'{name}.npy')
+        if not (isinstance(definition['values'], np.memmap) and os.path.abspath(definition['values'].filename) == os.path.abspath(file)):
+            np.save(file + '.tmp.npy', np.asarray(definition['values'], dtype=float))
+            os.replace(file + '.tmp.npy', file)
+            register_series(name, file, definition['years'])
+        shared[name] = (file, definition['years'])
+    return shared
+
+
+def register_shared(shared):
+    # Register series from share_series that this process does not know yet (a forked worker already has them)
+    for name, (file, years) in shared.items():
+        if name not in _series:
+            register_series(name, file, years)
+
+
+def series_values(series, tt, start=None):
+    """
+    Values and years of a river series given directly, as register_series takes them.
+
+    Parameters:
+    - series: Array (per year from year 0, or [N, T] per batch member), pandas Series indexed by year, or callable
+      f(t) of the model times.
+    - tt (array): Model times, yr (a callable is evaluated there).
+    - start (float): Year of the series at model time 0, as in river_forcing.
+
+    Returns:
+    - tuple: (values, years) such that river_forcing of the registered name gives the forcing of series itself.
+    """
+    offset = 0.0 if start is None else float(start)
+    if _is_series(series):
+        return series.to_numpy(dtype=float), series.index.to_numpy(dtype=float)
+    if callable(series):
+        return np.asarray(series(tt), dtype=float).T, np.asarray(tt, dtype=float) + offset
+    if isinstance(series, (np.ndarray, list, tuple)):
+        values = np.asarray(series, dtype=float)
+        return values, np.arange(values.shape[-1], dtype=float) + offset
+    raise ValueError(f"Series of type {type(series).__name__} cannot be reused; give an array, Series, callable or name")
+
+
+def series_digest(series, tt, start=None):
+    # sha256 of the values and years of a river series given directly (see series_values), for cache keys
+    values, years = series_values(series, tt, start)
+    digest = hashlib.sha256(str(values.shape).encode())
+    digest.update(np.ascontiguousarray(values).tobytes())
+    digest.update(np.ascontiguousarray(years).tobytes())
+    return digest.hexdigest()
+
+
+def name_series(series, tt, start=None):
+    """
+    Register a river series given directly under a name derived from its values, so that work split over processes
+    (run_sweep) can refer to it by name and share it like any registered series.
+
+    Parameters:
+    - series: None, a series name (both returned unchanged) or a series as in series_values.
+    - tt (array): Model times, yr.
+    - start (float): Year of the series at model time 0.
+
+    Returns:
+    - str: Series name.
+    """
+    if series is None or isinstance(series, str):
+        return series
+    name = 'series-' + series_digest(series, tt, start)[:16]
+    if name not in _series:
+        register_series(name, *series_values(series, tt, start))
+    return name
+
+
+def _is_series(value):
+    # pandas Series check without importing pandas: a process that has not loaded pandas holds no Series
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(value, pd.Series)
+
+
+def _resample(years, values, t):
+    # Linear interpolation of [T] or [N, T] values given at years onto the model times t; time first in the result
+    if years[0] > t[0] or years[-1] < t[-1]:
+        raise ValueError(f"Series covers years {years[0]:g} to {years[-1]:g}, the run needs {t[0]:g} to {t[-1]:g}")
+    values = np.asarray(values, dtype=float)
+    k = np.searchsorted(years, t)
+    if np.array_equal(years[np.minimum(k, len(years) - 1)], t):
+        return values[..., k].T                                         #model times are data years
+    k = np.clip(k, 1, len(years) - 1)
+    w = (t - years[k - 1]) / (years[k] - years[k - 1])
+    return (values[..., k - 1] * (1 - w) + values[..., k] * w).T
+
+
+def river_forcing(series, value, growth, tt, resolution=1, start=None):
+    """
+    River discharge or sediment concentration at the model times.
+
+    Parameters:
+    - series: None for linear growth from value; otherwise a registered series name, array (per year from year 0,
+      or [N, T] per batch member), pandas Series indexed by (calendar) year, callable f(t) of the model times, or
+      iterator yielding one value per model time step.
+    - value (float or array): Initial value of every scenario (linear growth only).
+    - growth (float or array): Yearly growth as a fraction of the initial value (linear growth only).
+    - tt (array): Model times, yr.
+    - resolution (float): Model time step, yr.
+    - start (float): Year of the series at model time 0 (default: its first year).
+
+    Returns:
+    - ndarray: [T] values, or [T, N] when value is an array. A series shared by all scenarios of a batch is a
+      read-only broadcast view.
+    """
+    value = np.asarray(value, dtype=float)
+    if series is None:
+        #Qr[i+1] = Qr[i] + Qr[0] * fQr * resolution
+        step = value * np.asarray(growth, dtype=float) * resolution
+        steps = np.broadcast_to(step, (len(tt) - 1,) + value.shape)
+        return np.cumsum(np.concatenate([value[None], steps]), axis=0)
+
+    if isinstance(series, str):
+        key = (('series', series), len(tt), float(resolution), start)
+        out = _cache.get(key)
+        if out is None:
+            if series not in _series:
+                raise ValueError(f"Unknown series {series}; available: {list(_series)}")
+            years = _series[series]['years']
+            out = _resample(years - (years[0] if start is None else start), _series[series]['values'], tt)
+            out.flags.writeable = False
+            _cache[key] = out
+    elif _is_series(series):
+        years = series.index.to_numpy(dtype=float)
+        out = _resample(years - (years[0] if start is None else start), series.to_numpy(dtype=float), tt)
+    elif callable(series):
+        out = np.asarray(series(tt), dtype=float)
+    elif isinstance(series, (np.ndarray, list, tuple)):
+        out = _resample(np.arange(np.shape(series)[-1], dtype=float), series, tt)
+    else:
+        out = np.fromiter(itertools.islice(series, len(tt)), dtype=float, count=len(tt))
+
+    if out.ndim == 1 and value.ndim:
+        return np.broadcast_to(out[:, None], (len(tt),) + value.shape)
+    if out.ndim > 1 and out.shape[1:] != value.shape:
+        raise ValueError(f"Series for {out.shape[1:]} scenarios, the run has {value.shape}")
+    return out
@@ -27,22 +27,33 @@
 # building the stack.
 # mreyec@uni.pe
 
-import matplotlib.pyplot as plt
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
 import math
+import os
 
-def analyze_hydrology(selection):
-    # Read hydrological data
-    HH = np.genfromtxt(f"Data/hydrology/{selection}.txt", skip_header=36)
-    df = DataFrame(HH, columns=['USGS', 'CODE', 'CODE_P', 'C', 'Year', 'Q'])
+import Instrument
 
-    # Global Data
-    Q_cov = df['Q'] * 0.0283168466
-    Qmax = Q_cov.max()
-    mean = np.mean(Q_cov)
-    mean_r = round(mean, 2)
+def read_hydrology(selection, data_dir='Data/Hydrology'):
+    # USGS annual statistics of an estuary: one row per year, mean discharge Q in ft3/s
+    HH = np.genfromtxt(os.path.join(data_dir, f"{selection}.txt"), skip_header=36)
+    Instrument.add_file('bytes_read.hydrology', os.path.join(data_dir, f"{selection}.txt"))
+    return DataFrame(HH, columns=['USGS', 'CODE', 'CODE_P', 'C', 'Year', 'Q'])
+
+def hydrology(selection, data_dir='Data/Hydrology'):
+    """
+    Mean river discharge of an estuary around the years of the intertidal area data, without plotting.
+
+    Parameters:
+    - selection (str): Estuary name, e.g. 'Alsea_bay'.
+    - data_dir (str): Folder holding the USGS files.
+
+    Returns:
+    - tuple: (df, s_values); df holds the yearly record with its 3-year centered mean Mean_Q (ft3/s), s_values
+      the Year and Mean_Q of the selected years.
+    """
+    df = read_hydrology(selection, data_dir)
 
     # Calculate the mean discharge for the same years as intertidal area
     window_size = 3
@@ -50,14 +61,19 @@ def analyze_hydrology(selection):
     y_sele = np.arange(1985, 2017, 3)
     s_values = df.loc[df['Year'].isin(y_sele), ['Year', 'Mean_Q']]
     s_values.reset_index(drop=True, inplace=True)
+    return df, s_values
 
+def plot_hydrology(df, s_values, selection, file=None):
+    # Record and selected-year discharge figure; saved to file (default results/00_Input_Qr_<selection>.png) and closed
+    import matplotlib.pyplot as plt
+    Q_cov = df['Q'] * 0.0283168466
+    Qmax = Q_cov.max()
+    mean = np.mean(Q_cov)
+    mean_r = round(mean, 2)
     Qm = s_values['Mean_Q'] * 0.0283168466
     mean_m = np.mean(Qm)
     mean_r_m = round(mean_m, 2)
 
-    # Save data to CSV
-    Qm.to_csv(f'results/00_Input_Qr_{selection}.csv', index=False)
-
     # Plot data
     y = np.arange(1984, 2015, 1)
     xmax = math.ceil(df['Year'].max())
@@ -89,6 +105,35 @@ def analyze_hydrology(selection):
     plt.grid(True)
     plt.legend(loc='upper right', ncol=1, prop={'size': 14}, fancybox=True)
 
-    plt.savefig(f"results/00_Input_Qr_{selection}.png", bbox_inches='tight')
+    file = file or f"results/00_Input_Qr_{selection}.png"
+    fig.savefig(file, bbox_inches='tight')
+    plt.close(fig)
+    return file
+
+@Instrument.timed('analyze.hydrology')
+def analyze_hydrology(selection, plot=True):
+    # Compute, save the selected-year discharge to results/00_Input_Qr_<selection>.csv and (optionally) plot
+    df, s_values = hydrology(selection)
+
+    # Save data to CSV
+    Qm = s_values['Mean_Q'] * 0.0283168466
+    Qm.to_csv(f'results/00_Input_Qr_{selection}.csv', index=False)
+
+    if plot:
+        plot_hydrology(df, s_values, selection)
 
     return s_values
+
+def discharge_series(selection, data_dir='Data/Hydrology'):
+    """
+    Annual mean river discharge of an estuary, ready to drive the model (morquest_set_input(Qr_series=...)).
+
+    Parameters:
+    - selection (str): Estuary name, e.g. 'Alsea_bay'.
+    - data_dir (str): Folder holding the USGS annual statistics files <selection>.txt.
+
+    Returns:
+    - Series: Discharge in m3/s indexed by year.
+    """
+    df = read_hydrology(selection, data_dir)
+    return pd.Series(df['Q'].to_numpy() * 0.0283168466, index=df['Year'].to_numpy().astype(int), name='Qr')
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Opt-in timers and counters of the model, the loaders and the pipeline
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import json
+import os
+import time
+from contextlib import nullcontext
+
+# Instrumentation is off unless enable() is called or the environment variable MORQUEST_METRICS is set (also for
+# the workers of a process pool, which inherit it). When off, timer() returns a shared no-op context manager and
+# add() returns at once, so the instrumented code runs as before. When on, the process collects:
+#   timers    name -> calls, total and largest wall time (e.g. 'run.loop', 'analyze.hydrology', 'stage.tidal')
+#   counters  name -> value (e.g. 'clamp.dVc' for the clamps of Kernel.CLAMPS, 'bytes_read.loader')
+# Work done in pool workers is collected by running the worker function through task() and passing every result
+# through gather(), which adds the metrics of the worker to this process:
+#   results = map(Instrument.gather, pool.map(Instrument.task(function), jobs))
+_state = {'enabled': os.environ.get('MORQUEST_METRICS', '') not in ('', '0')}
+_timers = {}                                    #name -> [calls, total s, max s]
+_counters = {}                                  #name -> value
+_NULL = nullcontext()
+
+
+def enable(on=True):
+    _state['enabled'] = bool(on)
+
+
+def enabled():
+    return _state['enabled']
+
+
+def reset():
+    _timers.clear()
+    _counters.clear()
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = _timers.setdefault(self.name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+
+def timer(name):
+    # Context manager timing a block as name
+    return _Timer(name) if _state['enabled'] else _NULL
+
+
+def timed(name):
+    # Decorator timing every call of a function as name
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = function.__name__, function.__doc__, function
+        return wrapper
+    return decorate
+
+
+def add(name, value=1):
+    # Increment counter name
+    if _state['enabled']:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def add_file(name, path):
+    # Add the size of a file read or written to counter name (e.g. 'bytes_written.result')
+    if _state['enabled'] and path and os.path.exists(path):
+        add(name, os.path.getsize(path))
+
+
+def snapshot():
+    """
+    Metrics collected by this process.
+
+    Returns:
+    - dict: 'timers' (name -> calls, total_s, max_s) and 'counters' (name -> value).
+    """
+    return {'timers': {name: {'calls': calls, 'total_s': total, 'max_s': peak}
+                       for name, (calls, total, peak) in sorted(_timers.items())},
+            'counters': dict(sorted(_counters.items()))}
+
+
+def merge(metrics):
+    # Add a snapshot (e.g. of a worker process) to the metrics of this process
+    for name, entry in metrics['timers'].items():
+        own = _timers.setdefault(name, [0, 0.0, 0.0])
+        own[0] += entry['calls']
+        own[1] += entry['total_s']
+        own[2] = max(own[2], entry['max_s'])
+    for name, value in metrics['counters'].items():
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class _Measured:
+    # Result of a worker task with the metrics it collected
+    def __init__(self, result, metrics):
+        self.result = result
+        self.metrics = metrics
+
+
+class _Task:
+    # Picklable wrapper running a function in a worker with instrumentation on
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        enable()
+        reset()
+        result = self.function(*args, **kwargs)
+        return _Measured(result, snapshot())
+
+
+def task(function):
+    # function for a process pool: unchanged when instrumentation is off, else returning its worker metrics too
+    return _Task(function) if _state['enabled'] else function
+
+
+def gather(value):
+    # Result of a pool task; merges the metrics of the worker when the task was wrapped by task()
+    if isinstance(value, _Measured):
+        merge(value.metrics)
+        return value.result
+    return value
+
+
+def to_json(path=None):
+    """
+    Metrics as JSON text.
+
+    Parameters:
+    - path (str): Also write them to this file.
+
+    Returns:
+    - str: The JSON text.
+    """
+    text = json.dumps(snapshot(), indent=1)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
+
+
+def to_prometheus(prefix='morquest'):
+    """
+    Metrics in the Prometheus text exposition format.
+
+    Timers become <prefix>_seconds_total, <prefix>_calls_total and <prefix>_seconds_max with a 'name' label; a
+    counter 'group.name' becomes <prefix>_<group>_total{name="name"}.
+
+    Returns:
+    - str: The exposition text.
+    """
+    metrics = snapshot()
+    lines = []
+    for metric, key, kind in (('seconds_total', 'total_s', 'counter'), ('calls_total', 'calls', 'counter'),
+                              ('seconds_max', 'max_s', 'gauge')):
+        if metrics['timers']:
+            lines.append(f'# TYPE {prefix}_{metric} {kind}')
+        for name, entry in metrics['timers'].items():
+            lines.append(f'{prefix}_{metric}{{name="{name}"}} {entry[key]:.9g}')
+    groups = {}
+    for name, value in metrics['counters'].items():
+        group, _, label = name.partition('.')
+        groups.setdefault(group, []).append((label, value))
+    for group, values in groups.items():
+        lines.append(f'# TYPE {prefix}_{group}_total counter')
+        for label, value in values:
+            lines.append(f'{prefix}_{group}_total{{name="{label}"}} {value:.9g}' if label else
+                         f'{prefix}_{group}_total {value:.9g}')
+    return '\n'.join(lines) + '\n'
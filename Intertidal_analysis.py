@@ -27,34 +27,43 @@
 # building the stack.
 # mreyec@uni.pe
 
-import geopandas as gpd
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import math
 
-def analyze_intertidal_area(shapefile_path, selection):
-    # Read the data from Shapefile
-    data = gpd.read_file(shapefile_path, encoding='utf-8')
+import Instrument
+import Loader
 
-    # Filter data for the selected estuary
-    data_selection = data[data['Est'] == selection]
+def intertidal_area(shapefile_path, selection):
+    """
+    Intertidal area of an estuary per year, without plotting.
 
-    # Group the data and calculate sum of areas
-    analysis = data_selection.groupby(['Est', 'Year'])['area'].sum() / 1000000
-    df1 = pd.DataFrame(analysis).reset_index()
+    Parameters:
+    - shapefile_path (str): Intertidal area shapefile.
+    - selection (str): Estuary name, e.g. 'Alsea_bay'.
 
+    Returns:
+    - DataFrame: Columns Est, Year and area (km2).
+    """
+    # Sum of areas per estuary and year, read from the attribute table (cached, see Loader.py)
+    analysis = Loader.intertidal_areas(shapefile_path)
+    return analysis[analysis['Est'] == selection].reset_index(drop=True)
+
+def plot_intertidal_area(df1, shapefile_path, selection, file=None):
+    # Map and bar chart of the intertidal evolution; saved to file (default
+    # results/00_Input_Intertidal_Area_<selection>.png) and closed. The map needs geopandas
+    import matplotlib.pyplot as plt
     ymax = math.ceil(df1['area'].max()) + 2
     coefficients = np.polyfit(df1['Year'], df1['area'], 1)
     slope = coefficients[0]
     intercept = coefficients[1]
     trendline = slope * df1['Year'] + intercept
-    df1.to_csv(f'results/00_Input_Intertidal_Area_{selection}.csv', index=False)
 
     # Plot colormap
-    colormap = plt.cm.get_cmap('viridis', len(df1['Year'].unique()))
+    colormap = plt.get_cmap('viridis', len(df1['Year'].unique()))
 
     # Plot intertidal evolution
+    data_selection = Loader.read_shapes(shapefile_path, selection)
     fig, axes = plt.subplots(nrows=1, ncols=2, figsize=(15, 6))
     for idx, year in enumerate(df1['Year'].unique()[::-1]):
         subset = data_selection[data_selection['Year'] == year]
@@ -78,6 +87,16 @@ def analyze_intertidal_area(shapefile_path, selection):
     for x, y in zip(df1['Year'], df1['area']):
         plt.text(x, y, '{:.2f}'.format(y), ha='center', va='bottom')
 
-    plt.savefig(f"results//00_Input_Intertidal_Area_{selection}.png", bbox_inches='tight')
+    file = file or f"results/00_Input_Intertidal_Area_{selection}.png"
+    fig.savefig(file, bbox_inches='tight')
+    plt.close(fig)
+    return file
 
+@Instrument.timed('analyze.intertidal')
+def analyze_intertidal_area(shapefile_path, selection, plot=True):
+    # Compute, save the yearly areas to results/00_Input_Intertidal_Area_<selection>.csv and (optionally) plot
+    df1 = intertidal_area(shapefile_path, selection)
+    df1.to_csv(f'results/00_Input_Intertidal_Area_{selection}.csv', index=False)
+    if plot:
+        plot_intertidal_area(df1, shapefile_path, selection)
     return df1
\ No newline at end of file
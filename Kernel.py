@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Yearly time-step kernel of the MorQuest model
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+# The kernel works on a flat float64 parameter vector and one preallocated state buffer of shape
+# [len(STATE), dur + 1] (one row per variable). It is plain Python restricted to what numba can compile,
+# so the same source serves as the pure-Python reference and, when numba is installed, as the compiled
+# backend. Select it with Run_morquest(..., backend='python' | 'numba' | 'auto'). The same source also runs on
+# arrays, with the N scenarios of Run_morquest_batch along a last axis of the parameters and of the state buffer.
+#
+# Column k of the buffer is the state at time tt[k]; step k advances it by dt[k] years (one year in Run_morquest,
+# variable in Adaptive.py). slrr[k] is the sea level rise over step k. The transports (Q rows) and the height-width
+# terms are rates per year, multiplied by dt[k] where they enter the volume changes of step k.
+#
+# Powers and exponentials go through libm in both backends: x ** y on numpy scalars and math.exp, which numba
+# compiles to the same libm calls. numpy's power and exp ufuncs use their own SIMD code on some CPUs (AVX-512),
+# which differs from libm in the last bit, so the two backends agree bit for bit.
+
+import math
+import warnings
+import numpy as np
+
+#Flat parameter vector
+PARAMS = ['Ac', 'Ai', 'dH', 'incAi', 'tr', 'lsys', 'cl', 'Vout', 'betas', 'cd', 'du', 'ecs', 'fis', 'si', 'fs', 'faw',
+          'por', 'rho', 'T']
+P_AC, P_AI, P_DH, P_INCAI, P_TR, P_LSYS, P_CL, P_VOUT, P_BETAS, P_CD, P_DU, P_ECS, P_FIS, P_SI, P_FS, P_FAW, \
+    P_POR, P_RHO, P_T = range(len(PARAMS))
+
+#Rows of the state buffer
+STATE = ['dAi_wh', 'dAi_sl', 'dAi', 'dAc', 'dVc_wh', 'dVc_sl', 'dVc', 'dVi_wh', 'dVi_sl', 'dVi', 'dVi_sed_wh',
+         'dVi_sed_sl', 'dVi_sed', 'dVs', 'dVd', 'dVout', 'erc', 'ds', 'dBr', 'Ai', 'Ac', 'Vr', 'Vc', 'Vi', 'Vi_sed',
+         'Vs', 'Vd', 'Vout', 'hc', 'hcod', 'hi', 'hiod', 'P', 'Vceq', 'at', 'Qrc', 'Qri', 'Qcieq', 'Qci', 'Qci_at',
+         'Qcdeq', 'Qcd', 'Qcs', 'Qsd', 'Qco', 'Qdo', 'Qso']
+(DAI_WH, DAI_SL, DAI, DAC, DVC_WH, DVC_SL, DVC, DVI_WH, DVI_SL, DVI, DVI_SED_WH, DVI_SED_SL, DVI_SED, DVS, DVD, DVOUT,
+ ERC, DS, DBR, AI, AC, VR, VC, VI, VI_SED, VS, VD, VOUT, HC, HCOD, HI, HIOD, P, VCEQ, AT, QRC, QRI, QCIEQ, QCI,
+ QCI_AT, QCDEQ, QCD, QCS, QSD, QCO, QDO, QSO) = range(len(STATE))
+
+#Clamps of the loop, counted per step in which they act (see Instrument.py): negative volume changes cut to the
+#volume, the drowned intertidal branch (itp), emptied volumes, and the sedVi clamp of the final step
+CLAMPS = ['dAi', 'dAc', 'dVc', 'dVi', 'dVs', 'dVd', 'dVout', 'drowned', 'Vout', 'Vs', 'Vi', 'Vc', 'dVi_sed']
+(C_DAI, C_DAC, C_DVC, C_DVI, C_DVS, C_DVD, C_DVOUT, C_DROWNED, C_VOUT, C_VS, C_VI, C_VC, C_DVI_SED) = range(len(CLAMPS))
+
+#Empirical equilibrium relations, see Eysink 1990
+VCA = 65e-6
+VCE = 1.5
+VDA = 2.9e-3
+VDE = 1.23
+YEAR = 365 * 24 * 3600
+EXP_MAX = math.log(np.finfo(float).max)               #largest argument with a finite exp
+
+
+def pack_params(input):
+    # Flat float64 parameter vector from a morquest_set_input dictionary (length-1 arrays/Series are accepted)
+    return np.array([np.asarray(input[key], dtype=float).reshape(-1)[0] for key in PARAMS])
+
+
+def new_state(n):
+    return np.zeros((len(STATE), n))
+
+
+def new_counts():
+    return np.zeros(len(CLAMPS), dtype=np.int64)
+
+
+#Built-in events: name -> (state variable, comparison, threshold)
+EVENTS = {'drowned': ('Ai', '<=', 0),                  #intertidal area lost
+          'channel_empty': ('Vc', '<=', 0),            #channel filled in
+          'shore_exhausted': ('Vs', '<=', 0)}          #shoreline volume used up
+OPS = ['<=', '>=', '<', '>']
+
+
+def pack_events(events=None, stop=None):
+    """
+    Event table for the kernel.
+
+    Parameters:
+    - events (list or dict): Built-in event names (see EVENTS) and/or a dict name -> (state variable, comparison,
+      threshold), e.g. {'half_Ai': ('Ai', '<=', 2.5e6)}. Any row of STATE can be used.
+    - stop (list or bool): Events that end the run; True stops at the first event. Stop events need not be listed
+      in events.
+
+    Returns:
+    - tuple: Event names, and the arrays (state rows, comparison codes, thresholds, stop flags, first years) passed
+      to the kernel; first years start at -1 (not reached).
+    """
+    spec = {}
+    for name in (events.items() if isinstance(events, dict) else (events or [])):
+        name, definition = name if isinstance(name, tuple) else (name, None)
+        spec[name] = definition if definition is not None else EVENTS.get(name)
+    stops = list(spec) if stop is True else list(stop or [])
+    for name in stops:
+        spec.setdefault(name, EVENTS.get(name))
+    for name, definition in spec.items():
+        if definition is None:
+            raise ValueError(f"Unknown event {name!r}; built-in events are {list(EVENTS)}")
+        variable, op, value = definition
+        if variable not in STATE or op not in OPS:
+            raise ValueError(f"Event {name!r}: variable must be one of STATE and comparison one of {OPS}")
+    names = list(spec)
+    return names, (np.array([STATE.index(spec[name][0]) for name in names], dtype=np.int64),
+                   np.array([OPS.index(spec[name][1]) for name in names], dtype=np.int64),
+                   np.array([spec[name][2] for name in names], dtype=float),
+                   np.array([name in stops for name in names], dtype=np.bool_),
+                   np.full(len(names), -1, dtype=np.int64))
+
+
+def _select(condition, a, b):
+    return a if condition else b
+
+
+def _count(condition):
+    return 1 if condition else 0
+
+
+def _power(x, y):
+    return x ** y
+
+
+def _exp(x):
+    # libm exp; inf past EXP_MAX, where math.exp raises (the compiled one returns inf)
+    return math.inf if x > EXP_MAX else math.exp(x)
+
+
+def _exp_array(x):
+    # _exp of every value of an array
+    x = np.asarray(x, dtype=float)
+    over = x > EXP_MAX
+    values = np.fromiter(map(math.exp, np.where(over, 0.0, x).ravel().tolist()), float, x.size).reshape(x.shape)
+    values[over] = math.inf
+    return values
+
+
+#Operations of the kernel on single values (python and numba) and on arrays of scenarios (Run_morquest_batch):
+#select(condition, a, b), count(condition), power(x, y) and exp(x). np.float_power and _exp_array call libm per
+#value, like x ** y and math.exp, so that every member of a batch equals its single run bit for bit
+SCALAR_OPS = (_select, _count, _power, _exp)
+ARRAY_OPS = (np.where, np.count_nonzero, np.float_power, _exp_array)
+
+
+def _make_kernel(jit, ops=SCALAR_OPS):
+    # The branches of the loop are written as select(condition, a, b), which takes a or b per scenario on arrays;
+    # the clamps are counted with count(condition) and only applied where they act. ops can also be replaced to run
+    # other number types (see Derivatives.py)
+    select, count, power, exp = (jit(op) for op in ops)
+
+    @jit
+    def initialize(p, S, slrr, Qr, ssc):
+        # Initial parameter values; row QRC must already hold the yearly river sediment supply
+        dH = p[P_DH]
+        S[AI, 0] = p[P_AI]
+        S[VR, 0] = Qr[0] * ssc[0]                                   #river sediment volume inflow
+        S[VI, 0] = 0.5 * p[P_AI] * dH                               #intertidal water volume, m3
+        S[VI_SED, 0] = S[VI, 0]                                     #intertidal area sediment volume, m3
+        S[P, 0] = dH * p[P_AC] + S[VI, 0]                           #tidal prism, m3
+        S[VCEQ, 0] = VCA * power(S[P, 0], VCE)                      #equilibrium channel water volume, m3
+        S[VC, 0] = S[VCEQ, 0]                                       #initial channel water volume, m3
+        S[VD, 0] = VDA * power(S[P, 0], VDE)                        #delta sediment volume, m3
+        S[HI, 0] = S[VI, 0] / p[P_AI]                               #mean water depth at intertidal area, m
+        S[HC, 0] = S[VC, 0] / p[P_AC]                               #mean water depth in channel area, m
+        S[AC, 0] = p[P_AC]
+        S[VS, 0] = 1.5 * p[P_CL] * 0.5 * (p[P_CD] * p[P_CD]) / p[P_BETAS]
+        S[VOUT, 0] = p[P_VOUT]
+        S[AT, 0] = p[P_T] * p[P_LSYS] / dH / YEAR                   #adaptation timescale, yr
+        S[QCIEQ, 0] = slrr[0] * S[AI, 0]                            #channel-intertidal transport to keep up with SLR
+        S[QCS, 0] = S[QRC, 0]                                       #sedtransport channel-shore /yr, m3
+        S[QSO, 0] = S[QRC, 0]                                       #sedtransport shore-out /yr, m3
+
+    @jit
+    def clamp(S, change, volume, yr, counts, c):
+        # Change of step yr cut to minus the volume (no negative volumes), counted as clamp c
+        cut = S[change, yr] <= -S[volume, yr]
+        cuts = count(cut)
+        counts[c] += cuts
+        if cuts > 0:
+            S[change, yr] = select(cut, -S[volume, yr], S[change, yr])
+
+    @jit
+    def fluxes(p, S, slrr, yr, dt, counts):
+        dH = p[P_DH]
+        Ai = S[AI]
+        Ac = S[AC]
+        h = dt[yr]
+        S[DAI_SL, yr] = -slrr[yr] * Ai[yr] / dH / p[P_SI]
+        S[DAI, yr] = p[P_INCAI] * h * Ai[max(1, yr - 1)]                                                          + S[DAI_SL, yr] + S[DAI_WH, yr] * h
+        S[DAC, yr] =                                                                                                - S[DAI_SL, yr] - S[DAI_WH, yr] * h
+        S[DVC_SL, yr] = -dH * S[DAI_SL, yr] * 0.5 * (1 - slrr[yr] / dH) + (Ac[yr] - S[DAI, yr]) * slrr[yr]
+        S[DVC, yr] = -S[QRC, yr] * h + S[QCI_AT, yr] * h + S[QCD, yr] * h + S[QCS, yr] * h + S[QCO, yr] * h       + S[DVC_SL, yr] + S[DVC_WH, yr] * h
+        S[DVI_SL, yr] = dH * S[DAI_SL, yr] * (1 - 0.5 * slrr[yr] / dH) + (Ai[yr] + S[DAI, yr]) * slrr[yr]
+        S[DVI, yr] = -S[QCI_AT, yr] * h                                                                            + S[DVI_SL, yr] + S[DVI_WH, yr] * h
+        S[DVI_SED_SL, yr] = -Ai[yr] * slrr[yr] + 0.5 * S[DAI, yr] * slrr[yr]
+        S[DVI_SED, yr] = S[QCI_AT, yr] * h                                                                         + S[DVI_SED_SL, yr] + S[DVI_SED_WH, yr] * h
+
+        S[DVS, yr] = S[QCS, yr] * h - S[QSD, yr] * h - S[QSO, yr] * h
+        S[DVD, yr] = S[QCD, yr] * h + S[QSD, yr] * h - S[QDO, yr] * h
+        S[DVOUT, yr] = S[QCO, yr] * h + S[QDO, yr] * h + S[QSO, yr] * h
+
+        S[DS, yr] = S[DVS, yr] / (p[P_CL] * p[P_CD])
+        S[DBR, yr] = -slrr[yr] * p[P_CD] / p[P_BETAS] / (p[P_CD] + p[P_DU])    #Bruun rule
+
+        # Prevent negative volumes
+        clamp(S, DAI, AI, yr, counts, C_DAI)
+        clamp(S, DAC, AC, yr, counts, C_DAC)
+        clamp(S, DVC, VC, yr, counts, C_DVC)
+        clamp(S, DVI, VI, yr, counts, C_DVI)
+
+    @jit
+    def clamp_outer(S, yr, counts):
+        clamp(S, DVS, VS, yr, counts, C_DVS)
+        clamp(S, DVD, VD, yr, counts, C_DVD)
+        clamp(S, DVOUT, VOUT, yr, counts, C_DVOUT)
+
+    @jit
+    def advance(S, yr, dt):
+        S[AI, yr + 1] = S[AI, yr] + S[DAI, yr]
+        S[AC, yr + 1] = S[AC, yr] + S[DAC, yr]
+        S[VR, yr + 1] = S[VR, yr] + S[QRC, yr] * dt[yr]
+        S[VC, yr + 1] = S[VC, yr] + S[DVC, yr]
+        S[VI, yr + 1] = S[VI, yr] + S[DVI, yr]
+        S[VI_SED, yr + 1] = S[VI_SED, yr] + S[DVI_SED, yr]
+        S[VS, yr + 1] = S[VS, yr] + S[DVS, yr]
+        S[VD, yr + 1] = S[VD, yr] + S[DVD, yr]
+        S[VOUT, yr + 1] = S[VOUT, yr] + S[DVOUT, yr]
+
+    @jit
+    def river_intertidal(p, S, yr, dt):
+        # Share of the change in river supply over the step, per year
+        change = S[QRC, yr + 1] - S[QRC, yr]
+        S[QRI, yr + 1] = select(S[QRC, yr + 1] >= S[QRC, yr], p[P_FIS] * change / dt[yr],
+                                p[P_FAW] * p[P_FIS] * change / dt[yr])
+
+    @jit
+    def adaptation(p, S, yr, slrst, tt):
+        ## Update of the equation of Adaptation Time Scale
+        depth = S[HI, yr + 1] / S[HI, 0]
+        S[AT, yr + 1] = depth * depth * p[P_T] * p[P_LSYS] / p[P_DH] / YEAR
+        if tt[yr] - slrst >= 0:
+            S[QCI_AT, yr + 1] = select(S[AT, yr + 1] != 0,
+                                       S[QCIEQ, yr] * (1 - exp(-(tt[yr] - slrst) / S[AT, yr + 1])), S[QCIEQ, yr])
+        else:
+            S[QCI_AT, yr + 1] = 0
+
+    @jit
+    def transports(p, S, yr, dt):
+        S[QCI, yr + 1] = S[QCI_AT, yr + 1] + S[QRI, yr + 1]
+        S[QCDEQ, yr + 1] = (VDA * power(S[P, yr + 1], VDE) - VDA * power(S[P, yr], VDE)) / dt[yr]
+        S[QCD, yr + 1] = S[QCDEQ, yr + 1]
+        S[QCS, yr + 1] = (1 - S[ERC, yr + 1]) * S[QRC, yr + 1] - p[P_FIS] * S[QRI, yr + 1] + p[P_TR] * (S[VCEQ, yr + 1] - S[VC, yr + 1])
+
+    @jit
+    def shore_exchange(p, S, yr):
+        # entrapment in shore for positive and for negative Qcs
+        S[QSO, yr + 1] = select(S[QCS, yr + 1] >= 0, (1 - p[P_ECS]) * S[QCS, yr + 1], (p[P_ECS]) * S[QCS, yr + 1])
+
+    @jit
+    def step(p, S, slrr, slrst, yr, itp, Ab, tt, dt, ref, counts):
+        # One step of the main loop (one year in Run_morquest); returns the updated intertidal flag itp. ref is the
+        # column of year slrst + 1, the reference of hiod; counts (int64, one per CLAMPS) counts the clamps
+        dH = p[P_DH]
+        h = dt[yr]
+        fluxes(p, S, slrr, yr, dt, counts)
+
+        drown = (itp == 0) | (S[DVI_SED, yr] <= -S[VI_SED, yr]) | (S[HI, yr] >= dH)
+        drowned = count(drown)
+        counts[C_DROWNED] += drowned
+        if drowned > 0:
+            itp = select(drown, 0, itp)
+            S[DVI_SED, yr] = select(drown, -S[VI_SED, yr], S[DVI_SED, yr])
+            S[VC, yr] = select(drown, S[VC, yr] + S[AI, yr] * S[HI, yr], S[VC, yr])
+            S[AC, yr] = select(drown, Ab, S[AC, yr])
+            for row in (AI, HI, HIOD, VI, QCI, QRI):
+                S[row, yr] = select(drown, 0.0, S[row, yr])
+
+        clamp_outer(S, yr, counts)
+        advance(S, yr, dt)
+
+        S[HC, yr + 1] = select(S[AC, yr + 1] <= 0, 0.0, S[VC, yr + 1] / S[AC, yr + 1])
+        S[HI, yr + 1] = select(S[AI, yr + 1] <= 0, 0.0, S[VI, yr + 1] / S[AI, yr + 1])
+        S[HIOD, yr + 1] = select(slrr[yr + 1] == 0, 0.0, S[HI, yr + 1] - S[HI, ref])
+
+        S[P, yr + 1] = dH * S[AC, yr + 1] + S[VI, yr + 1]
+        S[VCEQ, yr + 1] = VCA * power(S[P, yr + 1], VCE)
+        S[HCOD, yr + 1] = S[VC, yr + 1] / S[AC, yr + 1] - S[VCEQ, yr + 1] / S[AC, yr + 1]
+
+        river_intertidal(p, S, yr, dt)
+        S[QCIEQ, yr + 1] = slrr[yr] / h * S[AI, yr]
+        adaptation(p, S, yr, slrst, tt)
+        transports(p, S, yr, dt)
+
+        ## height-width correction, where the intertidal depth, the channel depth and Qri are not zero (faw * fs for
+        ## a decreasing river supply)
+        if tt[yr] >= 2:
+            Qri = S[QRI, yr + 1]
+            ratio = Qri / S[AI, yr + 1]
+            grow = ratio >= 0
+            fs = select(grow, p[P_FS], p[P_FAW] * p[P_FS])
+            wh = select(grow, Qri * p[P_FS], Qri * p[P_FAW] * p[P_FS]) / S[HC, yr]
+            update = (S[HI, yr + 1] != 0) & (S[HC, yr] != 0) & (ratio != 0)
+            S[DAI_WH, yr + 1] = select(update, wh, S[DAI_WH, yr + 1])
+            S[DVI_WH, yr + 1] = select(update, dH * wh - Qri * (1 - fs), S[DVI_WH, yr + 1])
+            S[DVI_SED_WH, yr + 1] = select(update, Qri * (1 - fs) + wh * dH * p[P_SI] / S[AI, yr] * (0.5 * wh * h + S[AI, yr]),
+                                           S[DVI_SED_WH, yr + 1])
+            S[DVC_WH, yr + 1] = select(update, -wh * (dH + S[HC, yr]), S[DVC_WH, yr + 1])
+
+        ## prevent transport from empty volumes
+        shore_exchange(p, S, yr)
+
+        empty = S[VOUT, yr + 1] <= 0
+        emptied = count(empty)
+        counts[C_VOUT] += emptied
+        if emptied > 0:
+            S[VOUT, yr + 1] = select(empty, 0.0, S[VOUT, yr + 1])
+            S[QSO, yr + 1] = select(empty & (S[QSO, yr + 1] < 0), 0.0, S[QSO, yr + 1])     # no transport from out to shore if no out volume
+
+        empty = S[VS, yr + 1] <= 0
+        emptied = count(empty)
+        counts[C_VS] += emptied
+        if emptied > 0:
+            S[VS, yr + 1] = select(empty, 0.0, S[VS, yr + 1])
+            S[QCS, yr + 1] = select(empty & (S[QCS, yr + 1] <= 0), 0.0, S[QCS, yr + 1])   # no transport from shore to channel if no shore volume
+            S[QSO, yr + 1] = select(empty & (S[QSO, yr + 1] >= S[VS, yr + 1] + S[QCS, yr + 1]), S[QCS, yr + 1],
+                                    S[QSO, yr + 1])                                       # transport from shore equal to shore if no shore volume
+
+        empty = (S[VI, yr + 1] <= 0) | (S[AI, yr + 1] <= 0)
+        emptied = count(empty)
+        counts[C_VI] += emptied
+        if emptied > 0:
+            for row in (VI, AI, HI, HIOD, VI_SED):
+                S[row, yr + 1] = select(empty, 0.0, S[row, yr + 1])
+            S[AC, yr + 1] = select(empty, S[AC, yr], S[AC, yr + 1])
+            S[QCI, yr] = select(empty & (-S[QCI, yr] * h + S[DVI_SL, yr] + S[DVI_WH, yr] * h <= 0),
+                                (S[DVI_SL, yr] + S[DVI_WH, yr] * h) / h, S[QCI, yr])
+
+        empty = S[VC, yr + 1] <= 0
+        emptied = count(empty)
+        counts[C_VC] += emptied
+        if emptied > 0:
+            S[VC, yr + 1] = select(empty, 0.0, S[VC, yr + 1])
+            S[QRC, yr] = select(empty & (-S[QRC, yr] * h + S[QCI, yr] * h + S[QCD, yr] * h + S[QCS, yr] * h + S[QCO, yr] * h + S[DVC_SL, yr] + S[DVC_WH, yr] * h <= 0),
+                                (S[QCI, yr] * h + S[QCD, yr] * h + S[QCS, yr] * h + S[QCO, yr] * h + S[DVC_SL, yr] + S[DVC_WH, yr] * h) / h,
+                                S[QRC, yr])                               # no transport from intertidal to channel if no channel volume
+            S[AI, yr + 1] = select(empty, S[AI, yr], S[AI, yr + 1])
+            for row in (AC, HC, HCOD):
+                S[row, yr + 1] = select(empty, 0.0, S[row, yr + 1])
+        return itp
+
+    @jit
+    def final_step(p, S, slrr, slrst, yr, tt, dt, counts):
+        dH = p[P_DH]
+        fluxes(p, S, slrr, yr, dt, counts)
+        cut = S[DVI_SED, yr] <= -S[VI_SED, yr]
+        cuts = count(cut)
+        counts[C_DVI_SED] += cuts
+        if cuts > 0:
+            S[DVI_SED_SL, yr] = select(cut, -S[QCI, yr], S[DVI_SED_SL, yr])
+            S[DVI_SED, yr] = select(cut, 0.0, S[DVI_SED, yr])
+        clamp_outer(S, yr, counts)
+        advance(S, yr, dt)
+        S[HC, yr + 1] = S[VC, yr + 1] / S[AC, yr]
+        S[HI, yr + 1] = S[VI, yr + 1] / S[AI, yr + 1]
+        S[HIOD, yr + 1] = S[HI, yr + 1] - S[HI, 0]
+
+        river_intertidal(p, S, yr, dt)
+        adaptation(p, S, yr, slrst, tt)
+        S[QCI, yr + 1] = S[QCI_AT, yr + 1] + S[QRI, yr + 1]
+        S[P, yr + 1] = dH * S[AC, yr + 1] + S[VI, yr + 1]
+        S[VCEQ, yr + 1] = VCA * power(S[P, yr + 1], VCE)
+        S[HCOD, yr + 1] = S[VC, yr + 1] / S[AC, yr + 1] - S[VCEQ, yr + 1] / S[AC, yr + 1]
+        transports(p, S, yr, dt)
+        shore_exchange(p, S, yr)
+
+    @jit
+    def closing_balance(p, S, slrr, yr):
+        # Budget terms of the last year recomputed with the final Qci (no height-width terms)
+        dH = p[P_DH]
+        S[DVC_SL, yr] = -dH * S[DAI_SL, yr] * 0.5 * (1 - slrr[yr] / dH) + (S[AC, yr] - S[DAI, yr]) * slrr[yr]
+        S[DVC, yr] = -S[QRC, yr] + S[QCI, yr] + S[QCD, yr] + S[QCS, yr] + S[QCO, yr]                             + S[DVC_SL, yr]
+        S[DVI_SL, yr] = dH * S[DAI_SL, yr] * (1 - 0.5 * slrr[yr] / dH) + (S[AI, yr] + S[DAI, yr]) * slrr[yr]
+        S[DVI, yr] = -S[QCI, yr]                                                                                  + S[DVI_SL, yr]
+        S[DVI_SED_SL, yr] = -S[AI, yr] * slrr[yr] + 0.5 * S[DAI, yr] * slrr[yr]
+        S[DVI_SED, yr] = S[QCI, yr]                                                                               + S[DVI_SED_SL, yr]
+        S[DVS, yr] = S[QCS, yr] - S[QSD, yr] - S[QSO, yr]
+        S[DVD, yr] = S[QCD, yr] + S[QSD, yr] - S[QDO, yr]
+        S[DVOUT, yr] = S[QCO, yr] + S[QDO, yr] + S[QSO, yr]
+        S[DS, yr] = S[DVS, yr] / (p[P_CL] * p[P_CD])
+        S[DBR, yr] = slrr[yr] * p[P_CD] / p[P_BETAS] / (p[P_CD] + p[P_DU])    #Bruun rule
+
+    @jit
+    def check_events(S, yr, ev_row, ev_op, ev_value, ev_stop, ev_year):
+        # Record the first year of every event; returns True when an event that ends the run occurred
+        stop = False
+        for k in range(len(ev_row)):
+            if ev_year[k] < 0:
+                x = S[ev_row[k], yr]
+                op = ev_op[k]
+                if (op == 0 and x <= ev_value[k]) or (op == 1 and x >= ev_value[k]) or (op == 2 and x < ev_value[k]) \
+                        or (op == 3 and x > ev_value[k]):
+                    ev_year[k] = yr
+                    stop = stop or ev_stop[k]
+        return stop
+
+    @jit
+    def run(p, S, slrr, Qr, ssc, slrst, dur, counts, ev_row, ev_op, ev_value, ev_stop, ev_year):
+        # Returns the last computed year: dur, or the year of the first stop event; see step for counts
+        initialize(p, S, slrr, Qr, ssc)
+        Ab = p[P_AC] + p[P_AI]                                      #basin area, m2
+        tt = np.arange(dur + 1) * 1.0                               #yearly steps
+        dt = np.ones(dur + 1)
+        itp = 1
+        for yr in range(dur - 1):
+            itp = step(p, S, slrr, slrst, yr, itp, Ab, tt, dt, slrst + 1, counts)
+            if len(ev_row) > 0 and check_events(S, yr, ev_row, ev_op, ev_value, ev_stop, ev_year):
+                return yr
+        final_step(p, S, slrr, slrst, dur - 1, tt, dt, counts)
+        for yr in range(dur - 1, dur + 1):
+            if len(ev_row) > 0 and check_events(S, yr, ev_row, ev_op, ev_value, ev_stop, ev_year):
+                return yr
+        return dur
+
+    return run, closing_balance, initialize, step, final_step
+
+
+def _no_jit(f):
+    return f
+
+run_python, closing_balance, initialize_python, step_python, final_step_python = _make_kernel(_no_jit)
+#The kernel on arrays of N scenarios (Run_morquest_batch): parameters [len(PARAMS), N] and state
+#[len(STATE), dur + 1, N]; events and stops are handled per scenario by the batch, so run is not used
+closing_batch, initialize_batch, step_batch, final_step_batch = _make_kernel(_no_jit, ARRAY_OPS)[1:]
+_compiled = {}
+
+
+def numba_available():
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_kernel(backend='python'):
+    """
+    Return the time-loop kernel run(p, S, slrr, Qr, ssc, slrst, dur) for a backend.
+
+    Parameters:
+    - backend (str): 'python' (reference), 'numba' (compiled; falls back to 'python' with a warning when numba is
+      not installed) or 'auto' (numba if installed, silently).
+    """
+    if backend == 'python':
+        return run_python
+    if backend not in ('numba', 'auto'):
+        raise ValueError(f"Unknown backend {backend!r}; use 'python', 'numba' or 'auto'")
+    if not numba_available():
+        if backend == 'numba':
+            warnings.warn("numba is not installed; using the pure-Python morQuest kernel")
+        return run_python
+    if 'numba' not in _compiled:
+        import numba
+        _compiled['numba'] = _make_kernel(numba.njit(cache=True, error_model='numpy'))
+    return _compiled['numba'][0]
+
+
+def get_step(backend='python'):
+    # initialize(p, S, slrr, Qr, ssc), step(p, S, slrr, slrst, yr, itp, Ab, tt, dt, ref, counts) and
+    # final_step(p, S, slrr, slrst, yr, tt, dt, counts) of a backend, for drivers with their own time loop (see
+    # Adaptive.py and Equilibrium.py)
+    if get_kernel(backend) is run_python:
+        return initialize_python, step_python, final_step_python
+    return _compiled['numba'][2:5]
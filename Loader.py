@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Cached access to the attribute tables of the shapefile inputs
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+
+import Instrument
+
+# The analyses only need attributes (estuary, year, area, slope, ...), so the tables are read from the .dbf part
+# of each shapefile without decoding any geometry. Aggregates over all estuaries are computed once per source and
+# kept in cache_dir:
+#   <table>.feather (or .pkl without pyarrow)   the aggregated table
+#   <table>.json                                 source file, mtime, size and sha256 it was built from
+# A cached table is reused while the source keeps its mtime, or when a touched source still has the same hash.
+INTERTIDAL = 'Data/Intertidal_Area/Intertidal_Area_App_EST_.shp'
+CHANNEL = 'Data/Channel_Area/Channel_area_2016.shp'
+NEARSHORE = 'Data/Nearshore_Slopes/Nearshore_slopes.shp'
+CACHE_DIR = 'results/cache'
+
+_memory = {}                                    #tables already loaded by this process
+
+
+def read_dbf(path, columns=None, encoding=None):
+    """
+    Attribute table of a shapefile, read from its dBase (.dbf) file.
+
+    Parameters:
+    - path (str): .shp or .dbf file.
+    - columns (list): Fields to keep (default: all).
+    - encoding (str): Text encoding (default: the .cpg file, else utf-8).
+
+    Returns:
+    - DataFrame: One row per (not deleted) record; numeric fields as float (int without decimals), dates as text.
+    """
+    base = os.path.splitext(path)[0]
+    if encoding is None:
+        encoding = 'utf-8'
+        if os.path.exists(base + '.cpg'):
+            with open(base + '.cpg') as f:
+                encoding = f.read().strip() or encoding
+    with open(base + '.dbf', 'rb') as f:
+        data = f.read()
+    Instrument.add('bytes_read.dbf', len(data))
+
+    n, header_length, record_length = struct.unpack('<IHH', data[4:12])
+    fields, offset = [], 1                                              #byte 0 of a record is the deletion flag
+    for pos in range(32, header_length - 1, 32):
+        if data[pos] == 0x0D:
+            break
+        name = data[pos:pos + 11].split(b'\0')[0].decode('ascii')
+        kind, size, decimals = chr(data[pos + 11]), data[pos + 16], data[pos + 17]
+        fields.append((name, kind, offset, size, decimals))
+        offset += size
+
+    records = np.frombuffer(data, dtype=np.uint8, count=n * record_length, offset=header_length).reshape(n, record_length)
+    keep = records[:, 0] != ord('*')
+    table = {}
+    for name, kind, offset, size, decimals in fields:
+        if columns is not None and name not in columns:
+            continue
+        raw = np.ascontiguousarray(records[keep, offset:offset + size]).view(f'S{size}').ravel()
+        if kind in 'NFO':
+            text = np.char.strip(raw)
+            value = np.full(len(text), np.nan)
+            valid = (text != b'') & (np.char.find(text, b'*') < 0)
+            value[valid] = text[valid].astype(float)
+            table[name] = value.astype(np.int64) if kind == 'N' and decimals == 0 and valid.all() else value
+        elif kind == 'L':
+            table[name] = np.isin(raw, [b'T', b't', b'Y', b'y'])
+        else:
+            table[name] = np.char.strip(np.char.decode(raw, encoding, errors='replace'))
+    return pd.DataFrame(table, columns=[name for name, *_ in fields if columns is None or name in columns])
+
+
+def _hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write(table, file):
+    try:
+        table.reset_index(drop=True).to_feather(file + '.feather')
+        return '.feather'
+    except ImportError:                                                 #no pyarrow
+        table.to_pickle(file + '.pkl')
+        return '.pkl'
+
+
+def _write_meta(meta, meta_file):
+    with open(meta_file + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_file + '.tmp', meta_file)
+
+
+def cached_table(name, source, build, cache_dir=CACHE_DIR):
+    """
+    Table derived from a source file, rebuilt only when the source changes.
+
+    Parameters:
+    - name (str): Cache name of the table.
+    - source (str): Source file (e.g. the .dbf of a shapefile, a tide gauge record).
+    - build (callable): Computes the table from the source path.
+    - cache_dir (str): Cache folder; None keeps the table in memory only.
+
+    Returns:
+    - DataFrame: The table.
+    """
+    stat = os.stat(source)
+    key = (name, os.path.abspath(source), cache_dir)
+    if key in _memory and _memory[key][0] == (stat.st_mtime_ns, stat.st_size):
+        return _memory[key][1].copy()
+
+    table = None
+    meta_file = os.path.join(cache_dir, name + '.json') if cache_dir else None
+    if meta_file and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        file = os.path.join(cache_dir, name + meta['format'])
+        same = meta['source'] == os.path.abspath(source) and meta['size'] == stat.st_size and os.path.exists(file)
+        if same and meta['mtime_ns'] != stat.st_mtime_ns:
+            same = meta['sha256'] == _hash(source)                      #touched but maybe unchanged
+            if same:
+                meta['mtime_ns'] = stat.st_mtime_ns
+                _write_meta(meta, meta_file)
+        if same:
+            table = pd.read_feather(file) if meta['format'] == '.feather' else pd.read_pickle(file)
+            Instrument.add_file('bytes_read.cache', file)
+
+    if table is None:
+        table = build(source)
+        if meta_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            suffix = _write(table, os.path.join(cache_dir, name))
+            _write_meta({'source': os.path.abspath(source), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                         'sha256': _hash(source), 'format': suffix}, meta_file)
+            Instrument.add_file('bytes_written.cache', os.path.join(cache_dir, name + suffix))
+    _memory[key] = ((stat.st_mtime_ns, stat.st_size), table)
+    return table.copy()
+
+
+def _name(path):
+    return os.path.basename(os.path.splitext(path)[0])
+
+
+def _dbf(path):
+    return os.path.splitext(path)[0] + '.dbf'
+
+
+def intertidal_areas(path=INTERTIDAL, cache_dir=CACHE_DIR):
+    # Intertidal area per estuary and year, km2 (columns Est, Year, area)
+    def build(source):
+        data = read_dbf(source)
+        return (data.groupby(['Est', 'Year'])['area'].sum() / 1000000).reset_index()
+    return cached_table('intertidal_areas_' + _name(path), _dbf(path), build, cache_dir)
+
+
+def channel_areas(path=CHANNEL, cache_dir=CACHE_DIR):
+    # Channel area per estuary, km2 (columns name2, area)
+    def build(source):
+        data = read_dbf(source)
+        return (data.groupby(['name2'])['area'].sum() / 1000000).reset_index()
+    return cached_table('channel_areas_' + _name(path), _dbf(path), build, cache_dir)
+
+
+def nearshore_slopes(path=NEARSHORE, cache_dir=CACHE_DIR):
+    # Mean nearshore slope and closure depth per estuary (columns name, slope, dc)
+    def build(source):
+        data = read_dbf(source)
+        return data.groupby(['name'])[['slope', 'dc']].mean().reset_index()
+    return cached_table('nearshore_slopes_' + _name(path), _dbf(path), build, cache_dir)
+
+
+def read_shapes(path, selection=None, column='Est'):
+    """
+    Geometries of a shapefile for maps, parsed once per process (requires geopandas).
+
+    Parameters:
+    - path (str): Shapefile.
+    - selection (str): Keep only the rows whose column equals selection.
+    - column (str): Attribute holding the estuary name.
+
+    Returns:
+    - GeoDataFrame: The (selected) features.
+    """
+    import geopandas as gpd
+    stat = os.stat(path)
+    key = ('shapes', os.path.abspath(path))
+    if key not in _memory or _memory[key][0] != (stat.st_mtime_ns, stat.st_size):
+        _memory[key] = ((stat.st_mtime_ns, stat.st_size), gpd.read_file(path, encoding='utf-8'))
+    data = _memory[key][1]
+    return data if selection is None else data[data[column] == selection]
@@ -27,26 +27,18 @@
 # building the stack.
 # mreyec@uni.pe
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
 import math
 
-def analyze_nearshore_data(selection):
-    # Read the data from Shapefile
-    shp_path0 = 'Data/Nearshore_slopes/Nearshore_slopes.shp'
-    nearshore = gpd.read_file(shp_path0, encoding='utf-8')
-
-    # Group by name and calculate mean slope and dc
-    nearshore_analysis_slope = nearshore.groupby(['name'])['slope'].mean()
-    nearshore_analysis_slope = pd.DataFrame(nearshore_analysis_slope).reset_index()
+import Instrument
+import Loader
 
-    nearshore_analysis_dc = nearshore.groupby(['name'])['dc'].mean()
-    nearshore_analysis_dc = pd.DataFrame(nearshore_analysis_dc).reset_index()
-
-    nearshore_results = pd.merge(nearshore_analysis_slope, nearshore_analysis_dc, on='name')
+@Instrument.timed('analyze.nearshore')
+def analyze_nearshore_data(selection):
+    # Mean slope and dc per estuary, read from the attribute table (cached, see Loader.py)
+    nearshore_results = Loader.nearshore_slopes('Data/Nearshore_Slopes/Nearshore_slopes.shp')
 
     if selection in nearshore_results['name'].values:
         print("Valid estuary selected:", selection)
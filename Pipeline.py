@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Estuary pipeline from the Data folder to model summaries, with cached stages
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import Forcing
+import Instrument
+import Loader
+import Tidal
+from Hydrology_analysis import hydrology
+from Intertidal_analysis import intertidal_area
+from morQuest import morquest_set_input, Run_morquest
+
+# The steps of morQuest_CaseStudy.ipynb as a graph of stages per estuary:
+#
+#   intertidal, hydrology, tidal, channel, nearshore  ->  inputs  ->  simulation  ->  summary
+#
+# Each stage output is stored in cache_dir/<estuary>/<stage>-<key>.pkl. The key hashes the content of the stage's
+# source files and code, the parameters it reads and the content of its upstream outputs. A stage runs again only
+# when one of these changes: a new slr reruns simulation and summary only; an edited shapefile reruns the stages
+# reading it, and the later stages only for the estuaries whose values actually changed.
+
+#Input files, see Loader.py and Tidal.py
+PATHS = {'intertidal': Loader.INTERTIDAL, 'channel': Loader.CHANNEL, 'nearshore': Loader.NEARSHORE,
+         'hydrology': 'Data/Hydrology', 'tidal': Tidal.TIDAL_DIR}
+CACHE_DIR = 'results/pipeline'
+
+#Model settings of morQuest_CaseStudy.ipynb; Ac, Ai, dH, Qr, betas and cd come from the data
+MODEL_DEFAULTS = dict(fQr=0, ssc=0.1, fssc=0, slr=0.53, lsys=5503, cl=1e6, fd=1.5, du=10, por=0.4, rho=2650, dur=100,
+                      T=43200, slrtype='linear', incAi=0, tr=0, erc=0.5, ecs=0.5, fis=0.5, si=0.10, fs=0.5, faw=0.5)
+
+
+def _intertidal(selection, paths, params):
+    return intertidal_area(paths['intertidal'], selection).rename(columns={'area': 'Ai'})
+
+
+def _hydrology(selection, paths, params):
+    s_values = hydrology(selection, paths['hydrology'])[1]
+    return s_values.rename(columns={'Mean_Q': 'Qr'})
+
+
+def _tidal(selection, paths, params):
+    tidal_data = Tidal.tidal_range(selection, tidal_dir=paths['tidal'])
+    return tidal_data.rename(columns={'Tidal Range (mm)': 'dH'})
+
+
+def _channel(selection, paths, params):
+    data = Loader.channel_areas(paths['channel'])
+    return data[data['name2'] == selection].rename(columns={'name2': 'Est', 'area': 'Ac'}).reset_index(drop=True)
+
+
+def _nearshore(selection, paths, params):
+    data = Loader.nearshore_slopes(paths['nearshore'])
+    return data[data['name'] == selection].rename(columns={'name': 'Est', 'slope': 'betas', 'dc': 'cd'}).reset_index(drop=True)
+
+
+def _inputs(selection, paths, params, intertidal, hydrology, tidal, channel, nearshore):
+    # Values of the last year with intertidal, river and tidal data, in model units
+    merged = pd.merge(pd.merge(intertidal, hydrology, on='Year'), tidal, on='Year')
+    if merged.empty or channel.empty or nearshore.empty:
+        raise ValueError(f'Incomplete data for {selection}')
+    last = merged.iloc[-1]
+    return {'Year': int(last['Year']),
+            'Ac': float(channel['Ac'].iloc[0]) * 1000000,                  #channel area, km2 to m2
+            'Ai': float(last['Ai']) * 1000000,                              #intertidal area, km2 to m2
+            'dH': float(last['dH']) * 0.001,                                #tidal range, mm to m
+            'Qr': float(last['Qr']) * 0.0283168466,                         #river flow, ft3/s to m3/s
+            'betas': float(nearshore['betas'].iloc[0]),                     #active shorezone slope
+            'cd': float(nearshore['cd'].iloc[0])}                           #closure depth, m
+
+
+def _simulation(selection, paths, params, inputs):
+    data = {key: value for key, value in inputs.items() if key != 'Year'}
+    return Run_morquest(morquest_set_input(**dict(MODEL_DEFAULTS, **data, **params)))
+
+
+def _summary(selection, paths, params, simulation):
+    # Initial and final state of the run
+    row = {'Est': selection, 'dur': int(simulation['dur'])}
+    for key in ['Ai', 'Ac', 'hi', 'hc', 'Vi', 'Vc', 'Vd', 'sedVi', 'sedVc', 'sedVd', 'at']:
+        series = np.ravel(simulation[key])
+        row[f'{key}_0'], row[f'{key}_end'] = float(series[0]), float(series[-1])
+    row['dAi'] = row['Ai_end'] / row['Ai_0'] - 1                        #relative change of the intertidal area
+    row['dAc'] = row['Ac_end'] / row['Ac_0'] - 1
+    return row
+
+
+def _shapefile(key):
+    return lambda selection, paths: [Loader._dbf(paths[key])]
+
+
+#Stage name -> run function, upstream stages (passed in this order), source files, code files, reads params.
+#Pipeline.py is in every code list: it holds the stage functions and the unit conversions
+STAGES = {
+    'intertidal': dict(run=_intertidal, after=[], sources=_shapefile('intertidal'),
+                       code=['Pipeline.py', 'Intertidal_analysis.py', 'Loader.py']),
+    'hydrology': dict(run=_hydrology, after=[], sources=lambda selection, paths: [
+                      os.path.join(paths['hydrology'], f'{selection}.txt')], code=['Pipeline.py', 'Hydrology_analysis.py']),
+    'tidal': dict(run=_tidal, after=[], sources=lambda selection, paths: [
+                  Tidal.station_path(Tidal.ESTUARY_STATIONS[selection], paths['tidal'])],
+                  code=['Pipeline.py', 'Tidal.py', 'Loader.py']),
+    'channel': dict(run=_channel, after=[], sources=_shapefile('channel'), code=['Pipeline.py', 'Loader.py']),
+    'nearshore': dict(run=_nearshore, after=[], sources=_shapefile('nearshore'), code=['Pipeline.py', 'Loader.py']),
+    'inputs': dict(run=_inputs, after=['intertidal', 'hydrology', 'tidal', 'channel', 'nearshore'], code=['Pipeline.py']),
+    'simulation': dict(run=_simulation, after=['inputs'], code=['Pipeline.py', 'morQuest.py', 'Kernel.py', 'Forcing.py'],
+                       params=True),
+    'summary': dict(run=_summary, after=['simulation'], code=['Pipeline.py']),
+}
+
+_digests = {}                                   #file -> ((mtime, size), sha256) for this process
+
+
+def _file_digest(path):
+    stat = os.stat(path)
+    if path not in _digests or _digests[path][0] != (stat.st_mtime_ns, stat.st_size):
+        _digests[path] = ((stat.st_mtime_ns, stat.st_size), Loader._hash(path))
+    return _digests[path][1]
+
+
+def _required(targets):
+    # Stages needed for the targets, upstream first
+    order = []
+
+    def visit(name):
+        for upstream in STAGES[name]['after']:
+            visit(upstream)
+        if name not in order:
+            order.append(name)
+    for name in targets:
+        visit(name)
+    return order
+
+
+def run_estuary(selection, params=None, targets=('summary',), paths=None, cache_dir=CACHE_DIR):
+    """
+    Run the stages of one estuary, reusing the cached outputs whose inputs did not change.
+
+    Parameters:
+    - selection (str): Estuary name, e.g. 'Alsea_bay'.
+    - params (dict): Model settings overriding MODEL_DEFAULTS and the data values (read by 'simulation' only).
+    - targets (list): Stages to produce, e.g. ['inputs'] for the preprocessing alone.
+    - paths (dict): Input files overriding PATHS.
+    - cache_dir (str): Stage cache folder; None disables caching.
+
+    Returns:
+    - dict: Stage name -> output, plus 'computed' (stages that were run rather than read from the cache).
+    """
+    paths = dict(PATHS, **(paths or {}))
+    params = dict(params or {})
+    here = os.path.dirname(os.path.abspath(__file__))
+    outputs, digests, computed = {}, {}, []
+    for name in _required(targets):
+        stage = STAGES[name]
+        key = {'stage': name,
+               'sources': [_file_digest(path) for path in stage.get('sources', lambda *a: [])(selection, paths)],
+               'code': [_file_digest(os.path.join(here, file)) for file in stage['code']],
+               'params': params if stage.get('params') else None,
+               'forcing': Forcing.fingerprint([params.get('slrtype', MODEL_DEFAULTS['slrtype'])]) if stage.get('params') else None,
+               'after': [digests[upstream] for upstream in stage['after']]}
+        key = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:20]
+        file = os.path.join(cache_dir, selection, f'{name}-{key}.pkl') if cache_dir else None
+        if file and os.path.exists(file):
+            with open(file, 'rb') as f:
+                digests[name], outputs[name] = pickle.load(f)
+            Instrument.add_file('bytes_read.pipeline', file)
+            continue
+
+        with Instrument.timer(f'stage.{name}'):
+            outputs[name] = stage['run'](selection, paths, params, *[outputs[upstream] for upstream in stage['after']])
+        data = pickle.dumps(outputs[name], protocol=pickle.HIGHEST_PROTOCOL)
+        digests[name] = hashlib.sha256(data).hexdigest()
+        computed.append(name)
+        if file:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file + '.tmp', 'wb') as f:
+                pickle.dump((digests[name], outputs[name]), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(file + '.tmp', file)
+            Instrument.add_file('bytes_written.pipeline', file)
+    return dict(outputs, computed=computed)
+
+
+def _run_estuary(selection, params, targets, paths, cache_dir, curves):
+    Forcing.register_definitions(curves)
+    return selection, run_estuary(selection, params, targets, paths, cache_dir)
+
+
+def run_pipeline(estuaries, params=None, targets=('summary',), paths=None, cache_dir=CACHE_DIR, max_workers=None):
+    """
+    Run the pipeline of several estuaries in parallel, one process per estuary.
+
+    Parameters:
+    - estuaries (list or dict): Estuary names, or name -> params overriding the common params.
+    - params (dict): Model settings common to all estuaries.
+    - targets, paths, cache_dir: See run_estuary.
+    - max_workers (int): Pool size (default: number of CPUs); 1 runs in this process.
+
+    Returns:
+    - dict: Estuary name -> output of run_estuary.
+    """
+    paths = dict(PATHS, **(paths or {}))
+    if not isinstance(estuaries, dict):
+        estuaries = {selection: {} for selection in estuaries}
+    jobs = []
+    for selection, own in estuaries.items():
+        input = dict(params or {}, **(own or {}))
+        jobs.append((selection, input, targets, paths, cache_dir,
+                     Forcing.definitions([input.get('slrtype', MODEL_DEFAULTS['slrtype'])])))
+
+    max_workers = max_workers or min(len(jobs), os.cpu_count())
+    if max_workers == 1:
+        return dict(_run_estuary(*job) for job in jobs)
+
+    # Tables shared by all estuaries are built here once, so the workers only read them
+    Loader.intertidal_areas(paths['intertidal'])
+    Loader.channel_areas(paths['channel'])
+    Loader.nearshore_slopes(paths['nearshore'])
+    for station in sorted({Tidal.ESTUARY_STATIONS[selection] for selection in estuaries}):
+        Tidal.monthly_range(station, tidal_dir=paths['tidal'])
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return dict(map(Instrument.gather, pool.map(Instrument.task(_run_estuary), *zip(*jobs))))
+
+
+def summaries(results):
+    # One row per estuary with the 'inputs' and 'summary' outputs of run_pipeline
+    rows = [dict(result.get('inputs', {}), **result.get('summary', {'Est': selection}))
+            for selection, result in results.items()]
+    return pd.DataFrame(rows).set_index('Est')
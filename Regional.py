@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Regional runs: all estuaries of the Data folder and a set of scenarios in one parallel job
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import Forcing
+import Instrument
+import Loader
+import Pipeline
+import Tidal
+from Sweep import parameter_grid
+
+# Every (estuary, scenario) pair is one task of a process pool, after the preprocessing of all estuaries has been
+# done (or read from the Pipeline cache) once. Each scenario result is cached by Pipeline as well, so extending a
+# regional run with new scenarios only computes those.
+#
+#   python Regional.py --param slr=0.5,1,2 --param si=0.06,0.13 --output results/regional.csv
+
+
+def estuary_sources(paths=None):
+    """
+    Estuaries found in each data source.
+
+    Parameters:
+    - paths (dict): Input files overriding Pipeline.PATHS.
+
+    Returns:
+    - DataFrame: One row per estuary name, one boolean column per source.
+    """
+    paths = dict(Pipeline.PATHS, **(paths or {}))
+    found = {
+        'hydrology': {os.path.splitext(file)[0] for file in os.listdir(paths['hydrology']) if file.endswith('.txt')},
+        'intertidal': set(Loader.intertidal_areas(paths['intertidal'])['Est']),
+        'channel': set(Loader.channel_areas(paths['channel'])['name2']),
+        'nearshore': set(Loader.nearshore_slopes(paths['nearshore'])['name']),
+        'tidal': {selection for selection, station in Tidal.ESTUARY_STATIONS.items()
+                  if os.path.exists(Tidal.station_path(station, paths['tidal']))},
+    }
+    names = sorted(set.union(*found.values()))
+    return pd.DataFrame({source: [name in values for name in names] for source, values in found.items()},
+                        index=pd.Index(names, name='Est'))
+
+
+def discover_estuaries(paths=None):
+    # Estuaries with data in every source
+    sources = estuary_sources(paths)
+    return sources.index[sources.all(axis=1)].tolist()
+
+
+def scenario_name(params):
+    return ','.join(f'{key}={value}' for key, value in params.items()) or 'base'
+
+
+def _run_task(selection, name, params, paths, cache_dir, curves):
+    with np.errstate(all='ignore'):                                     #drowned intertidal areas divide by zero
+        result = Pipeline._run_estuary(selection, params, ['summary'], paths, cache_dir, curves)[1]
+    return selection, name, result['inputs'], result['summary']
+
+
+def run_region(scenarios=None, estuaries=None, params=None, paths=None, cache_dir=Pipeline.CACHE_DIR,
+               max_workers=None):
+    """
+    Run a set of scenarios for every estuary, in parallel.
+
+    Parameters:
+    - scenarios (list or dict): Parameter sets (dicts of morQuest inputs), a dict name -> parameter set, or a dict
+      of value lists expanded with Sweep.parameter_grid (default: one run with the Pipeline.MODEL_DEFAULTS).
+    - estuaries (list): Estuary names (default: discover_estuaries()).
+    - params (dict): Model settings shared by all scenarios.
+    - paths (dict): Input files overriding Pipeline.PATHS.
+    - cache_dir (str): Stage cache folder, see Pipeline.run_estuary.
+    - max_workers (int): Pool size (default: number of CPUs).
+
+    Returns:
+    - DataFrame: One row per estuary and scenario (index Est, scenario) with the scenario parameters, the input
+      values taken from the data and the initial and final state of the run.
+    """
+    paths = dict(Pipeline.PATHS, **(paths or {}))
+    estuaries = estuaries or discover_estuaries(paths)
+    if scenarios is None:
+        scenarios = [{}]
+    elif isinstance(scenarios, dict) and not all(isinstance(value, dict) for value in scenarios.values()):
+        scenarios = parameter_grid(**scenarios)
+    if not isinstance(scenarios, dict):
+        scenarios = {scenario_name(scenario): scenario for scenario in scenarios}
+
+    # Preprocessing once per estuary, then one task per estuary and scenario
+    Pipeline.run_pipeline(estuaries, targets=['inputs'], paths=paths, cache_dir=cache_dir, max_workers=max_workers)
+    jobs = []
+    for selection in estuaries:
+        for name, scenario in scenarios.items():
+            input = dict(params or {}, **scenario)
+            jobs.append((selection, name, input, paths, cache_dir,
+                         Forcing.definitions([input.get('slrtype', Pipeline.MODEL_DEFAULTS['slrtype'])])))
+
+    max_workers = max_workers or min(len(jobs), os.cpu_count())
+    if max_workers == 1:
+        results = [_run_task(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(map(Instrument.gather, pool.map(Instrument.task(_run_task), *zip(*jobs),
+                                                           chunksize=max(1, len(jobs) // (4 * max_workers)))))
+
+    rows = []
+    for (selection, name, inputs, summary), job in zip(results, jobs):
+        scenario = {key: value for key, value in job[2].items() if not isinstance(value, (list, dict, pd.Series))}
+        rows.append(dict(scenario, **inputs, **summary, scenario=name))
+    return pd.DataFrame(rows).set_index(['Est', 'scenario'])
+
+
+def _value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run morQuest for all estuaries of the Data folder.')
+    parser.add_argument('--param', action='append', default=[], metavar='KEY=V1,V2,...',
+                        help='scenario values of a model input; several --param options give their combinations')
+    parser.add_argument('--estuaries', nargs='+', help='estuary names (default: all with complete data)')
+    parser.add_argument('--workers', type=int, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--cache-dir', default=Pipeline.CACHE_DIR, help='stage cache folder')
+    parser.add_argument('--output', default='results/regional_summary.csv', help='consolidated CSV table')
+    args = parser.parse_args(argv)
+
+    axes = {}
+    for option in args.param:
+        key, values = option.split('=', 1)
+        axes[key] = [_value(value) for value in values.split(',')]
+    sources = estuary_sources()
+    incomplete = sources[~sources.all(axis=1)]
+    for selection, row in incomplete.iterrows():
+        print(f"Skipping {selection}: no {', '.join(row.index[~row])} data")
+
+    table = run_region(parameter_grid(**axes) if axes else None, args.estuaries, max_workers=args.workers,
+                       cache_dir=args.cache_dir)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    table.to_csv(args.output)
+    print(table[['Ai_0', 'Ai_end', 'dAi', 'Ac_0', 'Ac_end', 'dAc']].to_string())
+    print(f'{len(table)} runs written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Optional figure rendering for the MorQuest analyses and results
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# The analysis modules compute without drawing (intertidal_area, hydrology, tidal_range, ...); their plot_*
+# functions draw one figure, save it and close it. A Reporter runs such plot functions in worker processes with
+# the non-interactive Agg backend, so rendering overlaps the computation and leaves no figures behind:
+#
+#   with Reporter() as report:
+#       df, s_values = hydrology(selection)
+#       report.submit(plot_hydrology, df, s_values, selection)
+#       ...
+#   report.files                                   # the written figures
+#
+# Reporter(enabled=False) skips all rendering.
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+class Reporter:
+    """
+    Background figure rendering in a process pool.
+
+    Parameters:
+    - max_workers (int): Rendering processes (default: 2).
+    - enabled (bool): False turns submit into a no-op, e.g. for batch runs without figures.
+    """
+
+    def __init__(self, max_workers=2, enabled=True):
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self._pool = None
+        self._futures = []
+        self.files = []
+
+    def submit(self, function, *args, **kwargs):
+        # Queue function(*args, **kwargs), which must save and close its figure and return the file name
+        if not self.enabled:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_use_agg)
+        future = self._pool.submit(function, *args, **kwargs)
+        self._futures.append(future)
+        return future
+
+    def close(self, wait=True):
+        # Wait for the queued figures (re-raising rendering errors) and shut the pool down
+        if self._pool is None:
+            return self.files
+        for future in self._futures:
+            result = future.result() if wait else None
+            if result is not None:
+                self.files.extend(result if isinstance(result, list) else [result])
+        self._futures = []
+        self._pool.shutdown(wait=wait)
+        self._pool = None
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(wait=exc[0] is None)
+
+
+def plot_result(result, selection, results_dir='results'):
+    """
+    Long-term trajectory figures of a morQuest run (areas, depths, volumes, sediment volumes and transports).
+
+    Parameters:
+    - result (MorquestResult or dict): Output of Run_morquest.
+    - selection (str): Estuary name used in titles and file names.
+    - results_dir (str): Folder for the PNG files.
+
+    Returns:
+    - list: The written files.
+    """
+    import matplotlib.pyplot as plt
+
+    data = {key: np.ravel(result[key]) for key in ['yr', 'Ai', 'Ac', 'at', 'hi', 'hc', 'Vi', 'Vc', 'Vd', 'sedVi',
+                                                     'sedVc', 'sedVd', 'Qci', 'Qcd', 'Qcs', 'Qso']}
+    yr = data['yr']
+    a = max(yr) + 1
+    files = []
+
+    def finish(fig, title, name, ylabel=None):
+        if ylabel:
+            plt.ylabel(ylabel)
+            plt.xlabel('Time (years)')
+            plt.minorticks_on()
+            plt.xticks(np.arange(0, a, 5))
+            plt.xlim(0, a)
+            plt.legend()
+            plt.grid(True)
+        plt.title(f'{title} in {selection}', fontsize=14, color="black")
+        file = os.path.join(results_dir, f'{name} in {selection}.png')
+        fig.savefig(file, bbox_inches='tight')
+        plt.close(fig)
+        files.append(file)
+
+    fig = plt.figure(figsize=(12, 5))
+    ax1 = fig.add_subplot(111)
+    ax1.plot(yr, data['Ai']/1000000, label='Intertidal area Ai (km$^2$)', linewidth=1.5, linestyle='--', marker='o', markersize=4, color="b")
+    ax1.plot(yr, data['Ac']/1000000, label='Channel area Ac (km$^2$)', linewidth=1.5, linestyle='-', marker='s', markersize=4, color="#3CB371")
+    ax1.set_xlabel('Year')
+    ax1.set_ylabel('Area (km$^2$)')
+    plt.grid()
+    plt.minorticks_on()
+    plt.xticks(np.arange(0, a, 5))
+    plt.xlim(0, a)
+    ax2 = ax1.twinx()
+    ax2.plot(yr, data['at'], label='Adaptation Time Scale at (years)', linewidth=1, linestyle='--', marker='^', markersize=4, color='r')
+    ax2.set_ylabel('at (years)', color='r')
+    ax2.tick_params(axis='y', labelcolor='r')
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines1 + lines2, labels1 + labels2, loc='best', fontsize=11)
+    finish(fig, 'Long-Term Projection of Ai, Ac, and at over time', '01-Long-Term Trajectory of Ai, Ac and at over time')
+
+    fig = plt.figure(figsize=(12, 5))
+    plt.plot(yr, data['hi'], label='Intertidal Depth (hi)', color='b', linewidth=1.5, linestyle='-', marker='o', markersize=4)
+    plt.plot(yr, data['hc'], label='Channel Depth (hc)', color='#3CB371', linewidth=1.5, linestyle='-', marker='s', markersize=4)
+    finish(fig, 'Long-Term Projection of hi and hc', '02-Long-Term Trajectory of hi and hc', 'Depth (m)')
+
+    fig = plt.figure(figsize=(12, 5))
+    plt.plot(yr, data['Vi'], label='Intertidal Volume (Vi-m$^3$)', color='b', linewidth=1.5, linestyle='-', marker='o', markersize=4)
+    plt.plot(yr, data['Vc'], label='Channel Volume (Vc-m$^3$)', color='#3CB371', linewidth=1.5, linestyle='-', marker='s', markersize=4)
+    plt.plot(yr, data['Vd'], label='Delta Volume (Vd-m$^3$)', color='#DAA520', linewidth=1.5, linestyle='-', marker='v', markersize=4)
+    finish(fig, 'Long-Term Projection of Vi, Vc and Vd', '03-Long-Term Trajectory of Vi, Vc and Vd', 'Volume (m$^3$)')
+
+    fig = plt.figure(figsize=(12, 5))
+    plt.plot(yr, data['sedVi'], label='Intertidal Sed. Volume (sedVi-m$^3$)', color='b', linewidth=1., linestyle='-', marker='o', markersize=4)
+    plt.plot(yr, data['sedVc'], label='Channel Sed. Volume (sedVc-m$^3$)', color='#3CB371', linewidth=1., linestyle='-', marker='s', markersize=4)
+    plt.plot(yr, data['sedVd'], label='Delta Sed. Volume (sedVd-m$^3$)', color='#DAA520', linewidth=1., linestyle='-', marker='v', markersize=4)
+    finish(fig, 'Long-Term Projection of sedVi, sedVc, sedVd and sedVs',
+           '04-Long-Term Trajectory of sedVi, sedVc, sedVd and sedVs', 'Volume (m$^3$)')
+
+    fig = plt.figure(figsize=(12, 5))
+    plt.plot(yr, data['Qci'], label='Qci-m$^3$/year', color='#DC143C', linewidth=1., linestyle='-', marker='o', markersize=4)
+    plt.plot(yr, data['Qcd'], label='Qcd-m$^3$/year', color='#3CB371', linewidth=1., linestyle='-', marker='s', markersize=4)
+    plt.plot(yr, data['Qcs'], label='Qcs-m$^3$/year', color='#8B008B', linewidth=1., linestyle='-', marker='*', markersize=4)
+    plt.plot(yr, data['Qso'], label='Qso-m$^3$/year', color='#DAA520', linewidth=1., linestyle='-', marker='v', markersize=4)
+    finish(fig, 'Long-Term Trajectory of Qci, Qcd, Qcs and Qso', '05-Long-Term Trajectory of Qci, Qcd, Qcs and Qso',
+           'Volume (m$^3$/year)')
+    return files
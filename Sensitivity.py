@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Global sensitivity analysis (Sobol, Morris) of the MorQuest model
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from morQuest import BATCH_KEYS, morquest_set_input, Run_morquest_batch
+
+#Default outputs: state at the end of the horizon
+VARIABLES = ['sedVd', 'Vs', 'Ai', 'at']
+
+
+def _setup(base, bounds, variables, years):
+    names = list(bounds)
+    unknown = [name for name in names if name not in BATCH_KEYS]
+    if unknown:
+        raise ValueError(f"Cannot vary {unknown}; parameters must be among {BATCH_KEYS}")
+    input = morquest_set_input(**base)
+    years = np.atleast_1d(years).tolist()
+    labels = pd.MultiIndex.from_product([list(variables), years], names=['variable', 'year'])
+    lower = np.array([bounds[name][0] for name in names], dtype=float)
+    upper = np.array([bounds[name][1] for name in names], dtype=float)
+    return input, names, labels, lower, upper
+
+
+def _evaluate(input, names, X, variables, years):
+    # One batched run of all rows of X ([member, parameter]); returns outputs as [member, variable * year]
+    batch = dict(input, **{name: X[:, k] for k, name in enumerate(names)})
+    with np.errstate(all='ignore'):
+        series = Run_morquest_batch(batch, output=variables).series
+    return np.column_stack([series[variable][:, years] for variable in variables])
+
+
+def _half_width(estimates):
+    # 95% confidence half-width of the mean of per-chunk estimates (batch means)
+    if len(estimates) < 2:
+        return np.full(np.shape(estimates[0]), np.inf)
+    with np.errstate(all='ignore'):
+        return 1.96 * np.nanstd(estimates, axis=0, ddof=1) / np.sqrt(len(estimates))
+
+
+def _converged(half_width, tol, chunks, min_chunks=4):
+    finite = half_width[np.isfinite(half_width)]
+    return tol is not None and chunks >= min_chunks and finite.size > 0 and finite.max() < tol
+
+
+def _sobol(n, sum_y, sum_y2, sum_s1, sum_st):
+    # First order and total indices from the accumulated sums
+    with np.errstate(all='ignore'):
+        variance = sum_y2 / (2 * n) - (sum_y / (2 * n)) ** 2
+        return sum_s1 / n[:, None] / variance[:, None], 0.5 * sum_st / n[:, None] / variance[:, None]
+
+
+def iter_sobol(base, bounds, variables=VARIABLES, years=-1, chunk_size=128, max_samples=2 ** 14, seed=0):
+    """
+    Sobol indices updated chunk by chunk (generator).
+
+    Each chunk draws chunk_size base samples of a scrambled Sobol sequence, forms the Saltelli design (matrices A, B
+    and A with column i from B) and runs the (d + 2) * chunk_size members as one batch. First order indices use the
+    Saltelli (2010) estimator and total indices the Jansen estimator; both are sums over samples, so the indices are
+    updated without keeping the model outputs.
+
+    Parameters:
+    - base (dict): morquest_set_input values of the parameters that are not varied.
+    - bounds (dict): Varied parameter -> (low, high), uniform in between.
+    - variables (list): Output series, e.g. ['sedVd', 'Vs', 'Ai', 'at'].
+    - years (int or list): Time index(es) of the outputs (-1: end of the horizon).
+    - chunk_size (int): Base samples per chunk, preferably a power of 2.
+    - max_samples (int): Stop after this many base samples.
+    - seed (int): Seed of the scrambled sequence.
+
+    Yields:
+    - dict: 'n' (valid base samples per output), 'S1' and 'ST' (DataFrames, outputs x parameters), 'S1_conf' and
+      'ST_conf' (95% confidence half-widths from the spread of the per-chunk estimates), 'chunks'.
+    """
+    input, names, labels, lower, upper = _setup(base, bounds, variables, years)
+    years = np.atleast_1d(years).tolist()
+    d, m = len(names), len(labels)
+    sampler = qmc.Sobol(2 * d, scramble=True, seed=seed)
+    n = np.zeros(m)
+    sum_y, sum_y2 = np.zeros(m), np.zeros(m)
+    sum_s1, sum_st = np.zeros((m, d)), np.zeros((m, d))
+    shift = None
+    chunks = []
+    drawn = 0
+    while drawn < max_samples:
+        size = min(chunk_size, max_samples - drawn)
+        U = qmc.scale(sampler.random(size), np.tile(lower, 2), np.tile(upper, 2))
+        A, B = U[:, :d], U[:, d:]
+        AB = np.repeat(A[None], d, axis=0)
+        for i in range(d):
+            AB[i, :, i] = B[:, i]
+        Y = _evaluate(input, names, np.concatenate([A, B, AB.reshape(-1, d)]), variables, years)
+        if shift is None:
+            shift = np.nanmean(Y[:size], axis=0)                            #reference level; keeps the sums well conditioned
+            shift = np.where(np.isfinite(shift), shift, 0)
+        Y = Y - shift
+        fA, fB, fAB = Y[:size], Y[size:2 * size], Y[2 * size:].reshape(d, size, m)
+        valid = np.isfinite(fA) & np.isfinite(fB) & np.all(np.isfinite(fAB), axis=0)      #drop failed runs
+        fA, fB, fAB = np.where(valid, fA, 0), np.where(valid, fB, 0), np.where(valid, fAB, 0)
+        sums = (valid.sum(axis=0), (fA + fB).sum(axis=0), (fA ** 2 + fB ** 2).sum(axis=0),
+                np.einsum('sm,dsm->md', fB, fAB - fA), np.einsum('dsm->md', (fA - fAB) ** 2))
+        n, sum_y, sum_y2, sum_s1, sum_st = [total + part for total, part in zip((n, sum_y, sum_y2, sum_s1, sum_st), sums)]
+        chunks.append(np.stack(_sobol(*sums)))
+        drawn += size
+
+        S1, ST = _sobol(n, sum_y, sum_y2, sum_s1, sum_st)
+        S1_conf, ST_conf = _half_width(chunks)
+        yield {'n': pd.Series(n.astype(int), index=labels),
+               'S1': pd.DataFrame(S1, index=labels, columns=names),
+               'ST': pd.DataFrame(ST, index=labels, columns=names),
+               'S1_conf': pd.DataFrame(S1_conf, index=labels, columns=names),
+               'ST_conf': pd.DataFrame(ST_conf, index=labels, columns=names),
+               'chunks': len(chunks)}
+
+
+def sobol_indices(base, bounds, variables=VARIABLES, years=-1, chunk_size=128, max_samples=2 ** 14, tol=0.05, seed=0,
+                  callback=None):
+    """
+    First order and total Sobol indices, stopping early once they converge.
+
+    Parameters: as iter_sobol, plus
+    - tol (float): Stop when the confidence half-width of every index is below tol (after at least 4 chunks);
+      None runs all max_samples.
+    - callback (callable): Called with every intermediate result, e.g. for progress reports.
+
+    Returns:
+    - dict: Last result of iter_sobol, with 'converged'.
+    """
+    for result in iter_sobol(base, bounds, variables, years, chunk_size, max_samples, seed):
+        if callback is not None:
+            callback(result)
+        half_width = np.concatenate([result['S1_conf'].to_numpy(), result['ST_conf'].to_numpy()])
+        if _converged(half_width, tol, result['chunks']):
+            return dict(result, converged=True)
+    return dict(result, converged=False)
+
+
+def _morris_trajectories(r, d, levels, rng):
+    # r one-at-a-time trajectories of d + 1 points on a grid in [0, 1]; returns points, moved parameter and step
+    delta = levels / (2 * (levels - 1))
+    start = rng.integers(0, levels // 2, size=(r, d)) / (levels - 1)
+    sign = rng.choice([-1.0, 1.0], size=(r, d))
+    start = np.where(sign > 0, start, start + delta)
+    order = np.argsort(rng.random((r, d)), axis=1)
+    points = np.repeat(start[:, None], d + 1, axis=1)
+    for j in range(d):
+        moved = order[:, j]
+        points[np.arange(r), j + 1:, moved] += sign[np.arange(r), moved][:, None] * delta
+    return points, order, sign[np.arange(r)[:, None], order] * delta
+
+
+def iter_morris(base, bounds, variables=VARIABLES, years=-1, chunk_size=64, max_trajectories=1024, levels=4, seed=0):
+    """
+    Morris elementary effects updated chunk by chunk (generator).
+
+    Each chunk runs chunk_size trajectories of d + 1 points as one batch. Effects are expressed per unit of the
+    normalized parameter range, so mu_star ranks parameters with different units.
+
+    Parameters:
+    - base, bounds, variables, years: see iter_sobol.
+    - chunk_size (int): Trajectories per chunk.
+    - max_trajectories (int): Stop after this many trajectories.
+    - levels (int): Number of grid levels (even).
+    - seed (int): Seed of the random trajectories.
+
+    Yields:
+    - dict: 'n' (valid effects per output), 'mu', 'mu_star' and 'sigma' (DataFrames, outputs x parameters),
+      'mu_star_conf' (95% confidence half-width of mu_star), 'chunks'.
+    """
+    input, names, labels, lower, upper = _setup(base, bounds, variables, years)
+    years = np.atleast_1d(years).tolist()
+    d, m = len(names), len(labels)
+    rng = np.random.default_rng(seed)
+    n = np.zeros((m, d))
+    sum_e, sum_abs, sum_e2 = np.zeros((m, d)), np.zeros((m, d)), np.zeros((m, d))
+    chunks = []
+    drawn = 0
+    while drawn < max_trajectories:
+        size = min(chunk_size, max_trajectories - drawn)
+        points, order, step = _morris_trajectories(size, d, levels, rng)
+        Y = _evaluate(input, names, lower + points.reshape(-1, d) * (upper - lower), variables, years)
+        Y = Y.reshape(size, d + 1, m)
+        effect = (Y[:, 1:] - Y[:, :-1]) / step[:, :, None]                #[trajectory, step, output]
+        E = np.full((size, d, m), np.nan)
+        E[np.arange(size)[:, None], order] = effect                        #reorder steps to parameters
+        valid = np.isfinite(E)
+        E = np.where(valid, E, 0)
+        n = n + valid.sum(axis=0).T
+        sum_e = sum_e + E.sum(axis=0).T
+        sum_abs = sum_abs + np.abs(E).sum(axis=0).T
+        sum_e2 = sum_e2 + (E ** 2).sum(axis=0).T
+        with np.errstate(all='ignore'):
+            chunks.append(np.abs(E).sum(axis=0).T / valid.sum(axis=0).T)
+        drawn += size
+
+        with np.errstate(all='ignore'):
+            mu = sum_e / n
+            sigma = np.sqrt(np.maximum(sum_e2 / n - mu ** 2, 0) * n / (n - 1))
+        yield {'n': pd.DataFrame(n.astype(int), index=labels, columns=names),
+               'mu': pd.DataFrame(mu, index=labels, columns=names),
+               'mu_star': pd.DataFrame(sum_abs / n, index=labels, columns=names),
+               'sigma': pd.DataFrame(sigma, index=labels, columns=names),
+               'mu_star_conf': pd.DataFrame(_half_width(chunks), index=labels, columns=names),
+               'chunks': len(chunks)}
+
+
+def morris_indices(base, bounds, variables=VARIABLES, years=-1, chunk_size=64, max_trajectories=1024, levels=4,
+                   tol=0.05, seed=0, callback=None):
+    """
+    Morris screening, stopping early once the ranking measure converges.
+
+    Parameters: as iter_morris, plus
+    - tol (float): Stop when the confidence half-width of mu_star, relative to the largest mu_star of the output, is
+      below tol (after at least 4 chunks); None runs all max_trajectories.
+    - callback (callable): Called with every intermediate result.
+
+    Returns:
+    - dict: Last result of iter_morris, with 'converged'.
+    """
+    for result in iter_morris(base, bounds, variables, years, chunk_size, max_trajectories, levels, seed):
+        if callback is not None:
+            callback(result)
+        with np.errstate(all='ignore'):
+            scale = np.nanmax(result['mu_star'].to_numpy(), axis=1, keepdims=True)
+            half_width = result['mu_star_conf'].to_numpy() / scale
+        if _converged(half_width, tol, result['chunks']):
+            return dict(result, converged=True)
+    return dict(result, converged=False)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Columnar multi-scenario store for morQuest results
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import json
+import os
+import numpy as np
+
+import Instrument
+from morQuest import BATCH_KEYS, PRECISIONS, downcast, merge_deviation
+
+# Layout of a store directory:
+#   store.json            manifest: variables and their lengths, parameter keys, event names, list of chunks,
+#                         storage precision and the largest relative deviation of each stored variable from its
+#                         float64 values
+#   main-000000.npz ...   compressed chunks; each variable is its own [scenario, year] member, so a
+#                         variable can be read without decompressing the others; next to them the members params,
+#                         slrtype, ids and event_<name> (first year of each event, -1: not reached)
+#   shards/<name>/        per-worker shards with the same layout, merged into the store with merge_shards()
+MANIFEST = 'store.json'
+PARAM_KEYS = BATCH_KEYS + ['dur']
+
+
+class ResultStore:
+    """
+    Append-only, chunked and compressed store of morQuest results laid out as [scenario, variable, year],
+    with a parameter table indexed by the morquest_set_input keys.
+
+    Parameters:
+    - path (str): Store directory, created if missing.
+    - variables (list): Time series to keep (default: every series of the first appended result except 'yr').
+    - chunk_size (int): Number of scenarios buffered before a chunk is written.
+    - shard (str): Write into the per-worker shard 'shards/<shard>' instead of the main store. Each process of a
+      pool writes its own shard; the parent merges them with ResultStore(path).merge_shards().
+    - precision (str): Store the series as 'float64' or 'float32' (default: as appended, e.g. float32 results of
+      Run_morquest_batch(..., precision='float32')).
+    """
+
+    def __init__(self, path, variables=None, chunk_size=1024, shard=None, precision=None):
+        self.root = path
+        self.shard = shard
+        self.path = os.path.join(path, 'shards', shard) if shard else path
+        self.chunk_size = chunk_size
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = self._read_manifest(self.path)
+        if variables is not None and self.manifest['variables'] and list(variables) != list(self.manifest['variables']):
+            raise ValueError(f"Store {self.path} already holds variables {list(self.manifest['variables'])}")
+        self._variables = list(variables) if variables is not None else None
+        if precision is not None and precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}; use one of {list(PRECISIONS)}")
+        self.precision = precision or self.manifest.get('precision')
+        self._buffer = []
+
+    @staticmethod
+    def _read_manifest(path):
+        manifest_file = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                return json.load(f)
+        return {'format': 1, 'variables': {}, 'param_keys': PARAM_KEYS, 'chunks': [], 'n_scenarios': 0}
+
+    def _write_manifest(self):
+        manifest_file = os.path.join(self.path, MANIFEST)
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    def __len__(self):
+        return self.manifest['n_scenarios'] + sum(len(rows['slrtype']) for rows in self._buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    @property
+    def variables(self):
+        return list(self.manifest['variables'])
+
+    @property
+    def deviation(self):
+        # Largest relative deviation of each stored variable from its float64 values (empty for float64 data)
+        return dict(self.manifest.get('deviation', {}))
+
+    def append(self, result, ids=None):
+        # Accepts a single-scenario or batched MorquestResult; ids optionally numbers the scenarios (e.g. their
+        # position in a sweep), otherwise they are numbered by their row in the store
+        if not self.manifest['variables']:
+            names = self._variables or [key for key in result.series if key != 'yr']
+            self.manifest['variables'] = {name: int(np.shape(result.series[name])[-1]) for name in names}
+        rows = {}
+        for name, length in self.manifest['variables'].items():
+            value = np.atleast_2d(result.series[name])
+            if value.shape[1] != length:
+                raise ValueError(f"Variable {name} has {value.shape[1]} values per scenario, the store expects {length}")
+            rows[name] = value
+        if 'events' not in self.manifest:
+            self.manifest['events'] = list(result.events)
+        elif set(result.events) != set(self.manifest['events']):
+            raise ValueError(f"Store {self.path} holds events {self.manifest['events']}, the result {list(result.events)}")
+        deviation = {name: value for name, value in result.deviation.items() if name in rows}
+        if self.precision:
+            cast, lost = downcast({name: value for name, value in rows.items()
+                                   if value.dtype != PRECISIONS[self.precision]}, self.precision)
+            rows.update(cast)
+            deviation = merge_deviation(deviation, lost)
+            self.manifest['precision'] = self.precision
+        if deviation:
+            self.manifest['deviation'] = merge_deviation(self.manifest.get('deviation', {}), deviation)
+        n = result.n_scenarios if ids is None else len(ids)
+        rows['params'] = np.column_stack([np.broadcast_to(np.asarray(result.params.get(key, np.nan), dtype=float), (n,))
+                                          for key in PARAM_KEYS])
+        rows['slrtype'] = np.broadcast_to(np.asarray(result.params.get('slrtype', ''), dtype=str), (n,))
+        rows['ids'] = np.full(n, -1) if ids is None else np.asarray(ids, dtype=np.int64)
+        for name in self.manifest['events']:
+            rows['event_' + name] = np.broadcast_to(np.asarray(result.events[name], dtype=np.int64), (n,))
+        self._buffer.append(rows)
+        if sum(len(rows['slrtype']) for rows in self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chunk = {key: np.concatenate([rows[key] for rows in self._buffer]) for key in self._buffer[0]}
+        self._buffer = []
+        name = f"{self.shard or 'main'}-{len(self.manifest['chunks']):06d}.npz"
+        np.savez_compressed(os.path.join(self.path, name), **chunk)
+        Instrument.add_file('bytes_written.store', os.path.join(self.path, name))
+        self.manifest['chunks'].append({'file': name, 'count': len(chunk['slrtype'])})
+        self.manifest['n_scenarios'] += len(chunk['slrtype'])
+        self._write_manifest()
+
+    def close(self):
+        self.flush()
+
+    def merge_shards(self):
+        # Move every shard's chunks into the main store (no recompression), in shard-name order. The main manifest
+        # lists a shard's chunks and their pending moves before any file is moved, so the next call completes a
+        # merge that was killed halfway
+        shards_dir = os.path.join(self.path, 'shards')
+        if not os.path.isdir(shards_dir):
+            return 0
+        self.flush()
+        self._finish_merge()
+        merged = 0
+        for shard in sorted(os.listdir(shards_dir)):
+            shard_dir = os.path.join(shards_dir, shard)
+            manifest = self._read_manifest(shard_dir)
+            if not manifest['chunks']:
+                continue
+            if not self.manifest['variables']:
+                self.manifest['variables'] = manifest['variables']
+            elif manifest['variables'] != self.manifest['variables']:
+                raise ValueError(f"Shard {shard} holds different variables than {self.path}")
+            if 'events' not in self.manifest:
+                self.manifest['events'] = manifest.get('events', [])
+            elif set(manifest.get('events', [])) != set(self.manifest['events']):
+                raise ValueError(f"Shard {shard} holds different events than {self.path}")
+            if manifest.get('deviation'):
+                self.manifest['deviation'] = merge_deviation(self.manifest.get('deviation', {}), manifest['deviation'])
+            if manifest.get('precision'):
+                self.manifest['precision'] = manifest['precision']
+            moves = []
+            for chunk in manifest['chunks']:
+                name = f"main-{len(self.manifest['chunks']):06d}.npz"
+                moves.append([os.path.join('shards', shard, chunk['file']), name])
+                self.manifest['chunks'].append({'file': name, 'count': chunk['count']})
+                self.manifest['n_scenarios'] += chunk['count']
+                merged += chunk['count']
+            self.manifest['pending'] = {'shard': shard, 'moves': moves}
+            self._write_manifest()
+            self._finish_merge()
+        return merged
+
+    def _finish_merge(self):
+        # Moves of the shard being merged (a file already moved is skipped), then removal of the shard; the pending
+        # record goes last, once the shard can no longer be merged twice
+        pending = self.manifest.get('pending')
+        if pending is None:
+            return
+        for source, target in pending['moves']:
+            if os.path.exists(os.path.join(self.path, source)):
+                os.replace(os.path.join(self.path, source), os.path.join(self.path, target))
+        shard_dir = os.path.join(self.path, 'shards', pending['shard'])
+        if os.path.exists(os.path.join(shard_dir, MANIFEST)):
+            os.remove(os.path.join(shard_dir, MANIFEST))
+        if os.path.isdir(shard_dir):
+            os.rmdir(shard_dir)
+        del self.manifest['pending']
+        self._write_manifest()
+
+    def read(self, variable, year=None, scenarios=None):
+        """
+        Read one variable for all (or the selected) scenarios without loading the other variables.
+
+        Parameters:
+        - variable (str): Variable name, e.g. 'Qcs'.
+        - year (int, slice or list): Time index(es) to keep; None keeps the whole series.
+        - scenarios (array): Scenario numbers to keep; None keeps all.
+
+        Returns:
+        - ndarray: [scenario, year] array, or [scenario] when year is an int.
+        """
+        if variable not in self.manifest['variables']:
+            raise KeyError(f"Variable {variable} is not in the store; available: {self.variables}")
+        parts = []
+        for chunk in self.manifest['chunks']:
+            with np.load(os.path.join(self.path, chunk['file'])) as data:
+                value = data[variable]
+            parts.append(value if year is None else value[:, year])
+        out = np.concatenate(parts) if parts else np.empty((0, self.manifest['variables'][variable]))
+        return out if scenarios is None else out[scenarios]
+
+    def params(self):
+        # Parameter table of all stored scenarios, one row per stored scenario (same order as read()), indexed by
+        # the scenario ids given to append()
+        import pandas as pd
+        parts, slrtype, ids = [], [], []
+        for chunk in self.manifest['chunks']:
+            with np.load(os.path.join(self.path, chunk['file'])) as data:
+                parts.append(data['params'])
+                slrtype.append(data['slrtype'])
+                ids.append(data['ids'])
+        table = pd.DataFrame(np.concatenate(parts) if parts else np.empty((0, len(PARAM_KEYS))),
+                             columns=self.manifest['param_keys'])
+        table['slrtype'] = np.concatenate(slrtype) if slrtype else []
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        table.index = pd.Index(np.where(ids >= 0, ids, np.arange(len(ids))), name='scenario')
+        return table
+
+    def events(self):
+        # First year of every stored event (-1: not reached), one row per stored scenario like params()
+        import pandas as pd
+        names = self.manifest.get('events', [])
+        columns, ids = {name: [] for name in names}, []
+        for chunk in self.manifest['chunks']:
+            with np.load(os.path.join(self.path, chunk['file'])) as data:
+                for name in names:
+                    columns[name].append(data['event_' + name])
+                ids.append(data['ids'])
+        table = pd.DataFrame({name: np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+                              for name, parts in columns.items()})
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        table.index = pd.Index(np.where(ids >= 0, ids, np.arange(len(ids))), name='scenario')
+        return table
+
+    def select(self, variable, year, by=None):
+        # e.g. store.select('Qcs', 50, by='ssc'): Qcs at year 50 next to the ssc value of every scenario
+        table = self.params()
+        if by is not None:
+            table = table[[by] if isinstance(by, str) else list(by)]
+        table = table.copy()
+        table[variable] = self.read(variable, year)
+        return table
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Fast emulator of morQuest output series trained on batched ensembles
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import json
+import warnings
+from itertools import combinations_with_replacement
+import numpy as np
+import pandas as pd
+from numpy.polynomial import legendre
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.optimize import minimize
+from scipy.stats import qmc
+
+from morQuest import BATCH_KEYS, morquest_set_input, Run_morquest_batch
+
+# The emulator replaces Run_morquest for parameters within given bounds, around a fixed base input. Training runs
+# sample the bounds with a scrambled Sobol sequence and are computed as one batch. The series of each variable
+# ([member, year]) are standardized per year and reduced to their leading principal components (PCA), which keep
+# 1 - var_tol of the variance. The score of every component is a smooth function of the parameters, fitted by:
+#   'gp'   Gaussian process with a squared exponential kernel, one length scale per parameter, fitted by maximum
+#          likelihood; the prediction variance follows from the kernel
+#   'poly' polynomial chaos: Legendre polynomials of total degree <= degree, fitted by least squares; the prediction
+#          variance is that of the regression
+# A prediction maps the component scores back to the series, with the variance of the discarded components added.
+# Queries outside the bounds are run with the model itself. Non-finite outputs (e.g. hi of a drowned intertidal
+# area) are emulated as 0.
+
+#Default outputs
+VARIABLES = ['Ai', 'Ac', 'Vc', 'sedVd']
+
+
+def _sample(names, lower, upper, n, seed):
+    # Scrambled Sobol points in the bounds, [member, parameter]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)                    #balance warning when n is not a power of 2
+        return qmc.scale(qmc.Sobol(len(names), scramble=True, seed=seed).random(n), lower, upper)
+
+
+def _run(input, names, X, variables):
+    # Output series [member, year] of every variable for the rows of X
+    with np.errstate(all='ignore'):
+        series = Run_morquest_batch(dict(input, **{name: X[:, k] for k, name in enumerate(names)}),
+                                    output=variables).series
+    return {variable: np.nan_to_num(np.atleast_2d(series[variable]), nan=0.0, posinf=0.0, neginf=0.0)
+            for variable in variables}
+
+
+def _sq_distance(U, V, scale):
+    # Squared scaled distances, [component, row of U, row of V]
+    return np.einsum('mnd,cd->cmn', (U[:, None, :] - V[None, :, :]) ** 2, 1 / scale ** 2)
+
+
+def _gp_fit(U, y):
+    # Log length scales, signal and noise variance of one GP by maximum likelihood (analytic gradient)
+    n, d = U.shape
+    diff2 = (U[:, None, :] - U[None, :, :]) ** 2                        #[n, n, parameter]
+
+    def nll(theta):
+        scale, s2, noise = np.exp(theta[:d]), np.exp(theta[d]), np.exp(theta[d + 1])
+        R = np.exp(-0.5 * np.einsum('ijd,d->ij', diff2, 1 / scale ** 2))
+        K = s2 * R + (noise + 1e-10) * np.eye(n)
+        try:
+            factor = cho_factor(K, lower=True)
+        except np.linalg.LinAlgError:
+            return 1e10, np.zeros(d + 2)
+        alpha = cho_solve(factor, y)
+        value = 0.5 * y @ alpha + np.log(np.diag(factor[0])).sum()
+        W = np.outer(alpha, alpha) - cho_solve(factor, np.eye(n))      #dnll/dK = -W / 2
+        grad = np.empty(d + 2)
+        grad[:d] = -0.5 * np.einsum('ij,ij,ijd->d', W, s2 * R, diff2) / scale ** 2
+        grad[d] = -0.5 * np.sum(W * s2 * R)
+        grad[d + 1] = -0.5 * np.trace(W) * noise
+        return value, grad
+
+    theta0 = np.concatenate([np.full(d, np.log(0.3)), [0.0, np.log(1e-4)]])
+    limits = [(np.log(1e-2), np.log(1e2))] * d + [(np.log(1e-3), np.log(1e2)), (np.log(1e-10), np.log(1.0))]
+    return minimize(nll, theta0, jac=True, method='L-BFGS-B', bounds=limits).x
+
+
+def _poly_terms(d, degree):
+    # Exponents of the Legendre products of total degree <= degree, [term, parameter]
+    terms = [np.zeros(d, dtype=int)]
+    for total in range(1, degree + 1):
+        for combination in combinations_with_replacement(range(d), total):
+            terms.append(np.bincount(combination, minlength=d))
+    return np.array(terms)
+
+
+def _poly_design(U, terms):
+    # Legendre polynomials of the parameters scaled to [-1, 1], [row, term]
+    P = legendre.legvander(2 * U - 1, terms.max())                      #[row, parameter, degree]
+    return np.prod(P[:, np.arange(U.shape[1])[None, :], terms], axis=2)
+
+
+class Emulator:
+    """
+    Surrogate of morQuest output series; see train_emulator.
+
+    Parameters:
+    - input (dict): morquest_set_input dictionary of the fixed parameters.
+    - bounds (dict): Parameter -> (low, high) of the trained domain.
+    - variables (list): Emulated output series.
+    - method (str): 'gp' or 'poly'.
+    - model (dict): Fitted arrays (see train_emulator).
+    """
+
+    def __init__(self, input, bounds, variables, method, model):
+        self.input = input
+        self.bounds = {name: (float(low), float(high)) for name, (low, high) in bounds.items()}
+        self.names = list(bounds)
+        self.variables = list(variables)
+        self.method = method
+        self.model = model
+        self.lower = np.array([low for low, high in self.bounds.values()])
+        self.width = np.array([high for low, high in self.bounds.values()]) - self.lower
+        self.validation = None
+        self.fallbacks = 0                                              #queries run with the model
+        # Components of all variables side by side, evaluated together
+        sizes = np.cumsum([0] + [len(model[variable]['basis']) for variable in self.variables])
+        self.slices = {variable: slice(a, b) for variable, a, b in zip(self.variables, sizes[:-1], sizes[1:])}
+        keys = ['scale', 's2', 'alpha', 'Kinv'] if method == 'gp' else ['coef', 'sigma2']
+        axis = {'coef': 1, 'sigma2': 0}
+        self.stacked = {key: np.concatenate([model[variable][key] for variable in self.variables], axis=axis.get(key, 0))
+                        for key in keys}
+
+    def _matrix(self, values):
+        # Query dict (scalars or arrays; missing parameters at their input value) -> [query, parameter]
+        unknown = [name for name in values if name not in self.names]
+        if unknown:
+            raise ValueError(f'{unknown} are not parameters of the emulator ({self.names})')
+        columns = [np.atleast_1d(np.asarray(values.get(name, self.input[name]), dtype=float)) for name in self.names]
+        return np.column_stack(np.broadcast_arrays(*columns))
+
+    def _scores(self, U, variance):
+        # Mean and variance (None unless variance) of the component scores of all variables, [query, component]
+        m, first = self.stacked, self.model[self.variables[0]]
+        var = None
+        if self.method == 'gp':
+            distance = (U[:, None, :] - first['U'][None, :, :]) ** 2                   #[query, train, parameter]
+            exponent = np.minimum(0.5 * (distance @ (1 / m['scale'] ** 2).T), 700)   #no subnormals (slow exp)
+            Ks = m['s2'][:, None, None] * np.exp(-exponent.transpose(2, 0, 1))        #[component, query, train]
+            mean = (Ks @ m['alpha'][:, :, None])[..., 0].T
+            if variance:
+                var = m['s2'][None, :] - np.sum((Ks @ m['Kinv']) * Ks, axis=2).T      #O(train^2) per query
+        else:
+            phi = _poly_design(U, first['terms'])
+            mean = phi @ m['coef']
+            if variance:
+                var = np.einsum('mt,tk,mk->m', phi, first['XtXinv'], phi)[:, None] * m['sigma2'][None, :]
+        return mean, None if var is None else np.maximum(var, 0)
+
+    def predict(self, values=None, return_std=False, fallback=True, max_std=None, **params):
+        """
+        Emulated output series.
+
+        Parameters:
+        - values (dict): Parameter -> value or array of values (one query per element); also given as keywords.
+          Parameters that are not given take their value in the base input.
+        - return_std (bool): Also return the standard deviation of the emulation error.
+        - fallback (bool): Run queries outside the trained bounds with Run_morquest_batch (std 0); otherwise they
+          are extrapolated.
+        - max_std (float): Also run the queries whose emulation std exceeds max_std times the spread of the
+          training outputs, in any year of any variable (e.g. near the drowning of the intertidal area). The mean
+          alone takes microseconds; the std grows with the square of the number of training runs.
+
+        Returns:
+        - dict: Variable -> series, [query, year] ([year] for a single query); with return_std, a tuple of (mean,
+          std) dicts.
+        """
+        X = self._matrix(dict(values or {}, **params))
+        U = (X - self.lower) / self.width
+        variance = return_std or max_std is not None
+        mean, std = {}, {}
+        outside = ~np.all((U >= -1e-12) & (U <= 1 + 1e-12), axis=1)
+        scores, var = self._scores(U, variance)
+        for variable in self.variables:
+            m, part = self.model[variable], self.slices[variable]
+            mean[variable] = m['mean'] + (scores[:, part] @ m['basis']) * m['std']
+            if variance:
+                std[variable] = np.sqrt(var[:, part] @ m['basis'] ** 2 + m['residual']) * m['std']
+                if max_std is not None:
+                    outside |= np.any(std[variable] > max_std * m['std'], axis=1)
+        if fallback and outside.any():
+            self.fallbacks += int(outside.sum())
+            exact = _run(self.input, self.names, X[outside], self.variables)
+            for variable in self.variables:
+                mean[variable][outside] = exact[variable]
+                if variance:
+                    std[variable][outside] = 0
+        if X.shape[0] == 1 and all(np.ndim(value) == 0 for value in dict(values or {}, **params).values()):
+            mean, std = {key: x[0] for key, x in mean.items()}, {key: x[0] for key, x in std.items()}
+        return (mean, std) if return_std else mean
+
+    def save(self, path):
+        # Compressed .npz with the fitted arrays and a json header
+        arrays = {f'{variable}/{key}': value for variable in self.variables for key, value in self.model[variable].items()}
+        header = {'input': {key: value for key, value in self.input.items()
+                            if value is None or isinstance(value, (int, float, str, np.number))},
+                  'bounds': self.bounds, 'variables': self.variables, 'method': self.method,
+                  'validation': None if self.validation is None else self.validation.reset_index().to_dict('list')}
+        np.savez_compressed(path, header=json.dumps(header, default=float), **arrays)
+
+
+def _fit(U, Y, method, var_tol, max_components, degree):
+    # PCA of the standardized series Y ([member, year]) and a fit of every component score
+    mean = Y.mean(axis=0)
+    std = np.sqrt(np.mean((Y - mean) ** 2)) or 1.0                     #one scale for all years
+    Z = (Y - mean) / std
+    _, singular, Vt = np.linalg.svd(Z, full_matrices=False)
+    share = np.cumsum(singular ** 2) / max(np.sum(singular ** 2), 1e-300)
+    k = min(int(np.searchsorted(share, 1 - var_tol)) + 1, max_components, len(singular))
+    basis = Vt[:k]
+    scale = np.where(singular[:k] > 0, singular[:k] / np.sqrt(len(Z)), 1.0)   #std of each score
+    scores = Z @ basis.T / scale
+    residual = np.mean((Z - scores * scale @ basis) ** 2, axis=0)       #variance of the discarded components, per year
+    model = {'mean': mean, 'std': std, 'basis': basis * scale[:, None], 'residual': residual}
+    if method == 'gp':
+        theta = np.array([_gp_fit(U, scores[:, c]) for c in range(k)])
+        d = U.shape[1]
+        model.update({'U': U, 'scale': np.exp(theta[:, :d]), 's2': np.exp(theta[:, d]), 'alpha': np.empty((k, len(U))),
+                      'Kinv': np.empty((k, len(U), len(U)))})
+        K = model['s2'][:, None, None] * np.exp(-0.5 * _sq_distance(U, U, model['scale'])) \
+            + (np.exp(theta[:, d + 1]) + 1e-10)[:, None, None] * np.eye(len(U))
+        for c in range(k):
+            L = np.linalg.cholesky(K[c])
+            Linv = solve_triangular(L, np.eye(len(U)), lower=True)
+            model['Kinv'][c] = Linv.T @ Linv
+            model['alpha'][c] = model['Kinv'][c] @ scores[:, c]
+    else:
+        terms = _poly_terms(U.shape[1], degree)
+        if len(terms) >= len(U):
+            raise ValueError(f'{len(terms)} polynomial terms need more than {len(U)} training runs')
+        phi = _poly_design(U, terms)
+        coef, *_ = np.linalg.lstsq(phi, scores, rcond=None)
+        XtXinv = np.linalg.pinv(phi.T @ phi)
+        sigma2 = np.sum((scores - phi @ coef) ** 2, axis=0) / (len(U) - len(terms))
+        model.update({'terms': terms, 'coef': coef, 'XtXinv': XtXinv, 'sigma2': sigma2})
+    return model
+
+
+def train_emulator(base, bounds, variables=VARIABLES, n_train=256, n_test=64, method='gp', var_tol=1e-6,
+                   max_components=20, degree=3, seed=0):
+    """
+    Train an emulator of morQuest output series on a batched ensemble, and validate it on held-out runs.
+
+    Parameters:
+    - base (dict): morquest_set_input values of the parameters that are not varied (and the default of the varied
+      ones in queries).
+    - bounds (dict): Varied parameter -> (low, high), among BATCH_KEYS.
+    - variables (list): Output series to emulate.
+    - n_train (int): Training runs, preferably a power of 2.
+    - n_test (int): Held-out validation runs, drawn uniformly at random.
+    - method (str): 'gp' (Gaussian process) or 'poly' (polynomial chaos).
+    - var_tol (float): Share of the variance of each variable left to the discarded principal components.
+    - max_components (int): Largest number of principal components per variable.
+    - degree (int): Total degree of the polynomials ('poly').
+    - seed (int): Seed of the training and validation samples.
+
+    Returns:
+    - Emulator: the fitted emulator; its validation table gives, per variable, the number of components, the
+      root-mean-square and maximum error of the held-out runs relative to the spread of the output, and the share
+      of held-out values within the 95% prediction interval.
+    """
+    names = list(bounds)
+    unknown = [name for name in names if name not in BATCH_KEYS]
+    if unknown:
+        raise ValueError(f"Cannot vary {unknown}; parameters must be among {BATCH_KEYS}")
+    if method not in ('gp', 'poly'):
+        raise ValueError("method must be 'gp' or 'poly'")
+    input = morquest_set_input(**base)
+    lower = np.array([bounds[name][0] for name in names], dtype=float)
+    upper = np.array([bounds[name][1] for name in names], dtype=float)
+    X = _sample(names, lower, upper, n_train, seed)
+    Y = _run(input, names, X, variables)
+    U = (X - lower) / (upper - lower)
+    emulator = Emulator(input, bounds, variables, method,
+                        {variable: _fit(U, Y[variable], method, var_tol, max_components, degree) for variable in variables})
+
+    if n_test > 0:
+        X = lower + np.random.default_rng(seed).random((n_test, len(names))) * (upper - lower)
+        Y = _run(input, names, X, variables)
+        mean, std = emulator.predict(dict(zip(names, X.T)), return_std=True, fallback=False)
+        rows = []
+        for variable in variables:
+            spread = max(np.std(Y[variable]), 1e-300)
+            error = np.abs(mean[variable] - Y[variable])
+            rows.append({'variable': variable, 'components': len(emulator.model[variable]['basis']),
+                         'rmse': np.sqrt(np.mean(error ** 2)) / spread, 'max': error.max() / spread,
+                         'coverage': np.mean(error <= 1.96 * std[variable] + 1e-12 * spread)})
+        emulator.validation = pd.DataFrame(rows).set_index('variable')
+    return emulator
+
+
+def load_emulator(path):
+    """
+    Emulator saved with Emulator.save.
+
+    Parameters:
+    - path (str): .npz file.
+
+    Returns:
+    - Emulator: the emulator, with its validation table.
+    """
+    with np.load(path) as data:
+        header = json.loads(str(data['header']))
+        model = {variable: {} for variable in header['variables']}
+        for key in data.files:
+            if key != 'header':
+                variable, name = key.split('/')
+                model[variable][name] = data[key]
+    emulator = Emulator(morquest_set_input(**header['input']), header['bounds'], header['variables'], header['method'],
+                        model)
+    if header['validation'] is not None:
+        emulator.validation = pd.DataFrame(header['validation']).set_index('variable')
+    return emulator
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Parallel scenario sweeps of the MorQuest model
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import Forcing
+import Instrument
+from morQuest import BATCH_KEYS, OUTPUT_KEYS, PRECISIONS, morquest_set_input, Run_morquest_batch
+from Store import ResultStore
+
+# A sweep directory contains:
+#   sweep.json     the sweep specification and its hash; a resumed sweep must match it
+#   done/<shard>   marker written by a worker once its shard is safely on disk
+#   forcing/       river series used by the sweep, memory-mapped read-only by the workers
+#   (store)        a ResultStore; workers write to store shards, merged in shard order when all are done
+
+#Inputs shared by all scenarios of one batch
+SHARED_KEYS = ['dur', 'plottimeres', 'slrtype', 'slrst', 'Qr_series', 'ssc_series', 'start']
+
+
+def parameter_grid(**axes):
+    """
+    Cartesian product of parameter values.
+
+    Example: parameter_grid(slr=[0.5, 1, 2], ssc=[0.1, 1]) gives 6 parameter sets.
+    """
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*(np.atleast_1d(axes[key]).tolist() for key in keys))]
+
+
+def _shards(scenarios, shard_size):
+    # Deterministic split: scenarios that can share one batch (same SHARED_KEYS) are grouped in order of first
+    # appearance, then cut into shards of at most shard_size scenarios
+    groups = {}
+    for i, scenario in enumerate(scenarios):
+        groups.setdefault(tuple(scenario[key] for key in SHARED_KEYS), []).append(i)
+    shards = [rows[k:k + shard_size] for rows in groups.values() for k in range(0, len(rows), shard_size)]
+    return [(f'shard-{k:06d}', rows) for k, rows in enumerate(shards)]
+
+
+def _run_shard(path, name, rows, columns, variables, curves, series, precision):
+    # Worker task: one batched run of all scenarios of the shard, written to its own store shard
+    Forcing.register_definitions(curves)
+    Forcing.register_shared(series)
+    input = morquest_set_input(**columns)
+    if isinstance(variables, set):                          # series to leave out of the default selection
+        variables = [key for key in OUTPUT_KEYS if key != 'yr' and key not in variables]
+    with np.errstate(all='ignore'):
+        result = Run_morquest_batch(input, output=variables, precision=precision)
+    with ResultStore(path, variables=variables, chunk_size=len(rows) + 1, shard=name, precision=precision) as store:
+        store.append(result, ids=rows)
+    marker = os.path.join(path, 'done', name)
+    with open(marker + '.tmp', 'w') as f:
+        f.write(str(len(rows)))
+    os.replace(marker + '.tmp', marker)
+    return name
+
+
+def run_sweep(path, scenarios, base=None, shard_size=256, max_workers=None, variables=None, precision='float64'):
+    """
+    Run many morQuest scenarios over a process pool, with checkpoint and resume.
+
+    Parameters:
+    - path (str): Sweep directory; results end up in a ResultStore at this path. Rows are grouped by shard; the
+      index of store.params() gives each row's position in scenarios.
+    - scenarios (list or dict): List of parameter sets (dicts of morquest_set_input keys), or a dict of value
+      lists expanded with parameter_grid.
+    - base (dict): morquest_set_input values shared by all scenarios.
+    - shard_size (int): Scenarios per task; each task is one vectorized Run_morquest_batch call.
+    - max_workers (int): Pool size (default: number of CPUs).
+    - variables (list): Time series to keep in the store (default: all; without 'slr' when slrtypes are mixed).
+    - precision (str): Storage precision of the series, 'float64' or 'float32' (see Run_morquest_batch); the
+      store's deviation reports the largest relative deviation of each series from float64.
+
+    Running the same sweep again after an interruption only computes the shards without a completion marker.
+
+    Returns:
+    - ResultStore: Store with the results of all scenarios.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; use one of {list(PRECISIONS)}")
+    if isinstance(scenarios, dict):
+        scenarios = parameter_grid(**scenarios)
+    defaults = morquest_set_input(**(base or {}))
+    scenarios = [dict(defaults, **scenario) for scenario in scenarios]
+    for scenario in scenarios:
+        # River series given as values go by a name derived from their values, so that the spec, the shard groups
+        # and the workers only see names
+        tt = np.arange(0, scenario['dur'] + 1, scenario['plottimeres'])
+        for key in ['Qr_series', 'ssc_series']:
+            scenario[key] = Forcing.name_series(scenario[key], tt, scenario['start'])
+    keys = BATCH_KEYS + SHARED_KEYS
+    slrtypes = [scenario['slrtype'] for scenario in scenarios]
+    series = [scenario[key] for scenario in scenarios for key in ['Qr_series', 'ssc_series']]
+
+    spec = {'keys': keys, 'shard_size': shard_size, 'variables': variables,
+            'scenarios': [[scenario[key] for key in keys] for scenario in scenarios],
+            'forcing': Forcing.fingerprint(slrtypes + series)}
+    if precision != 'float64':
+        spec['precision'] = precision
+    digest = hashlib.sha256(json.dumps(spec, default=float).encode()).hexdigest()
+    os.makedirs(os.path.join(path, 'done'), exist_ok=True)
+    spec_file = os.path.join(path, 'sweep.json')
+    if os.path.exists(spec_file):
+        with open(spec_file) as f:
+            if json.load(f)['hash'] != digest:
+                raise ValueError(f"{path} holds a different sweep; use a new directory")
+    else:
+        with open(spec_file, 'w') as f:
+            json.dump({'hash': digest, 'n_scenarios': len(scenarios), 'shard_size': shard_size}, f)
+
+    if variables is None:
+        # The linear forcing gives dur sea level values and the other curves dur+1, so a sweep mixing them
+        # cannot store 'slr' as a single column
+        variables = {'slr'} if 'linear' in slrtypes and len(set(slrtypes)) > 1 else set()
+
+    shards = _shards(scenarios, shard_size)
+    done = set(os.listdir(os.path.join(path, 'done')))
+    todo = []
+    for name, rows in shards:
+        if name in done:
+            continue
+        shutil.rmtree(os.path.join(path, 'shards', name), ignore_errors=True)      # partial output of a killed run
+        columns = {key: np.array([scenarios[i][key] for i in rows], dtype=float) for key in BATCH_KEYS}
+        for key in SHARED_KEYS:
+            columns[key] = scenarios[rows[0]][key]
+        todo.append((name, rows, columns))
+
+    if todo:
+        # Every forcing curve is computed once here; forked workers share these arrays, other workers compute
+        # each curve once per process. River series are mapped from .npy files rather than copied to the workers
+        curves = Forcing.definitions(slrtypes)
+        shared = Forcing.share_series(series, os.path.join(path, 'forcing'))
+        for slrtype, dur, slrst in {(columns['slrtype'], columns['dur'], columns['slrst']) for _, _, columns in todo}:
+            Forcing.slr_curve(slrtype, dur, slrst)
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            function = Instrument.task(_run_shard)
+            futures = [pool.submit(function, path, name, rows, columns, variables, curves, shared, precision)
+                       for name, rows, columns in todo]
+            for future in as_completed(futures):
+                Instrument.gather(future.result())
+
+    store = ResultStore(path, variables=None if isinstance(variables, set) else variables)
+    store.merge_shards()
+    return store
@@ -27,31 +27,130 @@
 # building the stack.
 # mreyec@uni.pe
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
+import os
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
 import math
 
-def analyze_tidal_data():
-    # Read tidal data
-    basin = pd.read_csv('Data/Tidal/d575a.csv', names=['Year', 'month', 'day', 'data'], skiprows=0)
-    basin = basin[basin['data'] >= 0]
-    basin['date'] = pd.to_datetime(basin[['Year', 'month', 'day']])
-    tidal_range = (basin['data'].max() + basin['data'].min())//2
+import Instrument
+import Loader
 
-    # Calculate the range (min and max) for each month
-    monthly_min_max = basin.groupby(basin['date'].dt.to_period('M')).agg({'data': ['min', 'max']})
-    monthly_min_max['mean'] = monthly_min_max[('data', 'min')] + (monthly_min_max[('data', 'max')] - monthly_min_max[('data', 'min')]) / 2
-    monthly_min_max.reset_index(inplace=True)
+# Daily tide gauge records (year, month, day, level in mm; one file per station). Monthly statistics are computed
+# chunk by chunk while the file is read and cached per station (see Loader.cached_table), so a station is parsed
+# once and the tidal range of an estuary is a lookup afterwards.
+TIDAL_DIR = 'Data/Tidal'
+SENTINEL = -32767                                                       #missing value of the gauge files
+COLUMNS = ['Year', 'month', 'day', 'data']
+STATIONS = {'d575a': 'Charleston, OR - USA'}                            #station file -> gauge name (plot titles)
+#Station used for each estuary; the case study uses Charleston for all of them
+ESTUARY_STATIONS = {selection: 'd575a' for selection in ['Alsea_bay', 'Coquille_river', 'Nehalem_river', 'Nestucca_bay',
+                                                         'Siletz_bay', 'Siuslaw_river', 'Smith_river', 'Umpqua_river']}
 
-    # Convert the "date" column to a datetime format (if it's not already)
-    monthly_min_max['Year'] = monthly_min_max['date'].dt.year
-    monthly_min_max['month'] = monthly_min_max['date'].dt.month
+
+def station_path(station, tidal_dir=TIDAL_DIR):
+    return station if station.endswith('.csv') else os.path.join(tidal_dir, f'{station}.csv')
+
+
+def read_station(station, chunksize=None, tidal_dir=TIDAL_DIR):
+    """
+    Daily water levels of a station, without missing values.
+
+    Parameters:
+    - station (str): Station name (file name in tidal_dir without .csv) or path of the file.
+    - chunksize (int): Rows per chunk; when given an iterator over chunks is returned instead of one DataFrame.
+
+    Returns:
+    - DataFrame (or iterator of DataFrames): Columns Year, month, day, data (mm) and date.
+    """
+    Instrument.add_file('bytes_read.tidal', station_path(station, tidal_dir))
+    chunks = pd.read_csv(station_path(station, tidal_dir), names=COLUMNS, dtype=np.int32, engine='c',
+                         chunksize=chunksize or 1 << 20)
+    def clean(chunk):
+        chunk = chunk[chunk['data'] != SENTINEL].copy()
+        months = (chunk['Year'].to_numpy() - 1970) * 12 + chunk['month'].to_numpy() - 1
+        chunk['date'] = months.astype('datetime64[M]').astype('datetime64[D]') + (chunk['day'].to_numpy() - 1)
+        return chunk
+    if chunksize:
+        return (clean(chunk) for chunk in chunks)
+    return pd.concat([clean(chunk) for chunk in chunks], ignore_index=True)
+
+
+def monthly_range(station, chunksize=100000, tidal_dir=TIDAL_DIR, cache_dir=Loader.CACHE_DIR):
+    """
+    Minimum, maximum and mid level of every month of a station, read in chunks of bounded size and cached.
+
+    Returns:
+    - DataFrame: Columns Year, month, min, max, mean (mm) and n (days), one row per month with data.
+    """
+    def build(path):
+        parts = []
+        for chunk in read_station(path, chunksize):
+            parts.append(chunk.groupby(['Year', 'month'])['data'].agg(['min', 'max', 'count']))
+        table = pd.concat(parts).groupby(level=['Year', 'month']).agg({'min': 'min', 'max': 'max', 'count': 'sum'})
+        table = table.rename(columns={'count': 'n'}).reset_index()
+        table['mean'] = table['min'] + (table['max'] - table['min']) / 2
+        return table[['Year', 'month', 'min', 'max', 'mean', 'n']]
+    path = station_path(station, tidal_dir)
+    return Loader.cached_table('tidal_monthly_' + os.path.splitext(os.path.basename(path))[0], path, build, cache_dir)
+
+
+def yearly_range(monthly, window_size=3):
+    # Mean of the monthly mid levels per year, and its centered rolling mean over window_size years (mean3)
+    yearly_mean = monthly.groupby('Year')['mean'].mean().reset_index()
+    yearly_mean['mean3'] = yearly_mean['mean'].rolling(window_size, center=True).mean()
+    return yearly_mean
+
+
+def tidal_range(selection=None, station=None, years=np.arange(1985, 2017, 3), **options):
+    """
+    Tidal range of an estuary for the given years, from the cached statistics of its station.
+
+    Parameters:
+    - selection (str): Estuary name, mapped to a station with ESTUARY_STATIONS.
+    - station (str): Station to use instead.
+    - years (array): Years to report.
+    - options: Further arguments of monthly_range.
+
+    Returns:
+    - DataFrame: Columns Year and 'Tidal Range (mm)' (3-year centered mean).
+    """
+    station = station or ESTUARY_STATIONS[selection]
+    yearly_mean = yearly_range(monthly_range(station, **options))
+    tidal_data = yearly_mean.loc[yearly_mean['Year'].isin(years), ['Year', 'mean3']].reset_index(drop=True)
+    tidal_data.columns = ['Year', 'Tidal Range (mm)']
+    return tidal_data
+
+
+def station_summary(stations=None, tidal_dir=TIDAL_DIR, **options):
+    """
+    Record length and mean tidal range of several stations (default: every file in tidal_dir).
+
+    Returns:
+    - DataFrame: One row per station with first and last year, days with data and mean yearly range (mm).
+    """
+    if stations is None:
+        stations = sorted(os.path.splitext(name)[0] for name in os.listdir(tidal_dir) if name.endswith('.csv'))
+    rows = []
+    for station in stations:
+        monthly = monthly_range(station, tidal_dir=tidal_dir, **options)
+        rows.append(dict(station=station, name=STATIONS.get(station, station), first=int(monthly['Year'].min()),
+                         last=int(monthly['Year'].max()), days=int(monthly['n'].sum()),
+                         range=yearly_range(monthly)['mean'].mean()))
+    return pd.DataFrame(rows).set_index('station')
+
+
+def plot_tidal_data(station='d575a', selection='Alsea_bay', file=None):
+    # Daily levels, yearly range and selected-year range of a station; saved to file (default
+    # results/00_Input_Tidal_<selection>.png) and closed
+    import matplotlib.pyplot as plt
+    basin = read_station(station)
+    monthly_min_max = monthly_range(station)
+    level_range = (monthly_min_max['max'].max() + monthly_min_max['min'].min())//2
+    name = STATIONS.get(station, station)
 
     # Mean value per year
-    yearly_mean = monthly_min_max.groupby('Year')['mean'].mean().reset_index()
+    yearly_mean = yearly_range(monthly_min_max)
 
     # Trendline calculation
     coef_A = np.polyfit(yearly_mean['Year'], yearly_mean['mean'], 1)
@@ -60,8 +159,6 @@ def analyze_tidal_data():
     trendline_A = slope_A * yearly_mean['Year'] + intercept_A
 
     # Calculate the mean over a window
-    window_size = 3
-    yearly_mean['mean3'] = yearly_mean['mean'].rolling(window_size, center=True).mean()
     y_sele = np.arange(1985,2017,3)
     b_values = yearly_mean.loc[yearly_mean['Year'].isin(y_sele), ['Year', 'mean3']]
     b_values.reset_index(drop=True, inplace=True)
@@ -69,9 +166,9 @@ def analyze_tidal_data():
     # Plot
     fig = plt.figure(figsize=(20,10))
     plt.subplot(311)
-    plt.plot(basin['date'], basin['data'], linewidth=0.5, color='#4682B4', label='tidal range:' + str(tidal_range) + 'mm')
+    plt.plot(basin['date'], basin['data'], linewidth=0.5, color='#4682B4', label='tidal range:' + str(level_range) + 'mm')
     plt.ylabel('Relative Water Level (MHHW,mm)')
-    plt.title('Charleston, OR - USA - Mean MHHW per day')
+    plt.title(f'{name} - Mean MHHW per day')
     plt.legend(loc='upper right', ncol=1, prop={'size':14}, fancybox=True)
     plt.grid(True)
 
@@ -79,7 +176,7 @@ def analyze_tidal_data():
     plt.plot(yearly_mean['Year'], yearly_mean['mean'], linewidth=0.5, color='#4682B4', linestyle='--', marker='o')
     plt.plot(yearly_mean['Year'], trendline_A, color='black', linewidth=1.5, linestyle='--', label='Trend Line')
     plt.ylabel('Tidal Range (mm)')
-    plt.title('Charleston, OR - USA - Tidal Range per Year')
+    plt.title(f'{name} - Tidal Range per Year')
     plt.ylim(2250, 2600)
     plt.legend(loc='upper right', ncol=1, prop={'size':14}, fancybox=True)
     plt.fill_between(y_sele, 1400, 1900, facecolor='grey', alpha=0.3)
@@ -92,16 +189,23 @@ def analyze_tidal_data():
     plt.xticks(np.arange(1984, 2017, 1))
     plt.xlabel('Year')
     plt.ylabel('Tidal Range (mm)')
-    plt.title('Charleston, OR - USA - Tidal Range per Year (1984-2016)')
+    plt.title(f'{name} - Tidal Range per Year (1984-2016)')
 
     for x, y in zip(b_values['Year'], b_values['mean3']):
         plt.text(x, y, '{:.2f}'.format(y), ha='center', va='bottom')
 
     plt.grid(True)
 
-    plt.savefig(f"results/00_Input_Tidal_Alsea_bay.png")
+    file = file or f"results/00_Input_Tidal_{selection}.png"
+    fig.savefig(file)
+    plt.close(fig)
+    return file
 
-    # Prepare tidal data for return
-    tidal_data = b_values[['Year', 'mean3']]
-    tidal_data.columns = ['Year', 'Tidal Range (mm)']
-    return tidal_data
+@Instrument.timed('analyze.tidal')
+def analyze_tidal_data(station=None, selection='Alsea_bay', plot=True):
+    # Tidal range of the selected years at the station of the estuary (see tidal_range; station overrides
+    # ESTUARY_STATIONS), optionally with its figure
+    station = station or ESTUARY_STATIONS[selection]
+    if plot:
+        plot_tidal_data(station, selection)
+    return tidal_range(selection, station=station)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Monte Carlo uncertainty propagation through the MorQuest model
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+import warnings
+import numpy as np
+import pandas as pd
+
+import Kernel
+from morQuest import BATCH_KEYS, morquest_set_input, Run_morquest_batch
+
+#Default outputs: areas, depths and sediment transports
+VARIABLES = ['Ai', 'Ac', 'hc', 'hi', 'Qrc', 'Qci', 'Qcd', 'Qri', 'Qcs', 'Qso']
+PROBS = [0.05, 0.25, 0.5, 0.75, 0.95]
+_compiled = {}
+
+
+def _p2_rows(X, count, first, q, n, nd, dn):
+    # P-square update with the rows of X ([observation, cell]) one after another; plain loops so that numba can
+    # compile it (same steps as P2Quantiles.update)
+    for r in range(X.shape[0]):
+        for c in range(X.shape[1]):
+            x = X[r, c]
+            if not np.isfinite(x):
+                continue
+            if count[c] < 5:
+                first[c, count[c]] = x
+                count[c] += 1
+                if count[c] == 5:
+                    ordered = np.sort(first[c])
+                    for k in range(q.shape[0]):
+                        q[k, c, :] = ordered
+                continue
+            count[c] += 1
+            for k in range(q.shape[0]):
+                qk, nk, ndk = q[k, c], n[k, c], nd[k, c]
+                if x < qk[0]:
+                    qk[0] = x
+                if x > qk[4]:
+                    qk[4] = x
+                for i in range(1, 4):
+                    if x < qk[i]:
+                        nk[i] += 1
+                nk[4] += 1
+                for i in range(5):
+                    ndk[i] += dn[k, i]
+                for i in range(1, 4):
+                    d = ndk[i] - nk[i]
+                    up = d >= 1 and nk[i + 1] - nk[i] > 1
+                    if not (up or (d <= -1 and nk[i - 1] - nk[i] < -1)):
+                        continue
+                    s = 1.0 if up else -1.0
+                    parabolic = qk[i] + s / (nk[i + 1] - nk[i - 1]) * (
+                        (nk[i] - nk[i - 1] + s) * (qk[i + 1] - qk[i]) / (nk[i + 1] - nk[i])
+                        + (nk[i + 1] - nk[i] - s) * (qk[i] - qk[i - 1]) / (nk[i] - nk[i - 1]))
+                    if qk[i - 1] < parabolic < qk[i + 1]:
+                        qk[i] = parabolic
+                    else:
+                        j = i + 1 if up else i - 1
+                        qk[i] = qk[i] + s * (qk[j] - qk[i]) / (nk[j] - nk[i])
+                    nk[i] += s
+
+
+def _p2_kernel(backend):
+    # Compiled _p2_rows for backend 'numba' / 'auto' when numba is installed, else None
+    if backend == 'python' or not Kernel.numba_available():
+        return None
+    if 'p2' not in _compiled:
+        import numba
+        _compiled['p2'] = numba.njit(cache=True, error_model='numpy')(_p2_rows)
+    return _compiled['p2']
+
+
+class P2Quantiles:
+    """
+    Streaming quantile estimates with the P-square algorithm (Jain and Chlamtac, 1985), for many cells at once.
+
+    Five markers per cell and probability are adjusted with every observation, so memory does not grow with the
+    number of observations. Non-finite observations are skipped for their cell.
+
+    Parameters:
+    - probs (list): Probabilities of the quantiles, e.g. [0.05, 0.5, 0.95].
+    - size (int): Number of cells (e.g. variables x years).
+    - backend (str): 'numba' / 'auto' update many observations with a compiled loop when numba is installed;
+      'python' uses numpy, vectorized over cells.
+    """
+
+    def __init__(self, probs, size, backend='auto'):
+        p = np.asarray(probs, dtype=float)[:, None, None]
+        self.probs = np.asarray(probs, dtype=float)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.first = np.full((size, 5), np.nan)                             #first five observations of every cell
+        self.q = np.zeros((len(self.probs), size, 5))                       #marker heights
+        self.n = np.broadcast_to(np.arange(5.0), self.q.shape).copy()       #marker positions
+        self.nd = np.broadcast_to(np.concatenate([0 * p, 2 * p, 4 * p, 2 + 2 * p, 4 + 0 * p], axis=2), self.q.shape).copy()
+        self.dn = np.concatenate([0 * p, p / 2, p, (1 + p) / 2, 1 + 0 * p], axis=2)
+        self.kernel = _p2_kernel(backend)
+
+    def update_many(self, X):
+        # Observations [observation, cell], in order
+        X = np.ascontiguousarray(X, dtype=float)
+        if self.kernel is not None:
+            self.kernel(X, self.count, self.first, self.q, self.n, self.nd, np.ascontiguousarray(self.dn[:, 0]))
+        else:
+            for row in X:
+                self.update(row)
+
+    def update(self, x):
+        # One observation per cell
+        x = np.asarray(x, dtype=float)
+        valid = np.isfinite(x)
+        fill = valid & (self.count < 5)
+        run = valid & ~fill
+        if fill.any():
+            cells = np.nonzero(fill)[0]
+            self.first[cells, self.count[cells]] = x[cells]
+        self.count += valid
+        ready = fill & (self.count == 5)
+        if ready.any():
+            self.q[:, ready] = np.sort(self.first[ready], axis=1)
+        if run.any():
+            self._step(x, run)
+
+    def _step(self, x, run):
+        q, n = self.q, self.n
+        q[..., 0] = np.where(run & (x < q[..., 0]), x, q[..., 0])
+        q[..., 4] = np.where(run & (x > q[..., 4]), x, q[..., 4])
+        n[..., 1:4] += run[:, None] & (x[:, None] < q[..., 1:4])
+        n[..., 4] += run
+        self.nd += self.dn * run[:, None]
+        with np.errstate(all='ignore'):
+            for i in (1, 2, 3):
+                d = self.nd[..., i] - n[..., i]
+                up = (d >= 1) & (n[..., i + 1] - n[..., i] > 1)
+                move = run & (up | ((d <= -1) & (n[..., i - 1] - n[..., i] < -1)))
+                if not move.any():
+                    continue
+                s = np.where(up, 1.0, -1.0)
+                parabolic = q[..., i] + s / (n[..., i + 1] - n[..., i - 1]) * (
+                    (n[..., i] - n[..., i - 1] + s) * (q[..., i + 1] - q[..., i]) / (n[..., i + 1] - n[..., i])
+                    + (n[..., i + 1] - n[..., i] - s) * (q[..., i] - q[..., i - 1]) / (n[..., i] - n[..., i - 1]))
+                qj = np.where(up, q[..., i + 1], q[..., i - 1])
+                nj = np.where(up, n[..., i + 1], n[..., i - 1])
+                linear = q[..., i] + s * (qj - q[..., i]) / (nj - n[..., i])
+                inside = (q[..., i - 1] < parabolic) & (parabolic < q[..., i + 1])
+                q[..., i] = np.where(move, np.where(inside, parabolic, linear), q[..., i])
+                n[..., i] += np.where(move, s, 0)
+
+    def quantiles(self):
+        # [probability, cell]; cells with fewer than five observations use the exact quantile of what they have
+        out = self.q[..., 2].copy()
+        few = self.count < 5
+        if few.any():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)                #all-NaN cells
+                out[:, few] = np.nanquantile(self.first[few], self.probs, axis=1)
+        return out
+
+
+class StreamingStats:
+    """
+    Per-cell count, mean, standard deviation, minimum, maximum and P-square quantiles of a stream of samples.
+
+    Parameters:
+    - size (int): Number of cells.
+    - probs (list): Quantile probabilities.
+    - backend (str): Quantile update backend, see P2Quantiles.
+    """
+
+    def __init__(self, size, probs=PROBS, backend='auto'):
+        self.n = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+        self.p2 = P2Quantiles(probs, size, backend)
+
+    def update(self, X):
+        # X: [sample, cell]; mean and variance are merged per chunk (Chan et al.), quantiles per sample
+        X = np.asarray(X, dtype=float)
+        finite = np.isfinite(X)
+        nb = finite.sum(axis=0)
+        with np.errstate(all='ignore'):
+            mb = np.where(finite, X, 0).sum(axis=0) / nb
+            m2b = np.where(finite, (X - mb) ** 2, 0).sum(axis=0)
+            delta = mb - self.mean
+            total = self.n + nb
+            keep = nb > 0
+            self.mean = np.where(keep, self.mean + delta * nb / total, self.mean)
+            self.m2 = np.where(keep, self.m2 + m2b + delta ** 2 * self.n * nb / total, self.m2)
+        self.n = total
+        self.min = np.fmin(self.min, np.where(finite, X, np.inf).min(axis=0))
+        self.max = np.fmax(self.max, np.where(finite, X, -np.inf).max(axis=0))
+        self.p2.update_many(X)
+
+    def summary(self):
+        with np.errstate(all='ignore'):
+            empty = self.n == 0
+            table = {'n': self.n.astype(np.int64),
+                     'mean': np.where(empty, np.nan, self.mean),
+                     'std': np.sqrt(self.m2 / (self.n - 1)),
+                     'min': np.where(empty, np.nan, self.min),
+                     'max': np.where(empty, np.nan, self.max)}
+        for p, values in zip(self.p2.probs, self.p2.quantiles()):
+            table[f'p{100 * p:g}'] = values
+        return table
+
+
+def draw(distributions, size, rng):
+    """
+    Random parameter values.
+
+    Parameters:
+    - distributions (dict): Parameter -> distribution. A distribution is a frozen scipy.stats distribution (e.g.
+      scipy.stats.uniform(3000, 5000)), a list of values drawn with equal probability (e.g. SLR scenarios), or a
+      callable f(rng, size).
+    - size (int): Number of samples.
+    - rng (numpy.random.Generator): Random generator.
+
+    Returns:
+    - dict: Parameter -> [size] array.
+    """
+    values = {}
+    for key, dist in distributions.items():
+        if hasattr(dist, 'rvs'):
+            values[key] = np.asarray(dist.rvs(size=size, random_state=rng), dtype=float)
+        elif callable(dist):
+            values[key] = np.asarray(dist(rng, size), dtype=float)
+        else:
+            values[key] = rng.choice(np.asarray(dist, dtype=float), size)
+    return values
+
+
+def propagate(base, distributions, variables=VARIABLES, n_samples=10000, chunk_size=1000, probs=PROBS, seed=0,
+              callback=None, backend='auto'):
+    """
+    Monte Carlo propagation of uncertain inputs, with streaming per-year statistics of the outputs.
+
+    Samples are run in batches of chunk_size members; every batch updates the running statistics and is then
+    discarded, so memory depends on chunk_size and the number of outputs, not on n_samples.
+
+    Parameters:
+    - base (dict): morquest_set_input values of the fixed parameters.
+    - distributions (dict): Uncertain parameters, see draw.
+    - variables (list): Output series to summarize.
+    - n_samples (int): Number of Monte Carlo samples.
+    - chunk_size (int): Samples per batched run.
+    - probs (list): Quantile probabilities.
+    - seed (int): Random seed.
+    - callback (callable): Called as callback(done, stats) after every chunk, e.g. for progress reports.
+    - backend (str): Quantile update backend, see P2Quantiles.
+
+    Returns:
+    - dict: Variable -> DataFrame indexed by year with columns n, mean, std, min, max and one column per quantile
+      (p5, p50, ...).
+    """
+    unknown = [key for key in distributions if key not in BATCH_KEYS]
+    if unknown:
+        raise ValueError(f"Cannot sample {unknown}; parameters must be among {BATCH_KEYS}")
+    input = morquest_set_input(**base)
+    rng = np.random.default_rng(seed)
+
+    stats, sizes, done = None, None, 0
+    while done < n_samples:
+        size = min(chunk_size, n_samples - done)
+        batch = dict(input, **draw(distributions, size, rng))
+        with np.errstate(all='ignore'):
+            series = Run_morquest_batch(batch, output=variables).series
+        if stats is None:
+            sizes = [series[variable].shape[1] for variable in variables]
+            stats = StreamingStats(sum(sizes), probs, backend)
+        stats.update(np.concatenate([series[variable] for variable in variables], axis=1))
+        done += size
+        if callback is not None:
+            callback(done, stats)
+
+    summary = pd.DataFrame(stats.summary())
+    out, start = {}, 0
+    for variable, length in zip(variables, sizes):
+        out[variable] = summary.iloc[start:start + length].reset_index(drop=True).rename_axis('yr')
+        start += length
+    return out
@@ -1,579 +1,525 @@
-#!/usr/bin/env python
-###############################################################################
-# $Id$
-#
-# Project:  MorQuestCode
-# Purpose:  MorQuest Core Code.
-# Author:   Mishel Reyes, # mreyec@uni.pe
-###############################################################################
-#
-# This library is free software; you can redistribute it and/or
-# modify it under the terms of the GNU Library General Public
-# License as published by the Free Software Foundation; either
-# version 2 of the License, or (at your option) any later version.
-#
-# This library is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
-# Library General Public License for more details.
-#
-# You should have received a copy of the GNU Library General Public
-# License along with this library; if not, write to the
-# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
-# Boston, MA 02111-1307, USA.
-###############################################################################
-# changes 19Apr2024
-# If the input image is a multi-band one, use all the channels in
-# building the stack.
-# mreyec@uni.pe
-
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import scipy.io
-import os
-
-#Read Input
-def morquest_set_input(Ac=0, Ai=0, dH=0, Qr=0, fQr=0, ssc=0, fssc=0, slr=0, lsys=0, cl=0, betas=0, cd=0, fd=0, du=0,
-                       por=0, rho=0, dur=0, T=0, slrtype='linear', incAi=0, tr=0, erc=0, ecs=0, fis=0, si=0, fs=0, faw=0, **kwargs):
-    
-    input = {
-        'Ac': Ac,                                   #channel area, m2
-        'Ai': Ai,                                   #intertidal area, m2
-        'dH': dH,                                   #tidal difference, m
-        'Qr': Qr,                                   #river flow, m3/s
-        'fQr': fQr,
-        'ssc': ssc,                                 #river suspended sediment concentration, give always value to prevent div0, mg/l, g/m3
-        'fssc': fssc,
-        'slr': slr,                                 #sea level rise after 'dur' years, m
-        'slrtype': 'linear',                        #sea level rise type: 'accel'/'linear'
-        'incAi': incAi,                             #increase it area per year as percentage of intertidal area at t=0,
-
-        #'at' : 40.0                                #intertidal area slr adaptation timescale, yr
-        #'lit' : 3000                               #it area length perp to channel axis, m        
-        
-        'tr': tr,                                 #exchange from channel to shore as percentage of instantaneous total exchange
-        'lsys': lsys,                               #empirically derived; system length scale; important to calculate connection length itarea to channel, m
-        'cl': cl,                                   #coastline length, m
-        'Vout': 1e10,                               #outside world sediment volumen
-        'betas': betas,                             #active shorezone slope [-]
-        'cd': cd,                                   #closure depth, m
-        'fd': fd,                                  #dune factor, m
-        'du': du,                                   #dune height above active zone, for Bruun rule, m
-
-        'erc': erc,                                 #maximun river supply entrapment portion from river into channel, -
-        'ecs': ecs,                                 #maximum river supply entrapment portion from channel into shorelin, -
-        'fis': fis,                                 #calibration factor for transport from river to it area under river sedsupply change, 1 menas all excess sedimen supply to itarea, [0 1], -
-        'si': si,                                   #factor increasing intertidal area slope at edge for slr computations ; smaller value implies less intertidal area under slr. 1 = linear. (no effect if ~ >10), [0 inf], -
-        'fs': fs,                                  #factor distributing it area deposition to it area width and channel slope, [0 1], -; 
-        'faw': faw,                                 #factor diminishing fs and fis in case of lowering Qrc, [0 1], -; 
-
-        'por': por,                                 #porosity, -
-        'rho': rho,                                #sediment density, kg/m3
-        'dur': dur,                                 #timespan calculation, yr
-        'T': T,                                 #tidal period, s
-
-        #Plotting parameters
-        'plotme': 1,                        #make figures
-        'plottimeres': 1,                   #plotting resolution, y
-        'savemyplots': 0,                   #save plots to hardcopy
-        'savemyplotsinfolder': './figs/'    #folder to save plots in
-    }
-    input.update(kwargs)
-
-    #Verification of the list of data as INPUT
-    return input    
-
-def Run_morquest(input, FileName):
-    # input = morquest_set_input()      
-    # You can override the default values by passing keyword arguments to the function like this:
-    # input = morquest_set_input(Ac=100e6, slr=5, dur=5, incAi = .1)
-    
-     #Efect of the sea Level
-    t = np.arange(input['dur'] + 1)
-    slrst = -1
-    
-    if input['slrtype'] == 'accel':
-        slr = input['slr'] * (np.sin(2 * np.pi / (4 * input['dur']) * t - np.pi / 2) + 1)
-        slrr = np.diff(slr)
-    elif input['slrtype'] == 'linear':
-        slrr = input['slr'] / input['dur'] * np.ones_like(t[:-1])
-        slr = np.cumsum(slrr)
-    elif input['slrtype'] == 'timep':
-        slr = np.zeros_like(t)
-        slrst = 200
-        slr[slrst:303] = input['slr'] * (np.sin(2 * np.pi / (4 * 100) * (np.arange(1, 104)) - np.pi / 2) + 1)
-        slrr = np.diff(slr)
-    
-    #Efect of the sediment concentration
-    #if isinstance(input['ssc'], (int, float)):
-        #input['ssc'] = np.ones(input['dur'] + 1) * input['ssc']
-    tt = np.arange(0, input['dur']+1, input['plottimeres'])
-    ssc = np.zeros(len(tt))
-    ssc[0] = input['ssc']
-    for i in range(len(tt) - 1):  
-        ssc[i+1] = ssc[i] + ssc[0]*input['fssc']*input['plottimeres']
-
-    #Efect of the River dischargue
-    Qr = np.zeros(len(tt))
-    Qr[0] = input['Qr']
-    for i in range(len(tt) - 1):  
-        Qr[i+1] = Qr[i] + Qr[0]*input['fQr']*input['plottimeres']
-
-    itp = 1
-    
-    # Assuming 'tt' has been calculated and defined
-    dAi_wh = np.zeros(len(tt))
-    dAi_sl = np.zeros(len(tt))
-    dAi = np.zeros(len(tt))
-    dAc = np.zeros(len(tt))
-    dVc_wh = np.zeros(len(tt))
-    dVc_sl = np.zeros(len(tt))
-    dVc = np.zeros(len(tt))
-    dVi_wh = np.zeros(len(tt))
-    dVi_sl = np.zeros(len(tt))
-    dVi = np.zeros(len(tt))
-    dVi_sed_wh = np.zeros(len(tt))
-    dVi_sed_sl = np.zeros(len(tt))
-    dVi_sed = np.zeros(len(tt))
-    dVs = np.zeros(len(tt))
-    dVd = np.zeros(len(tt))
-    dVout = np.zeros(len(tt))
-    erc = np.zeros(len(tt))
-    ds = np.zeros(len(tt))
-    dBr = np.zeros(len(tt))
-    dH = np.zeros(len(tt))
-    
-    Ai = np.zeros(len(tt))
-    Ac = np.zeros(len(tt))
-    Ab = np.zeros(len(tt))
-    Vr = np.zeros(len(tt))
-    Vc = np.zeros(len(tt))
-    Vi = np.zeros(len(tt))
-    Vi_sed = np.zeros(len(tt))
-    Vs = np.zeros(len(tt))
-    Vd = np.zeros(len(tt))
-    Vout = np.zeros(len(tt))
-    hc = np.zeros(len(tt))
-    hcod = np.zeros(len(tt))
-    hi = np.zeros(len(tt))
-    hiod = np.zeros(len(tt))
-    P = np.zeros(len(tt))
-    Vceq = np.zeros(len(tt))
-    at = np.zeros(len(tt))
-    
-    Qrc = np.zeros(len(tt))
-    Qri = np.zeros(len(tt))
-    Qcieq = np.zeros(len(tt))
-    Qci = np.zeros(len(tt))
-    Qci_at = np.zeros(len(tt))
-    Qcdeq = np.zeros(len(tt))
-    Qcd = np.zeros(len(tt))
-    Qcs = np.zeros(len(tt))
-    Qsd = np.zeros(len(tt))
-    Qco = np.zeros(len(tt))
-    Qdo = np.zeros(len(tt))
-    Qso = np.zeros(len(tt))
-    
-    # Initial parameter values
-    Ai[0] = input['Ai']
-    dH[0] = input['dH']
-    #Initial parameter values
-    
-    Ab = input['Ac'] + input['Ai']                                      #basin area, m2
-    Qssec = Qr * ssc                                                    #sediment supply, kg/s
-    Qs = Qssec * 3600 * 24 * 365 / input['rho'] / (1 - input['por'])    #yearly sediment supply volume incl porosity, m3/yr
-    Vr[0] = Qr[0] * ssc[0]                                              #river sediment volume inflow
-    Vi[0] = 0.5 * input['Ai'] * input['dH']                              #intertidal water volume, m3
-    Vi_sed[0] = Vi[0]                                                    #intertidal area sediment volume, m3
-    P[0] = input['dH'] * input['Ac'] + Vi[0]                             #tidal prism, m3
-    vca = 65e-6
-    vce = 1.5
-    Vceq[0] = vca * P[0]**vce                                           #initial channel water volume, m3
-    
-    Vc[0] = Vceq[0]                                                      #equilibrium channel water volume, m3
-    vda = 2.9e-3
-    vde = 1.23
-    Vd[0] = vda * P[0]**vde                                              #delta sediment volume, m3
-    hi[0] = Vi[0] / input['Ai']                                          #mean water depth at intertidal area, m
-    hc[0] = Vc[0] / input['Ac']                                          #mean water depth in channel area, m
-    Ai[0] = input['Ai']
-    Ac[0] = input['Ac']
-    Vs[0] = 1.5 * input['cl'] * 0.5 * input['cd']**2 / input['betas']
-    Vout[0] = input['Vout']
-    
-    ## Update of the equation of Adaptation Time Scale
-    at[0] = input['T'] * input['lsys'] / input['dH'] / (365 * 24 * 3600) # adaptation timescale, yr  
-    #at[0] = 0.75 * (Ac[0]  + Ai[0])
-    ##############################################
-    
-    Qrc = Qs                                                            # sedtransport river-channel /yr, m3
-    Qci[0] = 0                                                           # sedtransport channel-intertidal /yr, m3 
-    Qcieq[0] = slrr[0] * Ai[0]                                           # channel-intertidalarea sediment transport required to keep up with SLR
-    Qcdeq[0] = 0                                                        # based on delta sediment volume required to meet P, m3
-    Qcd[0] = 0                                                         # sedtransport channel-delta /yr, m3
-    Qcs[0] = Qrc[0]                                                     # sedtransport channel-shore /yr, m3
-    Qsd[0] = 0                                                          # sedtransport shore-delta /yr, m3
-    Qco[0] = 0                                                           # sedtransport channel-out /yr, m3
-    Qdo[0] = 0                                                           # sedtransport delta-out /yr, m3
-    Qso[0] = Qrc[0]                                                      # sedtransport shore-out /yr, m3
-    Qri[0] = 0                                                           # sedtransport river-intertidal /yr, m3
-    
-    for yr in range(input['dur']-1):
-        dAi_sl[yr] = -slrr[yr] * Ai[yr] / input['dH'] / input['si']
-        dAi[yr] = input['incAi'] * Ai[max(1, yr - 1)]                                                                   + dAi_sl[yr] + dAi_wh[yr]
-        dAc[yr] =                                                                                                       - dAi_sl[yr] - dAi_wh[yr]
-        dVc_sl[yr] = -input['dH'] * dAi_sl[yr] * 0.5 * (1 - slrr[yr] / input['dH']) + (Ac[yr] - dAi[yr]) * slrr[yr]
-        dVc[yr] = -Qrc[yr] + Qci_at[yr] + Qcd[yr] + Qcs[yr] + Qco[yr]                                                   + dVc_sl[yr] + dVc_wh[yr]
-        dVi_sl[yr] = input['dH'] * dAi_sl[yr] * (1 - 0.5 * slrr[yr] / input['dH']) + (Ai[yr] + dAi[yr]) * slrr[yr]
-        dVi[yr] = -Qci_at[yr]                                                                                           + dVi_sl[yr] + dVi_wh[yr]
-        dVi_sed_sl[yr] = -Ai[yr] * slrr[yr] + 0.5 * dAi[yr] * slrr[yr]
-        dVi_sed[yr] = Qci_at[yr]                                                                                        + dVi_sed_sl[yr] + dVi_sed_wh[yr]
-    
-        dVs[yr] = Qcs[yr] - Qsd[yr] - Qso[yr]
-        dVd[yr] = Qcd[yr] + Qsd[yr] - Qdo[yr]
-        dVout[yr] = Qco[yr] + Qdo[yr] + Qso[yr]
-    
-        ds[yr] = dVs[yr] / (input['cl'] * input['cd'])
-        dBr[yr] = -slrr[yr] * input['cd'] / input['betas'] / (input['cd'] + input['du'])    #Bruun rule
-    
-        # Prevent negative volumes
-        if dAi[yr] <= -Ai[yr]:
-            dAi[yr] = -Ai[yr]
-        if dAc[yr] <= -Ac[yr]:
-            dAc[yr] = -Ac[yr]
-        if dVc[yr] <= -Vc[yr]:
-            dVc[yr] = -Vc[yr]
-        if dVi[yr] <= -Vi[yr]:
-            dVi[yr] = -Vi[yr]
-    
-        if itp == 0 or (dVi_sed[yr] <= -Vi_sed[yr]).all() or (hi[yr] >= input['dH']).all():
-            itp = 0
-            dVi_sed[yr] = -Vi_sed[yr]
-            Vc[yr] = Vc[yr] + Ai[yr] * hi[yr]
-            Ai[yr] = 0
-            Ac[yr] = Ab
-            hi[yr] = 0
-            hiod[yr] = 0
-            Vi[yr] = 0
-            Qci[yr] = 0
-            Qri[yr] = 0
-    
-        if dVs[yr] <= -Vs[yr]:
-            dVs[yr] = -Vs[yr]
-        if dVd[yr] <= -Vd[yr]:
-            dVd[yr] = -Vd[yr]
-        if dVout[yr] <= -Vout[yr]:
-            dVout[yr] = -Vout[yr]
-    
-        Ai[yr + 1] = Ai[yr] + dAi[yr]
-        Ac[yr + 1] = Ac[yr] + dAc[yr]
-        Vr[yr + 1] = Vr[yr] + Qrc[yr]
-        Vc[yr + 1] = Vc[yr] + dVc[yr]
-        Vi[yr + 1] = Vi[yr] + dVi[yr]
-        Vi_sed[yr + 1] = Vi_sed[yr] + dVi_sed[yr]
-        Vs[yr + 1] = Vs[yr] + dVs[yr]
-        Vd[yr + 1] = Vd[yr] + dVd[yr]
-        Vout[yr + 1] = Vout[yr] + dVout[yr]
-    
-        if Ac[yr + 1] <= 0:
-            hc[yr + 1] = 0
-        else:
-            hc[yr + 1] = Vc[yr + 1] / Ac[yr + 1]
-    
-        if Ai[yr + 1] <= 0:
-            hi[yr + 1] = 0
-        else:
-            hi[yr + 1] = Vi[yr + 1] / Ai[yr + 1]
-    
-        if slrr[yr + 1] == 0:
-            hiod[yr + 1] = 0
-        else:
-            hiod[yr + 1] = hi[yr + 1] - hi[slrst+1]
-    
-        P[yr + 1] = input['dH'] * Ac[yr + 1] + Vi[yr + 1]
-        Vceq[yr + 1] = vca * P[yr + 1]**vce                     # channel water volume, m3, see Eysink 1990
-        hcod[yr + 1] = Vc[yr + 1] / Ac[yr + 1] - Vceq[yr + 1] / Ac[yr + 1]
-        # erc[yr + 1] = min(
-        #     1 - (dVc[yr] + Qrc[yr] - Qci[yr] + input['fis'] * Qri[yr] - input['tr'] * (Vceq[yr] - Vc[yr]) - dVc_sl[yr] - dVc_wh[yr]) / Qrc[yr],
-        #     input['erc'])  # min of no dVc and input['erc']
-        # if Vceq[yr] - Vc[yr] >= 0:
-        #     erc[yr + 1] = 0
-    
-        if Qrc[yr + 1] >= Qrc[yr]:
-            Qri[yr + 1] = input['fis'] * (Qrc[yr + 1] - Qrc[yr])                    # *(abs(Qrc[yr + 1] - Qrc[yr]) / Qrc[yr])
-        else:
-            Qri[yr + 1] = input['faw'] * input['fis'] * (Qrc[yr + 1] - Qrc[yr])     # *(abs(Qrc[yr + 1] - Qrc[yr]) / Qrc[yr])
-    
-        Qcieq[yr + 1] = slrr[yr] * Ai[yr]                                           # channel-intertidal area sediment transport required to keep up with SLR
-        
-        ## Update of the equation of Adaptation Time Scale
-        at[yr + 1] = (hi[yr + 1] / hi[0]) ** 2 * input['T'] * input['lsys'] / input['dH'] / (365 * 24 * 3600)  # adaptation timescale, yr   #################################!!!!!!!!!!!!!!!!!!!!!
-        #at[yr + 1] = (hi[yr + 1] / hi[0]) ** 2 * (0.75 * (Ac[yr + 1] + Ai[yr + 1]))
-
-        #############
-        if yr - slrst >= 0:
-            if at[yr + 1] != 0:
-                Qci_at[yr + 1] = Qcieq[yr] * (1 - np.exp(-(yr - slrst) / at[yr + 1]))
-            else:
-                Qci_at[yr + 1] = Qcieq[yr]  # Set Qci_at directly to Qcieq when at[yr + 1] is zero
-        else:
-            Qci_at[yr + 1] = 0
-        ####
-        
-        Qci[yr + 1] = Qci_at[yr + 1] + Qri[yr + 1]
-        Qcdeq[yr + 1] = vda * (P[yr + 1]) ** vde - vda * (P[yr]) ** vde             # based on delta sediment volume required to meet P, m3, see Eysink 1990
-        Qcd[yr + 1] = Qcdeq[yr + 1]
-        Qcs[yr + 1] = (1 - erc[yr + 1]) * Qrc[yr + 1] - input['fis'] * Qri[yr + 1] + input['tr'] * (Vceq[yr + 1] - Vc[yr + 1])
-        Qsd[yr + 1] = 0
-        Qco[yr + 1] = 0
-        Qdo[yr + 1] = 0
-    
-        ## height-width correction
-        if yr >= 2:
-            if hi[yr + 1] == 0 or hi[yr + 1] == 0 or hc[yr] == 0:
-                pass
-            else:
-                if Qri[yr + 1] / Ai[yr + 1] >= 0:
-                    if Qri[yr + 1] / Ai[yr + 1] == 0:
-                        pass
-                    else:
-                        dAi_wh[yr + 1] = Qri[yr + 1] * input['fs'] / hc[yr]
-                        dVi_wh[yr + 1] = input['dH'] * dAi_wh[yr + 1] - Qri[yr + 1] * (1 - input['fs'])
-                        dVi_sed_wh[yr + 1] = Qri[yr + 1] * (1 - input['fs']) + dAi_wh[yr + 1] * input['dH'] * input['si'] / Ai[yr] * (0.5 * dAi_wh[yr + 1] + Ai[yr])
-                        dVc_wh[yr + 1] = -dAi_wh[yr + 1] * (input['dH'] + hc[yr])
-                else:
-                    dAi_wh[yr + 1] = Qri[yr + 1] * input['faw'] * input['fs'] / hc[yr]
-                    dVi_wh[yr + 1] = input['dH'] * dAi_wh[yr + 1] - Qri[yr + 1] * (1 - input['faw'] * input['fs'])
-                    dVi_sed_wh[yr + 1] = Qri[yr + 1] * (1 - input['faw'] * input['fs']) + dAi_wh[yr + 1] * input['dH'] * input['si'] / Ai[yr] * (0.5 * dAi_wh[yr + 1] + Ai[yr])
-                    dVc_wh[yr + 1] = -dAi_wh[yr + 1] * (input['dH'] + hc[yr])
-    
-        ## prevent transport from empty volumes
-        if Qcs[yr+1] >= 0:
-            Qso[yr+1] = (1 - input['ecs']) * Qcs[yr+1]      # entrapment in shore for positive Qcs
-        else:
-            Qso[yr+1] = (input['ecs']) * Qcs[yr+1]          # entrapment in shore for negative Qcs
-    
-        if Vout[yr+1] <= 0:
-            Vout[yr+1] = 0
-            if Qso[yr+1] < 0:
-                Qso[yr+1] = 0                             # no transport from out to shore if no out volume
-    
-        if Vs[yr+1] <= 0:
-            Vs[yr+1] = 0
-            if Qcs[yr+1] <= 0:
-                Qcs[yr+1] = 0                             # no transport from shore to channel if no shore volume
-            if Qso[yr+1] >= Vs[yr+1] + Qcs[yr+1]:
-                Qso[yr+1] = Qcs[yr+1]                       # transport from shore equal to shore if no shore volume
-    
-        if Vi[yr+1] <= 0 or Ai[yr+1] <= 0:
-            Vi[yr+1] = 0
-            Ai[yr+1] = 0
-            hi[yr+1] = 0
-            hiod[yr+1] = 0
-            Vi_sed[yr+1] = 0
-            Ac[yr+1] = Ac[yr]
-            if -Qci[yr] + dVi_sl[yr] + dVi_wh[yr] <= 0:
-                Qci[yr] = dVi_sl[yr] + dVi_wh[yr]
-    
-        if Vc[yr+1] <= 0:
-            Vc[yr+1] = 0
-            if -Qrc[yr] + Qci[yr] + Qcd[yr] + Qcs[yr] + Qco[yr] + dVc_sl[yr] + dVc_wh[yr] <= 0:
-                Qrc[yr] = Qci[yr] + Qcd[yr] + Qcs[yr] + Qco[yr] + dVc_sl[yr] + dVc_wh[yr]  # no transport from intertidal to channel if no channel volume
-            Ai[yr+1] = Ai[yr]
-            Ac[yr+1] = 0
-            hc[yr+1] = 0
-            hcod[yr+1] = 0
-    
-    #final timestep
-    yr = input['dur']-1
-    
-    dAi_sl[yr] = -slrr[yr] * Ai[yr] / input['dH'] / input['si']
-    dAi[yr] = input['incAi'] * Ai[max(1, yr - 1)]                                                                   + dAi_sl[yr] + dAi_wh[yr]
-    dAc[yr] =                                                                                                       -dAi_sl[yr] - dAi_wh[yr]
-    dVc_sl[yr] = -input['dH'] * dAi_sl[yr] * 0.5 * (1 - slrr[yr] / input['dH']) + (Ac[yr] - dAi[yr]) * slrr[yr]
-    dVc[yr] = -Qrc[yr] + Qci_at[yr] + Qcd[yr] + Qcs[yr] + Qco[yr]                                                   + dVc_sl[yr] + dVc_wh[yr]
-    dVi_sl[yr] = input['dH'] * dAi_sl[yr] * (1 - 0.5 * slrr[yr] / input['dH']) + (Ai[yr] + dAi[yr]) * slrr[yr]
-    dVi[yr] = -Qci_at[yr]                                                                                           + dVi_sl[yr] + dVi_wh[yr]
-    dVi_sed_sl[yr] = -Ai[yr] * slrr[yr] + 0.5 * dAi[yr] * slrr[yr]
-    dVi_sed[yr] = Qci_at[yr]                                                                                        + dVi_sed_sl[yr] + dVi_sed_wh[yr]
-    
-    dVs[yr] = Qcs[yr] - Qsd[yr] - Qso[yr]
-    dVd[yr] = Qcd[yr] + Qsd[yr] - Qdo[yr]
-    dVout[yr] = Qco[yr] + Qdo[yr] + Qso[yr]
-    
-    ds[yr] = dVs[yr] / (input['cl'] * input['cd'])
-    dBr[yr] = -slrr[yr] * input['cd'] / input['betas'] / (input['cd'] + input['du'])    #Bruun rule
-    
-    # Prevent negative volumes
-    if dAi[yr] <= -Ai[yr]:
-        dAi[yr] = -Ai[yr]
-    if dAc[yr] <= -Ac[yr]:
-        dAc[yr] = -Ac[yr]
-    if dVc[yr] <= -Vc[yr]:
-        dVc[yr] = -Vc[yr]
-    if dVi[yr] <= -Vi[yr]:
-        dVi[yr] = -Vi[yr]
-    if dVi_sed[yr] <= -Vi_sed[yr]:
-        dVi_sed_sl[yr] = -Qci[yr]
-        dVi_sed[yr] = 0
-    if dVs[yr] <= -Vs[yr]:
-        dVs[yr] = -Vs[yr]
-    if dVd[yr] <= -Vd[yr]:
-        dVd[yr] = -Vd[yr]
-    if dVout[yr] <= -Vout[yr]:
-        dVout[yr] = -Vout[yr]
-    
-    Ai[yr + 1] = Ai[yr] + dAi[yr]
-    Ac[yr + 1] = Ac[yr] + dAc[yr]
-    Vr[yr + 1] = Vr[yr] + Qrc[yr]
-    Vc[yr + 1] = Vc[yr] + dVc[yr]
-    Vi[yr + 1] = Vi[yr] + dVi[yr]
-    Vi_sed[yr + 1] = Vi_sed[yr] + dVi_sed[yr]
-    Vs[yr + 1] = Vs[yr] + dVs[yr]
-    Vd[yr + 1] = Vd[yr] + dVd[yr]
-    Vout[yr + 1] = Vout[yr] + dVout[yr]
-    hc[yr + 1] = Vc[yr + 1] / Ac[yr]
-    hi[yr + 1] = Vi[yr + 1] / Ai[yr + 1]
-    hiod[yr + 1] = hi[yr + 1] - hi[0]
-
-    ####add 31/08/2023
-    if Qrc[yr + 1] >= Qrc[yr]:
-        Qri[yr + 1] = input['fis'] * (Qrc[yr + 1] - Qrc[yr])                    # *(abs(Qrc[yr + 1] - Qrc[yr]) / Qrc[yr])
-    else:
-        Qri[yr + 1] = input['faw'] * input['fis'] * (Qrc[yr + 1] - Qrc[yr])     # *(abs(Qrc[yr + 1] - Qrc[yr]) / Qrc[yr])
-    ########
-    
-    ## Update at
-    at[yr + 1] = (hi[yr + 1] / hi[0]) ** 2 * input['T'] * input['lsys'] / input['dH'] / (365 * 24 * 3600)  # adaptation timescale, yr   #################################!!!!!!!!!!!!!!!!!!!!!
-    #at[yr + 1] = (hi[yr + 1] / hi[0]) ** 2 * (0.75 * (Ac[yr + 1] + Ai[yr + 1]))
-
-    if yr - slrst >= 0:
-        if at[yr + 1] != 0:
-            Qci_at[yr + 1] = Qcieq[yr] * (1 - np.exp(-(yr - slrst) / at[yr + 1]))
-        else:
-            Qci_at[yr + 1] = Qcieq[yr]  # Set Qci_at directly to Qcieq when at[yr + 1] is zero
-    else:
-        Qci_at[yr + 1] = 0
-        
-    Qci[yr + 1] = Qci_at[yr + 1] + Qri[yr + 1]
-    ##############################################
-    P[yr + 1] = input['dH'] * Ac[yr + 1] + Vi[yr + 1]
-    Vceq[yr + 1] = vca * P[yr + 1] ** vce
-    hcod[yr + 1] = Vc[yr + 1] / Ac[yr + 1] - Vceq[yr + 1] / Ac[yr + 1]
-    
-    ##add 31/08/2023
-    Qcdeq[yr + 1] = vda * (P[yr + 1]) ** vde - vda * (P[yr]) ** vde             # based on delta sediment volume required to meet P, m3, see Eysink 1990
-    Qcd[yr + 1] = Qcdeq[yr + 1]
-    ####
-
-    ## correct Qcs and Qso  31/08/2023
-    Qcs[yr + 1] = (1 - erc[yr + 1]) * Qrc[yr + 1] - input['fis'] * Qri[yr + 1] + input['tr'] * (Vceq[yr + 1] - Vc[yr + 1])
-    if Qcs[yr+1] >= 0:
-        Qso[yr+1] = (1 - input['ecs']) * Qcs[yr+1]      # entrapment in shore for positive Qcs
-    else:
-        Qso[yr+1] = (input['ecs']) * Qcs[yr+1]          # entrapment in shore for negative Qcs
-    ##
-
-    sedVc = np.cumsum(Qrc) - np.cumsum(Qci) - np.cumsum(Qcd) - np.cumsum(Qcs) - np.cumsum(Qco)
-    sedVi = np.cumsum(dVi_sed)
-    sedVd = Vd - Vd[0]
-    sedVs = Vs - Vs[0]
-    sedVr = Vr - Vr[0]
-    sedVout = Vout - Vout[0]
-    
-    dVc_sl[yr] = -input['dH'] * dAi_sl[yr] * 0.5 * (1 - slrr[yr] / input['dH']) + (Ac[yr] - dAi[yr]) * slrr[yr]
-    dVc[yr] = -Qrc[yr] + Qci[yr] + Qcd[yr] + Qcs[yr] + Qco[yr]                                                   + dVc_sl[yr]
-    
-    dVi_sl[yr] = input['dH'] * dAi_sl[yr] * (1 - 0.5 * slrr[yr] / input['dH']) + (Ai[yr] + dAi[yr]) * slrr[yr]
-    dVi[yr] = -Qci[yr]                                                                                           + dVi_sl[yr] 
-    
-    dVi_sed_sl[yr] = -Ai[yr] * slrr[yr] + 0.5 * dAi[yr] * slrr[yr]
-    dVi_sed[yr] = Qci[yr]                                                                                        + dVi_sed_sl[yr]
-    
-    dVs[yr] = Qcs[yr] - Qsd[yr] - Qso[yr]
-    dVd[yr] = Qcd[yr] + Qsd[yr] - Qdo[yr]
-    dVout[yr] = Qco[yr] + Qdo[yr] + Qso[yr]
-    
-    ds[yr] = dVs[yr] / (input['cl'] * input['cd'])
-    dBr[yr] = slrr[yr] * input['cd'] / input['betas'] / (input['cd'] + input['du'])    #Bruun rule
-
-    # Output
-    output = {}
-    output['slrtype'] = input['slrtype']
-    output['incAi'] = input['incAi']
-    output['lsys'] = input['lsys']
-    output['tr'] = input['tr']
-    output['cl'] = input['cl']
-    output['Vout'] = input['Vout']
-    output['slope'] = input['betas']
-    output['cd'] = input['cd']
-    output['erc'] = input['erc']
-    output['ecs'] = input['ecs']
-    output['fis'] = input['fis']
-    output['si'] = input['si']
-    output['ssc'] = input['ssc']
-    output['fd'] = input['fd']
-    output['fs'] = input['fs']
-    output['faw'] = input['faw']
-    output['du'] = input['du']
-    output['dur'] = input['dur']
-    
-    output['yr'] = np.arange(0, input['dur'] + 1)
-    output['slr'] = slr
-    output['slrr'] = slrr
-    output['dAi'] = dAi
-    output['dVc'] = dVc
-    output['dVc_sl'] = dVc_sl
-    output['dVc_wh'] = dVc_wh
-    output['dVi'] = dVi
-    output['dVi_sl'] = dVi_sl
-    output['dVi_wh'] = dVi_wh
-    output['dVs'] = dVs
-    output['dVd'] = dVd
-    output['dVout'] = dVout
-    output['dVi_sed_sl'] = dVi_sed_sl
-    output['dVi_sed_wh'] = dVi_sed_wh
-    output['dVi_sed'] = dVi_sed
-    output['ds'] = ds
-    output['dBr'] = dBr
-    output['at'] = at
-    
-    output['Ai'] = Ai
-    output['Ac'] = Ac 
-    output['Ab'] = output['Ai'] + output['Ac']   
-    output['Vr'] = Vr
-    output['Vc'] = Vc
-    output['Vi'] = Vi
-    output['Vs'] = Vs
-    output['Vd'] = Vd
-    output['Vout'] = Vout
-    output['hc'] = hc
-    output['hi'] = hi
-    output['hiod'] = hiod
-    output['hcod'] = hcod
-    output['P'] = P
-    output['Vceq'] = Vceq
-    output['sedVc'] = sedVc
-    output['sedVi'] = Vi_sed
-    output['sedVd'] = sedVd
-    output['sedVs'] = sedVs
-    output['sedVr'] = sedVr
-    output['sedVout'] = sedVout
-    
-    output['Qssec'] = Qssec
-    output['Qrc'] = Qrc
-    output['Qcd'] = Qcd
-    output['Qci'] = Qci
-    output['Qri'] = Qri
-    output['Qcs'] = Qcs
-    output['Qso'] = Qso
-    
-    # Create results directory if it doesn't exist
-    results_dir = 'results'
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
-    
-    # Save output to a .mat file in the results directory
-    output_file = os.path.join(results_dir, FileName)
-    scipy.io.savemat(output_file, output) 
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  MorQuest Core Code.
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+# changes 19Apr2024
+# If the input image is a multi-band one, use all the channels in
+# building the stack.
+# mreyec@uni.pe
+
+import numpy as np
+import os
+
+import Forcing
+import Instrument
+import Kernel
+
+#Read Input
+def morquest_set_input(Ac=0, Ai=0, dH=0, Qr=0, fQr=0, ssc=0, fssc=0, slr=0, lsys=0, cl=0, betas=0, cd=0, fd=0, du=0,
+                       por=0, rho=0, dur=0, T=0, slrtype='linear', slrst=None, incAi=0, tr=0, erc=0, ecs=0, fis=0, si=0, fs=0, faw=0,
+                       Qr_series=None, ssc_series=None, start=None, **kwargs):
+    
+    input = {
+        'Ac': Ac,                                   #channel area, m2
+        'Ai': Ai,                                   #intertidal area, m2
+        'dH': dH,                                   #tidal difference, m
+        'Qr': Qr,                                   #river flow, m3/s
+        'fQr': fQr,                                 #yearly river flow growth as a fraction of Qr, -
+        'Qr_series': Qr_series,                     #river flow per year instead of Qr/fQr (array, Series by year, callable, iterator or series name), m3/s
+        'ssc': ssc,                                 #river suspended sediment concentration, give always value to prevent div0, mg/l, g/m3
+        'fssc': fssc,                               #yearly ssc growth as a fraction of ssc, -
+        'ssc_series': ssc_series,                   #ssc per year instead of ssc/fssc, like Qr_series, mg/l
+        'start': start,                             #year of the series at model year 0, None: their first year
+        'slr': slr,                                 #sea level rise after 'dur' years, m
+        'slrtype': slrtype,                         #sea level rise type: 'linear'/'accel'/'timep' or a curve registered in Forcing.py
+        'slrst': slrst,                             #year the sea level starts rising, None: default of slrtype ('timep': 200)
+        'incAi': incAi,                             #increase it area per year as percentage of intertidal area at t=0,
+
+        #'at' : 40.0                                #intertidal area slr adaptation timescale, yr
+        #'lit' : 3000                               #it area length perp to channel axis, m        
+        
+        'tr': tr,                                 #exchange from channel to shore as percentage of instantaneous total exchange
+        'lsys': lsys,                               #empirically derived; system length scale; important to calculate connection length itarea to channel, m
+        'cl': cl,                                   #coastline length, m
+        'Vout': 1e10,                               #outside world sediment volumen
+        'betas': betas,                             #active shorezone slope [-]
+        'cd': cd,                                   #closure depth, m
+        'fd': fd,                                  #dune factor, m
+        'du': du,                                   #dune height above active zone, for Bruun rule, m
+
+        'erc': erc,                                 #maximun river supply entrapment portion from river into channel, -
+        'ecs': ecs,                                 #maximum river supply entrapment portion from channel into shorelin, -
+        'fis': fis,                                 #calibration factor for transport from river to it area under river sedsupply change, 1 menas all excess sedimen supply to itarea, [0 1], -
+        'si': si,                                   #factor increasing intertidal area slope at edge for slr computations ; smaller value implies less intertidal area under slr. 1 = linear. (no effect if ~ >10), [0 inf], -
+        'fs': fs,                                  #factor distributing it area deposition to it area width and channel slope, [0 1], -; 
+        'faw': faw,                                 #factor diminishing fs and fis in case of lowering Qrc, [0 1], -; 
+
+        'por': por,                                 #porosity, -
+        'rho': rho,                                #sediment density, kg/m3
+        'dur': dur,                                 #timespan calculation, yr
+        'T': T,                                 #tidal period, s
+
+        #Plotting parameters
+        'plotme': 1,                        #make figures
+        'plottimeres': 1,                   #plotting resolution, y
+        'savemyplots': 0,                   #save plots to hardcopy
+        'savemyplotsinfolder': './figs/'    #folder to save plots in
+    }
+    input.update(kwargs)
+
+    #Verification of the list of data as INPUT
+    return input    
+
+def scalar(value):
+    # Single input value as float; accepts numbers and length-1 arrays/Series (e.g. a DataFrame row)
+    return float(np.asarray(value, dtype=float).reshape(-1)[0])
+
+def Run_morquest(input, FileName=None, store=None, backend='python', events=None, stop=None, events_only=False,
+                 output=None):
+    # input = morquest_set_input()      
+    # You can override the default values by passing keyword arguments to the function like this:
+    # input = morquest_set_input(Ac=100e6, slr=5, dur=5, incAi = .1)
+    # The result is returned in memory as a MorquestResult. Pass FileName ('output.mat' or 'output.npz') to also
+    # save it in the results folder, or store (e.g. a result store) to append it there.
+    # backend selects the time-loop kernel: 'python', or 'numba' / 'auto' for the compiled one (see Kernel.py).
+    # events records the first year of events such as 'drowned', 'channel_empty', 'shore_exhausted' or threshold
+    # crossings (see Kernel.pack_events) in result.events (-1: not reached); stop lists the events that end the
+    # run, the remaining years are then NaN. With events_only=True the result keeps only the events.
+    # output selects the series and years of the result (see output_spec), e.g. ['Ai', 'Vc'] or
+    # {'variables': ['Ai'], 'stride': 10}; memory and file size then scale with the selection.
+    spec = output_spec(output, int(input['dur']))
+
+    # With instrumentation on (see Instrument.py) the stages are timed as run.forcing, run.loop, run.closing,
+    # run.output and save, and the clamps of the loop are counted
+    with Instrument.timer('run.forcing'):
+        #Efect of the sea Level (see Forcing.py for the slrtype curves)
+        slr, slrr, slrst = Forcing.slr_forcing(input['slrtype'], scalar(input['slr']), input['dur'], input.get('slrst'))
+
+        #Efect of the sediment concentration and river discharge: linear growth (fssc, fQr) or a series (see Forcing.py)
+        tt = np.arange(0, input['dur']+1, input['plottimeres'])
+        ssc = np.asarray(Forcing.river_forcing(input.get('ssc_series'), scalar(input['ssc']), scalar(input['fssc']), tt,
+                                               input['plottimeres'], input.get('start')))
+        Qr = np.asarray(Forcing.river_forcing(input.get('Qr_series'), scalar(input['Qr']), scalar(input['fQr']), tt,
+                                              input['plottimeres'], input.get('start')))
+
+        #Sediment supply
+        Qssec = Qr * ssc                                                #sediment supply, kg/s
+
+        # Model state: one row per variable of the yearly loop, see Kernel.STATE
+        params = Kernel.pack_params(input)
+        S = Kernel.new_state(len(tt))
+        S[Kernel.QRC] = Qssec * 3600 * 24 * 365 / params[Kernel.P_RHO] / (1 - params[Kernel.P_POR])    #yearly sediment supply volume incl porosity, m3/yr
+        slrr = np.asarray(slrr, dtype=float)
+
+    # Yearly time loop and final timestep (the kernel computes both values of its selects, e.g. a depth where the
+    # area is zero, so the discarded ones may divide by zero)
+    event_names, event_table = Kernel.pack_events(events, stop)
+    counts = Kernel.new_counts()
+    with Instrument.timer('run.loop'), np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        last = Kernel.get_kernel(backend)(params, S, slrr, Qr, ssc, slrst, int(input['dur']), counts, *event_table)
+    add_clamps(counts)
+    event_years = event_result(event_names, event_table, stop)
+    if events_only:
+        result = MorquestResult({}, result_meta(input), result_params(input), event_years)
+        save_result(result, FileName, store)
+        return result
+    S[:, last + 1:] = np.nan                                            #years after a stop event
+    state = dict(zip(Kernel.STATE, S))                                  #named views on the state rows
+
+    if last >= int(input['dur']) - 1:
+        with Instrument.timer('run.closing'):
+            Kernel.closing_balance(params, S, slrr, int(input['dur']) - 1)
+
+    # Output
+    with Instrument.timer('run.output'):
+        series = result_series(state, np.arange(0, input['dur'] + 1), slr, slrr, Qssec, spec['variables'])
+        series = select_output(series, spec)
+        result = MorquestResult(series, result_meta(input), result_params(input), event_years)
+    save_result(result, FileName, store)
+    return result
+
+
+def add_clamps(counts):
+    # Clamp counts of a run (one per Kernel.CLAMPS) to the instrumentation counters clamp.<name>
+    if Instrument.enabled():
+        for name, count in zip(Kernel.CLAMPS, counts):
+            Instrument.add(f'clamp.{name}', int(count))
+
+
+#Output series of a run, in this order ('yr' is always kept), and the state rows they differ from
+OUTPUT_KEYS = ['yr', 'slr', 'slrr', 'dAi', 'dVc', 'dVc_sl', 'dVc_wh', 'dVi', 'dVi_sl', 'dVi_wh', 'dVs', 'dVd', 'dVout',
+               'dVi_sed_sl', 'dVi_sed_wh', 'dVi_sed', 'ds', 'dBr', 'at', 'Ai', 'Ac', 'Ab', 'Vr', 'Vc', 'Vi', 'Vs', 'Vd',
+               'Vout', 'hc', 'hi', 'hiod', 'hcod', 'P', 'Vceq', 'sedVc', 'sedVi', 'sedVd', 'sedVs', 'sedVr', 'sedVout',
+               'Qssec', 'Qrc', 'Qcd', 'Qci', 'Qri', 'Qcs', 'Qso']
+OUTPUT_ROWS = {'sedVi': 'Vi_sed'}
+
+def output_spec(output=None, dur=None):
+    """
+    Check an output spec: which series a run returns, and at which years.
+
+    Parameters:
+    - output (list or dict): Series names (see OUTPUT_KEYS), or a dict with 'variables' (list, default: all),
+      'stride' (int: every stride-th year from year 0, plus the last year) or 'years' (list of model years).
+      None keeps every series at every year.
+    - dur (int): Run length, to check the years against.
+
+    Returns:
+    - dict: 'variables' (list, None for all) and 'years' (int array, None for all years).
+    """
+    if output is None:
+        output = {}
+    elif not isinstance(output, dict):
+        output = {'variables': list(output)}
+    unknown = set(output) - {'variables', 'stride', 'years'}
+    if unknown:
+        raise ValueError(f"Unknown output spec keys {sorted(unknown)}; use 'variables', 'stride' or 'years'")
+    variables = output.get('variables')
+    if variables is not None:
+        variables = [key for key in dict.fromkeys(variables) if key != 'yr']
+        missing = [key for key in variables if key not in OUTPUT_KEYS]
+        if missing:
+            raise ValueError(f"Unknown output variables {missing}; available: {OUTPUT_KEYS[1:]}")
+    years = None
+    if output.get('stride') is not None and output.get('years') is not None:
+        raise ValueError("Give either 'stride' or 'years' in an output spec, not both")
+    if output.get('stride') is not None:
+        stride = int(output['stride'])
+        if stride < 1:
+            raise ValueError('The output stride must be a positive number of years')
+        years = np.unique(np.append(np.arange(0, dur + 1, stride), dur))
+    elif output.get('years') is not None:
+        years = np.unique(np.asarray(output['years'], dtype=int))
+        if years.size and (years[0] < 0 or years[-1] > dur):
+            raise ValueError(f'Output years must lie between 0 and dur = {dur}')
+    return {'variables': variables, 'years': years}
+
+def result_series(state, yr, slr, slrr, Qssec, variables=None):
+    # Output time series of a run from the named rows of its state buffer (see Kernel.STATE), with time as first
+    # axis; variables selects series (default: OUTPUT_KEYS), the derived ones are only computed when selected
+    derived = {
+        'yr': lambda: yr,
+        'slr': lambda: slr,
+        'slrr': lambda: slrr,
+        'Ab': lambda: state['Ai'] + state['Ac'],
+        'sedVc': lambda: np.cumsum(state['Qrc'], axis=0) - np.cumsum(state['Qci'], axis=0) - np.cumsum(state['Qcd'], axis=0)
+                         - np.cumsum(state['Qcs'], axis=0) - np.cumsum(state['Qco'], axis=0),
+        'sedVd': lambda: state['Vd'] - state['Vd'][0],
+        'sedVs': lambda: state['Vs'] - state['Vs'][0],
+        'sedVr': lambda: state['Vr'] - state['Vr'][0],
+        'sedVout': lambda: state['Vout'] - state['Vout'][0],
+        'Qssec': lambda: Qssec,
+    }
+    keys = OUTPUT_KEYS if variables is None else ['yr'] + list(variables)
+    return {key: derived[key]() if key in derived else state[OUTPUT_ROWS.get(key, key)] for key in keys}
+
+def select_output(series, spec):
+    # Series of an output spec at its years (time as first axis; slrr, one value per year up to dur - 1, keeps the
+    # years it has). A spec selecting variables or years gets copies, so that the full state buffer of the run is
+    # not kept alive by views on it
+    if spec['variables'] is None and spec['years'] is None:
+        return series
+    if spec['years'] is None:
+        return {key: np.array(value) for key, value in series.items()}
+    years = spec['years']
+    return {key: np.asarray(value)[years[years < len(value)]] for key, value in series.items()}
+
+
+#Scalar metadata stored with every result, next to the time series
+META_KEYS = ['slrtype', 'incAi', 'lsys', 'tr', 'cl', 'slope', 'cd', 'erc', 'ecs', 'fis', 'si', 'ssc', 'fd', 'fs', 'faw',
+             'du', 'dur']
+
+def result_meta(input):
+    meta = {}
+    for key in META_KEYS:
+        value = input['betas'] if key == 'slope' else input[key]
+        if not isinstance(value, str):
+            value = np.asarray(value, dtype=float)
+            value = value.item() if value.size == 1 else value
+        meta[key] = value
+    meta['dur'] = int(input['dur'])
+    return meta
+
+def event_result(names, table, stop):
+    # First year of every event (-1: not reached), plus 'stop' (year the run ended early, -1: ran to the end) when
+    # stop events are given; per-scenario arrays for a batch
+    stops, years = table[3], table[4]
+    events = {name: years[k] if years.ndim > 1 else int(years[k]) for k, name in enumerate(names)}
+    if stop:
+        reached = np.where(years[stops] >= 0, years[stops], np.iinfo(np.int64).max)
+        first = reached.min(axis=0) if stops.any() else np.iinfo(np.int64).max
+        events['stop'] = np.where(first == np.iinfo(np.int64).max, -1, first)
+        events['stop'] = events['stop'] if years.ndim > 1 else int(events['stop'])
+    return events
+
+def result_params(input, batch=False):
+    # Full morquest_set_input parameter set of a run (per-scenario arrays for a batch), used to index stored results
+    params = {'slrtype': input['slrtype'], 'dur': int(input['dur'])}
+    for key in BATCH_KEYS:
+        value = np.asarray(input[key], dtype=float)
+        params[key] = value.reshape(-1) if batch else value.reshape(-1)[0].item()
+    return params
+
+#Storage precisions of batched and stored results; the model always computes in float64
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+def downcast(series, precision='float32'):
+    """
+    Series in a lower storage precision, with the accuracy this costs.
+
+    Parameters:
+    - series (dict): float64 series of a run.
+    - precision (str): Key of PRECISIONS.
+
+    Returns:
+    - tuple: (series in the new precision; dict of the maximum relative deviation of each series from its float64
+      values: about 6e-8 for float32, 1 where a non-zero value flushes to zero, inf where a value overflows).
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; use one of {list(PRECISIONS)}")
+    low, deviation = {}, {}
+    for key, value in series.items():
+        value = np.asarray(value, dtype=float)
+        exact = np.isfinite(value) & (value != 0)
+        with np.errstate(over='ignore', invalid='ignore'):                  #overflow is reported as inf
+            low[key] = value.astype(PRECISIONS[precision])
+            error = np.abs(low[key][exact].astype(float) - value[exact]) / np.abs(value[exact])
+        deviation[key] = float(np.max(error, initial=0.0))
+    return low, deviation
+
+def merge_deviation(deviation, other):
+    # Largest relative deviation per series of two downcast reports
+    return {key: max(deviation.get(key, 0.0), other.get(key, 0.0)) for key in {**deviation, **other}}
+
+class MorquestResult:
+    """
+    In-memory result of a morQuest run.
+
+    Holds every output time series as a contiguous float64 array (shape [dur + 1], or [N, dur + 1] for a batched
+    run; float32 when the batch was run with precision='float32'), the scalar metadata of the run and the first
+    year of the requested events. Indexing by name works like the former output dictionary, e.g. result['Ai'] or
+    result['dur']. deviation holds the maximum relative deviation of each float32 series from its float64 values.
+    """
+
+    def __init__(self, series, meta, params=None, events=None, deviation=None):
+        self.series = {key: np.ascontiguousarray(value, dtype=np.float32 if np.asarray(value).dtype == np.float32
+                                                 else float) for key, value in series.items()}
+        self.meta = dict(meta)
+        self.params = dict(params) if params is not None else {}
+        self.deviation = dict(deviation) if deviation is not None else {}
+        self.events = dict(events) if events is not None else {}
+
+    def __getitem__(self, key):
+        if key in self.series:
+            return self.series[key]
+        return self.meta[key]
+
+    def __contains__(self, key):
+        return key in self.series or key in self.meta
+
+    def keys(self):
+        return list(self.meta) + list(self.series)
+
+    @property
+    def n_scenarios(self):
+        return int(np.size(self.params['Ai'])) if 'Ai' not in self.series else \
+            (1 if self.series['Ai'].ndim == 1 else self.series['Ai'].shape[0])
+
+    def member(self, i):
+        # Single-scenario view of a batched result
+        series = {key: value if key == 'yr' else value[i] for key, value in self.series.items()}
+        meta = {key: value[i] if isinstance(value, np.ndarray) else value for key, value in self.meta.items()}
+        params = {key: value[i] if isinstance(value, np.ndarray) else value for key, value in self.params.items()}
+        events = {key: int(value[i]) for key, value in self.events.items()}
+        return MorquestResult(series, meta, params, events, self.deviation)              #deviation of the batch
+
+    def to_dict(self):
+        output = dict(self.meta)
+        output.update(self.series)
+        output.update({f'event_{key}': value for key, value in self.events.items()})
+        return output
+
+    def save(self, FileName, results_dir='results'):
+        # '.npz' files are written with numpy, anything else as a MATLAB '.mat' file
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+            FileName = os.path.join(results_dir, FileName)
+        if FileName.endswith('.npz'):
+            np.savez(FileName, **self.to_dict())
+        else:
+            import scipy.io
+            scipy.io.savemat(FileName, self.to_dict())
+        return FileName
+
+    @classmethod
+    def load(cls, FileName):
+        if FileName.endswith('.npz'):
+            with np.load(FileName) as data:
+                data = {key: data[key] for key in data.files}
+        else:
+            import scipy.io
+            data = scipy.io.loadmat(FileName)
+        meta, series, events = {}, {}, {}
+        for key, value in data.items():
+            if key.startswith('__'):
+                continue
+            value = np.asarray(value)
+            if key.startswith('event_'):
+                events[key[6:]] = int(value.item()) if value.size == 1 else np.ravel(value)
+            elif key in META_KEYS:
+                value = value.item() if value.size == 1 else np.ravel(value)
+                meta[key] = value.strip() if isinstance(value, str) else value
+            else:
+                series[key] = np.ravel(value) if value.ndim < 2 or 1 in value.shape else value
+        return cls(series, meta, events=events)
+
+def save_result(result, FileName=None, store=None, results_dir='results'):
+    # Optional persistence sinks for a MorquestResult: a .mat/.npz file in results_dir and/or any store
+    # object providing append(result)
+    if FileName is None and store is None:
+        return
+    with Instrument.timer('save'):
+        if FileName is not None:
+            Instrument.add_file('bytes_written.result', result.save(FileName, results_dir))
+        if store is not None:
+            store.append(result)
+
+
+#Parameters that may vary per scenario in a batched run
+BATCH_KEYS = ['Ac', 'Ai', 'dH', 'Qr', 'fQr', 'ssc', 'fssc', 'slr', 'incAi', 'tr', 'lsys', 'cl', 'Vout', 'betas', 'cd',
+              'fd', 'du', 'erc', 'ecs', 'fis', 'si', 'fs', 'faw', 'por', 'rho', 'T']
+
+def batch_inputs(input):
+    """
+    Broadcast the numeric entries of a morquest_set_input dictionary to a common [N] shape.
+
+    Parameters:
+    - input (dict): Input dictionary whose BATCH_KEYS entries are scalars or array-likes of length N.
+
+    Returns:
+    - dict: Copy of input with every BATCH_KEYS entry as a float64 array of shape [N].
+    """
+    values = [np.asarray(input[key], dtype=float).reshape(-1) for key in BATCH_KEYS]
+    values = np.broadcast_arrays(*values)
+    batch = dict(input)
+    for key, value in zip(BATCH_KEYS, values):
+        batch[key] = np.ascontiguousarray(value)
+    return batch
+
+def Run_morquest_batch(input, FileName=None, store=None, events=None, stop=None, events_only=False, output=None,
+                       precision='float64'):
+    # Vectorized version of Run_morquest: every BATCH_KEYS entry of input may be an array of N values
+    # (one per scenario) and all N scenarios are stepped together. 'dur', 'slrtype' and 'plottimeres'
+    # are shared by the whole batch. The scenarios are stepped by the kernel of Run_morquest, run on arrays with
+    # one value per scenario (see Kernel.py), so member i reproduces Run_morquest on the i-th parameter set exactly.
+    # Returns a MorquestResult with time series of shape [N, dur + 1]; see Run_morquest for FileName, store,
+    # events, stop, events_only and output. The loop ends once every scenario has met a stop event.
+    # precision='float32' returns (and saves or stores) the series in float32, halving their memory and I/O. The
+    # model still runs in float64, and the derived series that cancel large values (sedVc, the sedV* changes of
+    # Vout = 1e10, ...) are formed in float64 before the cast; result.deviation reports the maximum relative
+    # deviation of every series from the float64 run.
+    p = batch_inputs(input)
+    n = len(p['Ac'])
+    dur = int(input['dur'])
+    spec = output_spec(output, dur)
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; use one of {list(PRECISIONS)}")
+
+    #Efect of the sea Level; an absolute slrtype curve is shared by all scenarios without copies
+    slr, slrr, slrst = Forcing.slr_forcing(input['slrtype'], p['slr'], dur, input.get('slrst'))
+
+    #Efect of the sediment concentration and river discharge; rows are time, columns are scenarios. A series shared
+    #by all scenarios is not copied per scenario
+    tt = np.arange(0, dur + 1, input['plottimeres'])
+    nt = len(tt)
+    ssc = Forcing.river_forcing(input.get('ssc_series'), p['ssc'], p['fssc'], tt, input['plottimeres'], input.get('start'))
+    Qr = Forcing.river_forcing(input.get('Qr_series'), p['Qr'], p['fQr'], tt, input['plottimeres'], input.get('start'))
+
+    #Model state: one row per variable of the yearly loop (see Kernel.STATE), one column per scenario
+    params = np.array([p[key] for key in Kernel.PARAMS])
+    S = np.zeros((len(Kernel.STATE), nt, n))
+    Qssec = Qr * ssc                                                    #sediment supply, kg/s
+    S[Kernel.QRC] = Qssec * 3600 * 24 * 365 / p['rho'] / (1 - p['por'])   #yearly sediment supply volume incl porosity, m3/yr
+    slrr = np.asarray(slrr, dtype=float)
+    rows = dict(zip(Kernel.STATE, S))                                   #named views on the state rows
+    counts = Kernel.new_counts()                                        #clamps summed over the scenarios
+
+    #Events: first year per scenario (-1: not reached); stopped_at is the year a stop event ended the scenario
+    event_names, event_table = Kernel.pack_events(events, stop)
+    ev_rows, ev_ops, ev_values, ev_stops = event_table[:4]
+    ev_years = np.full((len(event_names), n), -1)
+    stopped_at = np.full(n, -1)
+    compare = [np.less_equal, np.greater_equal, np.less, np.greater]            #Kernel.OPS
+
+    def detect(yr):
+        # Returns True once every scenario has stopped
+        active = stopped_at < 0
+        for k in range(len(event_names)):
+            hit = active & (ev_years[k] < 0) & compare[ev_ops[k]](S[ev_rows[k], yr], ev_values[k])
+            ev_years[k] = np.where(hit, yr, ev_years[k])
+            if ev_stops[k]:
+                stopped_at[:] = np.where(hit & (stopped_at < 0), yr, stopped_at)
+        return bool((stopped_at >= 0).all())
+
+    #Yearly time loop, final timestep and closing balance of the kernel, stepped on all scenarios at once
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'), Instrument.timer('batch.loop'):
+        Kernel.initialize_batch(params, S, slrr, Qr, ssc)
+        Ab = params[Kernel.P_AC] + params[Kernel.P_AI]                  #basin area, m2
+        tt, dt = np.arange(dur + 1) * 1.0, np.ones(dur + 1)
+        itp = np.ones(n, dtype=np.int64)
+        for yr in range(dur - 1):
+            itp = Kernel.step_batch(params, S, slrr, slrst, yr, itp, Ab, tt, dt, slrst + 1, counts)
+            if event_names and detect(yr):
+                break
+        else:
+            Kernel.final_step_batch(params, S, slrr, slrst, dur - 1, tt, dt, counts)
+            if event_names:
+                detect(dur - 1)
+                detect(dur)
+            Kernel.closing_batch(params, S, slrr, dur - 1)
+
+        #years after a stop event
+        if (stopped_at >= 0).any():
+            after = (np.arange(nt)[:, None] > stopped_at) & (stopped_at >= 0)
+            S[:, after] = np.nan
+
+    add_clamps(counts)
+    meta = dict(p)
+    meta.update(slrtype=input['slrtype'], dur=dur)
+    event_years = event_result(event_names, (None, None, None, ev_stops, ev_years), stop)
+    if events_only:
+        result = MorquestResult({}, result_meta(meta), result_params(meta, batch=True), event_years)
+        save_result(result, FileName, store)
+        return result
+
+    # Output, scenario-major
+    with Instrument.timer('batch.output'), np.errstate(invalid='ignore', over='ignore'):
+        series = result_series(rows, np.arange(0, dur + 1), slr, slrr, Qssec, spec['variables'])
+        if spec['years'] is not None:
+            series = select_output(series, spec)
+        series = {key: value.T for key, value in series.items()}          #copied once by MorquestResult
+        deviation = None
+        if precision != 'float64':
+            series, deviation = downcast(series, precision)
+        result = MorquestResult(series, result_meta(meta), result_params(meta, batch=True), event_years, deviation)
+    save_result(result, FileName, store)
+    return result
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Adaptive time steps: the error falls as rtol tightens
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import numpy as np
+import pytest
+
+from Adaptive import run_adaptive
+from Benchmark import ALSEA_BAY
+from morQuest import morquest_set_input
+
+GRID = np.arange(0, 20.001, 0.01)
+
+
+def _loss(result):
+    # First output time without intertidal area
+    return GRID[np.argmax(result['Ai'] <= 0)]
+
+
+@pytest.mark.parametrize('case', [dict(slr=0.6), dict(slr=0.4, si=0.2), dict(slr=0.3, tr=0.05)])
+def test_error_falls_with_rtol(case):
+    input = morquest_set_input(**dict(ALSEA_BAY, dur=20, **case))
+    reference = run_adaptive(input, dt0=0.005, dt_min=0.005, dt_max=0.005, rtol=np.inf, output=GRID)[0]
+    previous = {'Ai': np.inf, 'Vi': np.inf, 'Vc': np.inf, 'loss': np.inf}
+    for rtol in [1e-2, 1e-3, 1e-4]:
+        result, stats = run_adaptive(input, rtol=rtol, output=GRID)
+        n = int(min(_loss(result), _loss(reference)) / 0.01) - 5            #before the intertidal area is lost
+        errors = {key: np.max(np.abs(result[key][:n] - reference[key][:n])) / np.ptp(reference[key][:n])
+                  for key in ['Ai', 'Vi', 'Vc']}
+        errors['loss'] = abs(_loss(result) - _loss(reference))
+        assert all(errors[key] <= previous[key] for key in errors), (rtol, errors, previous)
+        previous = errors
+    assert max(previous['Ai'], previous['Vi'], previous['Vc']) < 5e-3 and previous['loss'] <= 0.15
+    assert stats['evaluations'] < 1000
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Members of a batched run against single runs
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import numpy as np
+import pytest
+
+from Benchmark import ALSEA_BAY
+from morQuest import OUTPUT_KEYS, BATCH_KEYS, Run_morquest, Run_morquest_batch, morquest_set_input
+
+#One scenario per column: Alsea Bay, drowning ones (fast rise, low si), channel exchange (tr > 0), growing and
+#shrinking river supply, and an eroding one
+MEMBERS = [{},
+           dict(slr=80, si=0.02),
+           dict(slr=6, si=0.05, tr=0.1, fQr=0.02),
+           dict(tr=5.0, ssc=0.0001, Qr=0.1),
+           dict(slr=3.2, fQr=0.03, fssc=-0.015, incAi=-0.01, tr=0.1, si=1.4, fs=0.2, fis=0.8, faw=0.3, dH=3.5),
+           dict(slr=1.5, fQr=-0.02, fssc=0.04, incAi=0.001, si=0.5, fs=0.9, fis=0.3, faw=0.7, dH=0.8, Ai=2e7, Ac=1e6),
+           dict(slr=0.0, tr=0.01, ecs=0.9)]
+
+
+def _inputs(slrtype, **options):
+    dur = 302 if slrtype == 'timep' else 100
+    members = [morquest_set_input(**dict(ALSEA_BAY, **member, slrtype=slrtype, dur=dur), **options)
+               for member in MEMBERS]
+    batch = dict(members[0])
+    batch.update({key: np.array([member[key] for member in members], dtype=float) for key in BATCH_KEYS})
+    return members, batch
+
+
+@pytest.mark.parametrize('slrtype', ['linear', 'accel', 'timep'])
+def test_members_match_single_runs(slrtype):
+    members, batch = _inputs(slrtype)
+    events = ['drowned', 'channel_empty', 'shore_exhausted']
+    result = Run_morquest_batch(batch, events=events)
+    assert (result.events['drowned'] >= 0).any() and (result.events['drowned'] < 0).any()
+    for i, input in enumerate(members):
+        single, member = Run_morquest(input, events=events), result.member(i)
+        for key in OUTPUT_KEYS:
+            assert np.array_equal(member[key], single[key], equal_nan=True), (i, key)
+        assert member.events == single.events
+
+
+def test_members_match_single_runs_with_stop():
+    members, batch = _inputs('linear')
+    result = Run_morquest_batch(batch, events=['drowned'], stop=['drowned'])
+    assert (result.events['stop'] >= 0).any() and (result.events['stop'] < 0).any()
+    for i, input in enumerate(members):
+        single, member = Run_morquest(input, events=['drowned'], stop=['drowned']), result.member(i)
+        for key in OUTPUT_KEYS:
+            assert np.array_equal(member[key], single[key], equal_nan=True), (i, key)
+        assert member.events == single.events
+
+
+def test_members_match_single_runs_with_river_series():
+    series = 40 + 15 * np.sin(np.arange(101) / 3.0)
+    members, batch = _inputs('accel', Qr_series=series)
+    result = Run_morquest_batch(batch)
+    for i, input in enumerate(members):
+        single, member = Run_morquest(input), result.member(i)
+        for key in OUTPUT_KEYS:
+            assert np.array_equal(member[key], single[key], equal_nan=True), (i, key)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Calibration: observations, recovery of known coefficients and the estuary pool
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Calibration
+import Loader
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, morquest_set_input
+
+
+@pytest.fixture(scope='module')
+def synthetic():
+    # Observations of a run with si = 0.1: Ai every 3 years, Ac at the end only
+    truth = Run_morquest(morquest_set_input(**dict(ALSEA_BAY, si=0.1, dur=30, slr=0.1)))
+    years = np.arange(0, 31, 3)
+    return pd.DataFrame({'Year': 1985.0 + years, 'Ai': truth['Ai'][years],
+                         'Ac': np.where(years == 30, truth['Ac'][years], np.nan)})
+
+
+def test_load_observed():
+    observed = Calibration.load_observed('Umpqua_river')
+    csv = pd.read_csv('results/00_Input_Intertidal_Area_Umpqua_river.csv')
+    channel = Loader.channel_areas().set_index('name2')['area']
+    assert list(observed['Year']) == list(csv['Year']) + [Calibration.CHANNEL_YEAR]
+    np.testing.assert_allclose(observed['Ai'][:-1], csv['area'] * 1e6)
+    assert np.isnan(observed['Ai'].iloc[-1])
+    assert observed['Ac'].iloc[-1] == pytest.approx(channel['Umpqua_river'] * 1e6)
+    assert observed['Ac'][:-1].isna().all()
+    assert list(Calibration.load_observed('Umpqua_river', channel=None).columns) == ['Year', 'Ai']
+
+
+@pytest.mark.parametrize('method', ['gradient', 'evolution'])
+def test_recovers_known_coefficient(synthetic, method):
+    fit = Calibration.calibrate(dict(ALSEA_BAY, si=0.3, slr=0.1), synthetic, params=['si'], method=method, maxiter=50,
+                                popsize=10)
+    assert fit['params']['si'] == pytest.approx(0.1, rel=1e-6)
+    assert fit['misfit'] < 1e-6 and not fit['cached']
+
+
+def test_misfit_includes_channel_area(synthetic):
+    fit = Calibration.calibrate(dict(ALSEA_BAY, si=0.1, slr=0.1), synthetic, params=['si'], method='gradient')
+    shifted = synthetic.assign(Ac=synthetic['Ac'] * 1.1)
+    assert Calibration.calibrate(dict(ALSEA_BAY, si=0.1, slr=0.1), shifted, params=['si'],
+                                 method='gradient')['misfit'] > fit['misfit'] + 1e-3
+
+
+def test_calibrate_estuaries(synthetic, tmp_path):
+    assert Calibration.calibrate_estuaries({}).empty
+    estuaries = {'Synthetic': (dict(ALSEA_BAY, si=0.3, slr=0.1), synthetic)}
+    options = dict(params=['si'], method='gradient', cache_dir=str(tmp_path), max_workers=1)
+    table = Calibration.calibrate_estuaries(estuaries, **options)
+    assert list(table.index) == ['Synthetic'] and not table.loc['Synthetic', 'cached']
+    assert table.loc['Synthetic', 'si'] == pytest.approx(0.1, rel=1e-6)
+    again = Calibration.calibrate_estuaries(estuaries, **options)
+    assert again.loc['Synthetic', 'cached'] and again.loc['Synthetic', 'si'] == table.loc['Synthetic', 'si']
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Equilibrium state: settling year and continued horizons
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pytest
+
+from Benchmark import ALSEA_BAY
+from Equilibrium import equilibrium, settled_year
+from morQuest import Run_morquest, morquest_set_input
+
+
+def _run(input, rate, dur):
+    # Single run over one horizon, as the equilibrium used to rerun it
+    return Run_morquest(dict(morquest_set_input(**input), slrtype='linear', slr=rate * dur, dur=dur, plottimeres=1,
+                             slrst=None))
+
+
+@pytest.mark.parametrize('case, year, dur', [({}, 48, 256), (dict(tr=0.01), 818, 1024),
+                                             (dict(tr=0.01, slr=20.0, si=0.05), 928, 1024)])
+def test_alsea_settling_year(case, year, dur):
+    input = dict(ALSEA_BAY, **case)
+    eq = equilibrium(input, backend='python')
+    assert eq['converged'] and eq['year'] == year
+    assert eq['years'] == dur and eq['runs'] == int(np.log2(dur / 256)) + 1    #no year simulated twice
+    rate = input['slr'] / input['dur']
+    reference = _run(input, rate, dur)
+    assert settled_year(reference, years=dur) == (eq['year'], eq['state'], eq['rates'])
+    assert eq['result'].series.keys() == reference.series.keys()
+    for key in reference.series:
+        np.testing.assert_array_equal(eq['result'][key], reference[key], err_msg=key)
+    assert eq['result']['dur'] == dur
+
+
+def test_aitken_settles_earlier():
+    input = dict(ALSEA_BAY, tr=0.01)
+    eq = equilibrium(input, solver='aitken', backend='python')
+    assert eq['converged'] and eq['year'] == 49 and eq['years'] == 256
+    assert eq['state']['Vc'] == pytest.approx(equilibrium(input, backend='python')['state']['Vc'], rel=1e-4)
+
+
+def test_not_converged_within_max_dur():
+    eq = equilibrium(dict(ALSEA_BAY, tr=0.01), dur=128, max_dur=512, backend='python')
+    assert not eq['converged'] and eq['year'] == -1 and eq['state'] == {}
+    assert eq['runs'] == 3 and eq['years'] == 512 and len(eq['result']['Ai']) == 513
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Event years of events_only and stopped runs kept by the result store
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import numpy as np
+
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, Run_morquest_batch, morquest_set_input
+from Store import ResultStore
+
+EVENTS = {'drowned': None, 'half_Ai': ('Ai', '<=', 4e6)}
+
+
+def test_events_only_round_trip(tmp_path):
+    input = morquest_set_input(**dict(ALSEA_BAY, slr=np.array([0.5, 3.0, 20.0]), si=np.array([0.5, 0.1, 0.1]),
+                                             dur=100))
+    store = ResultStore(str(tmp_path))
+    batch = Run_morquest_batch(input, events=EVENTS, stop=['drowned'], events_only=True, store=store)
+    single = Run_morquest(dict(input, slr=3.0, si=0.1), events=EVENTS, stop=['drowned'], events_only=True, store=store)
+    store.flush()
+    assert batch.series == {} and (batch.events['drowned'] >= 0).any() and (batch.events['drowned'] < 0).any()
+
+    table = ResultStore(str(tmp_path)).events()
+    assert sorted(table.columns) == ['drowned', 'half_Ai', 'stop']
+    for name in table.columns:
+        np.testing.assert_array_equal(table[name], np.append(batch.events[name], single.events[name]))
+
+
+def test_stopped_run_keeps_events(tmp_path):
+    input = morquest_set_input(**dict(ALSEA_BAY, slr=3.0, dur=100))
+    with ResultStore(str(tmp_path)) as store:
+        result = Run_morquest(input, events=EVENTS, stop=['drowned'], store=store)
+    stop = result.events['stop']
+    assert 0 <= stop < 99 and np.isnan(result['Ai'][stop + 2:]).all()
+    assert ResultStore(str(tmp_path)).events().loc[0, 'stop'] == stop
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Sea level forcing: built-in and registered curves and their cache
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import functools
+
+import numpy as np
+import pytest
+
+import Forcing
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, Run_morquest_batch, morquest_set_input
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Curves registered by a test stay in it
+    monkeypatch.setattr(Forcing, '_registry', dict(Forcing._registry))
+    monkeypatch.setattr(Forcing, '_cache', {})
+    monkeypatch.setattr(Forcing, '_stats', {'hits': 0, 'misses': 0})
+
+
+def test_builtin_curves():
+    slr, slrr, slrst = Forcing.slr_forcing('linear', 0.5, 50)
+    assert slrst == -1 and slr.shape == (50,) and slrr.shape == (50,)
+    np.testing.assert_allclose(slrr, 0.01)
+    assert slr[-1] == pytest.approx(0.5)
+    slr, slrr, slrst = Forcing.slr_forcing('accel', 0.5, 50)
+    assert slr.shape == (51,) and slr[0] == pytest.approx(0) and slr[-1] == pytest.approx(0.5)
+    assert (np.diff(slrr) > 0).all()                                        #accelerating
+    slr, slrr, slrst = Forcing.slr_forcing('timep', 0.5, 500)
+    assert slrst == 200 and (slr[:200] == 0).all() and slr[299] == pytest.approx(0.5)   #slr 100 yr after slrst
+    assert (slr[399:] == slr[399]).all() and slr[399] == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        Forcing.slr_forcing('timep', 0.5, 100)                             #starts after the run
+    with pytest.raises(ValueError):
+        Forcing.slr_forcing('unknown', 0.5, 100)
+
+
+def test_cache():
+    first, _ = Forcing.slr_curve('accel', 100)
+    again, _ = Forcing.slr_curve('accel', 100)
+    assert again is first and not first.flags.writeable
+    assert Forcing.cache_info() == {'hits': 1, 'misses': 1, 'size': 1}
+    Forcing.slr_curve('accel', 100, slrst=10)
+    assert Forcing.cache_info()['misses'] == 2
+    Forcing.clear_cache()
+    assert Forcing.cache_info() == {'hits': 0, 'misses': 0, 'size': 0}
+
+
+def test_absolute_curve():
+    Forcing.register_curve('pathway', [0.1, 0.3, 0.9], years=[2020, 2070, 2120])
+    slr, slrr, _ = Forcing.slr_forcing('pathway', np.array([1.0, 5.0]), 100)
+    assert slr.shape == (101, 2) and not slr.flags.writeable
+    np.testing.assert_allclose(slr[[0, 25, 50, 100], 0], [0, 0.1, 0.2, 0.8])
+    np.testing.assert_array_equal(slr[:, 0], slr[:, 1])                   #slr of the scenarios is ignored
+    assert np.shares_memory(slr, Forcing.slr_curve('pathway', 100)[0])     #broadcast, not copied
+    with pytest.raises(ValueError):
+        Forcing.slr_forcing('pathway', 1.0, 150)                           #beyond the pathway
+    with pytest.raises(ValueError):
+        Forcing.register_curve('linear', [0, 1])
+
+
+def test_scaled_curve_and_reregistration():
+    Forcing.register_curve('quadratic', functools.partial(Forcing.polynomial, coefficients=(0, 0, 1)), scaled=True)
+    slr, _, _ = Forcing.slr_forcing('quadratic', 2.0, 10)
+    np.testing.assert_allclose(slr, 2.0 * np.arange(11) ** 2 / 100)
+    digest = Forcing.fingerprint(['quadratic', None])
+    Forcing.register_curve('quadratic', functools.partial(Forcing.polynomial, coefficients=(0, 1)), scaled=True)
+    assert Forcing.fingerprint(['quadratic']) != digest
+    np.testing.assert_allclose(Forcing.slr_forcing('quadratic', 2.0, 10)[0], 0.2 * np.arange(11))
+
+
+def test_load_pathways_drive_the_model(tmp_path):
+    file = tmp_path / 'pathways.csv'
+    file.write_text('Year,low,high\n2000,0,0\n2100,0.3,1.0\n')
+    assert Forcing.load_pathways(str(file)) == ['low', 'high']
+    input = morquest_set_input(**dict(ALSEA_BAY, slrtype='high', dur=50))
+    result = Run_morquest(input)
+    np.testing.assert_allclose(result['slr'], np.linspace(0, 0.5, 51))
+    batch = Run_morquest_batch(dict(input, si=np.array([0.05, 0.1])))
+    np.testing.assert_allclose(batch.member(1)['Ai'], Run_morquest(dict(input, si=0.1))['Ai'], rtol=1e-12)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Lazy imports: the solver core loads numpy only
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from Benchmark import HEAVY
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _loaded(code):
+    # HEAVY modules loaded by running code in a new interpreter
+    script = f'import sys, json\n{code}\nprint(json.dumps([name for name in {HEAVY!r} if name in sys.modules]))'
+    out = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', ['morQuest', 'Kernel', 'Forcing', 'Store', 'Sweep', 'Equilibrium', 'Adaptive'])
+def test_core_imports_numpy_only(module):
+    assert _loaded(f'import {module}') == []
+
+
+def test_run_without_heavy_dependencies(tmp_path):
+    code = (f"import os\nfrom Benchmark import ALSEA_BAY\nfrom morQuest import Run_morquest, morquest_set_input\n"
+            f"os.chdir({str(tmp_path)!r})\nRun_morquest(morquest_set_input(**ALSEA_BAY), FileName='run.npz')")
+    assert _loaded(code) == []
+    assert _loaded(code.replace('run.npz', 'run.mat')) == ['scipy']        #only when saving a .mat file
+    assert (tmp_path / 'results' / 'run.npz').exists() and (tmp_path / 'results' / 'run.mat').exists()
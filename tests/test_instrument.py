@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Instrumentation: timers, counters, worker metrics and export
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import Instrument
+import Kernel
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, morquest_set_input
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setitem(Instrument._state, 'enabled', True)
+    Instrument.reset()
+    yield
+    Instrument.reset()
+
+
+def _work(n):
+    # Worker function of the pool test
+    with Instrument.timer('work'):
+        Instrument.add('items', n)
+    return n * 2
+
+
+def test_off_by_default(monkeypatch):
+    monkeypatch.setitem(Instrument._state, 'enabled', False)
+    Instrument.reset()
+    assert Instrument.timer('x') is Instrument.timer('y')                  #shared no-op
+    Instrument.add('count')
+    Run_morquest(morquest_set_input(**ALSEA_BAY))
+    assert Instrument.snapshot() == {'timers': {}, 'counters': {}}
+    assert Instrument.task(_work) is _work
+
+
+def test_timers_and_counters(metrics):
+    for pause in (0.01, 0.03):
+        with Instrument.timer('block'):
+            time.sleep(pause)
+
+    @Instrument.timed('decorated')
+    def function(x):
+        """Doc."""
+        return x + 1
+
+    assert function(1) == 2 and function.__name__ == 'function' and function.__doc__ == 'Doc.'
+    Instrument.add('count')
+    Instrument.add('count', 4)
+    snapshot = Instrument.snapshot()
+    block = snapshot['timers']['block']
+    assert block['calls'] == 2 and 0.04 <= block['total_s'] < 1 and 0.03 <= block['max_s'] < block['total_s']
+    assert snapshot['timers']['decorated']['calls'] == 1 and snapshot['counters'] == {'count': 5}
+
+
+def test_run_stages_and_clamps(metrics, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Run_morquest(morquest_set_input(**dict(ALSEA_BAY, slr=5.0)), FileName='run.npz')
+    snapshot = Instrument.snapshot()
+    for stage in ['run.forcing', 'run.loop', 'run.output', 'save']:
+        assert snapshot['timers'][stage]['calls'] == 1, stage
+    assert set(snapshot['counters']) >= {f'clamp.{name}' for name in Kernel.CLAMPS}
+    assert sum(snapshot['counters'][f'clamp.{name}'] for name in Kernel.CLAMPS) > 0   #drowning clamps
+    assert snapshot['counters']['bytes_written.result'] == os.path.getsize(tmp_path / 'results' / 'run.npz')
+
+
+def test_worker_metrics(metrics):
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        results = list(map(Instrument.gather, pool.map(Instrument.task(_work), [1, 2, 3])))
+    assert results == [2, 4, 6]
+    snapshot = Instrument.snapshot()
+    assert snapshot['timers']['work']['calls'] == 3 and snapshot['counters'] == {'items': 6}
+
+
+def test_export(metrics, tmp_path):
+    with Instrument.timer('run.loop'):
+        Instrument.add('clamp.dVc', 3)
+        Instrument.add('total', 2)
+    text = Instrument.to_json(str(tmp_path / 'metrics.json'))
+    assert json.loads((tmp_path / 'metrics.json').read_text()) == json.loads(text) == Instrument.snapshot()
+    lines = Instrument.to_prometheus().splitlines()
+    assert '# TYPE morquest_seconds_total counter' in lines and 'morquest_calls_total{name="run.loop"} 1' in lines
+    assert 'morquest_clamp_total{name="dVc"} 3' in lines and 'morquest_total_total 2' in lines
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Parity of the numba and pure-Python kernels
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+import Kernel
+from Benchmark import ALSEA_BAY
+from morQuest import OUTPUT_KEYS, Run_morquest, morquest_set_input
+
+#Alsea Bay, a drowning estuary, a channel exchange (tr > 0) with low supply, and an eroding one with growth rates
+CASES = {'alsea': {},
+         'drowned': dict(slr=80, si=0.02),
+         'exchange': dict(tr=5.0, ssc=0.0001, Qr=0.1),
+         'growth': dict(slr=3.2, fQr=0.03, fssc=-0.015, incAi=-0.01, tr=0.1, si=1.4, fs=0.2, fis=0.8, faw=0.3, dH=3.5)}
+
+
+def _input(case, slrtype):
+    return morquest_set_input(**dict(ALSEA_BAY, **CASES[case], slrtype=slrtype, dur=302 if slrtype == 'timep' else 100))
+
+
+def _assert_identical(result, reference):
+    for key in OUTPUT_KEYS:
+        assert np.array_equal(result[key], reference[key], equal_nan=True), key
+
+
+@pytest.mark.parametrize('slrtype', ['linear', 'accel', 'timep'])
+@pytest.mark.parametrize('case', list(CASES))
+def test_numba_matches_python(case, slrtype):
+    pytest.importorskip('numba')
+    input = _input(case, slrtype)
+    events = list(Kernel.EVENTS)
+    reference = Run_morquest(input, backend='python', events=events)
+    result = Run_morquest(input, backend='numba', events=events)
+    _assert_identical(result, reference)
+    assert result.events == reference.events
+
+
+def test_numba_missing_falls_back(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'numba', None)                     #import numba raises ImportError
+    assert not Kernel.numba_available()
+    with pytest.warns(UserWarning, match='numba is not installed'):
+        assert Kernel.get_kernel('numba') is Kernel.run_python
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert Kernel.get_kernel('auto') is Kernel.run_python
+    input = _input('alsea', 'accel')
+    with pytest.warns(UserWarning):
+        result = Run_morquest(input, backend='numba')
+    _assert_identical(result, Run_morquest(input, backend='python'))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Shapefile loader: attribute tables and their cache
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Loader
+
+FIELDS = [('Est', 'C', 12, 0), ('Year', 'N', 4, 0), ('area', 'F', 10, 3), ('depth', 'N', 6, 2), ('wet', 'L', 1, 0)]
+
+
+def _write_dbf(path, records, deleted=()):
+    # dBase III table with the fields of FIELDS; records are tuples of already formatted field texts
+    header_length = 32 + 32 * len(FIELDS) + 1
+    record_length = 1 + sum(size for _, _, size, _ in FIELDS)
+    data = struct.pack('<B3BIHH20x', 3, 126, 10, 18, len(records), header_length, record_length)
+    for name, kind, size, decimals in FIELDS:
+        data += struct.pack('<11sc4xBB14x', name.encode(), kind.encode(), size, decimals)
+    data += b'\r'
+    for i, record in enumerate(records):
+        data += b'*' if i in deleted else b' '
+        data += b''.join(text.encode().rjust(size) for text, (_, _, size, _) in zip(record, FIELDS))
+    with open(path, 'wb') as f:
+        f.write(data + b'\x1a')
+
+
+def test_read_dbf(tmp_path):
+    path = str(tmp_path / 'table.dbf')
+    _write_dbf(path, [('Alsea_bay', '1985', '1.500', '2.25', 'T'), ('Gone', '1990', '9.000', '1.00', 'T'),
+                      ('Umpqua', '1988', '', '****', 'F')], deleted=[1])
+    table = Loader.read_dbf(path)
+    assert list(table.columns) == ['Est', 'Year', 'area', 'depth', 'wet']
+    assert table['Est'].tolist() == ['Alsea_bay', 'Umpqua']
+    assert table['Year'].dtype == np.int64 and table['Year'].tolist() == [1985, 1988]
+    assert table['area'][0] == 1.5 and np.isnan(table['area'][1])
+    assert table['depth'][0] == 2.25 and np.isnan(table['depth'][1])      #overflow marker
+    assert table['wet'].tolist() == [True, False]
+    assert list(Loader.read_dbf(path, columns=['area', 'Est']).columns) == ['Est', 'area']
+
+
+def test_intertidal_areas_match_the_analysis(tmp_path):
+    table = Loader.intertidal_areas(cache_dir=str(tmp_path))
+    expected = pd.read_csv('results/00_Input_Intertidal_Area_Umpqua_river.csv')
+    umpqua = table[table['Est'] == 'Umpqua_river'].reset_index(drop=True)
+    assert umpqua['Year'].tolist() == expected['Year'].tolist()
+    np.testing.assert_allclose(umpqua['area'], expected['area'], rtol=1e-12)
+    assert sorted(Loader.channel_areas(cache_dir=str(tmp_path))['name2']) == sorted(table['Est'].unique())
+
+
+def test_cached_table(tmp_path, monkeypatch):
+    source = tmp_path / 'source.dbf'
+    _write_dbf(str(source), [('Alsea_bay', '1985', '1.500', '2.25', 'T')])
+    cache = str(tmp_path / 'cache')
+    builds = []
+
+    def build(path):
+        builds.append(path)
+        return Loader.read_dbf(path)
+
+    def load():
+        monkeypatch.setattr(Loader, '_memory', {})                          #as a new process
+        return Loader.cached_table('table', str(source), build, cache)
+
+    first = load()
+    assert len(builds) == 1 and os.path.exists(os.path.join(cache, 'table.json'))
+    pd.testing.assert_frame_equal(load(), first)
+    os.utime(source, ns=(0, 0))                                             #touched, same content
+    pd.testing.assert_frame_equal(load(), first)
+    assert len(builds) == 1
+    _write_dbf(str(source), [('Alsea_bay', '1986', '1.500', '2.25', 'T')])          #same size, new mtime
+    assert load()['Year'].tolist() == [1986] and len(builds) == 2
+    first.loc[0, 'Est'] = 'changed'                                         #callers get copies
+    assert Loader.cached_table('table', str(source), build, cache)['Est'][0] == 'Alsea_bay'
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Pipeline cache: a stage reruns when its sources, code, params or upstream outputs change
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import os
+import shutil
+
+import Pipeline
+
+ALL = ['intertidal', 'hydrology', 'tidal', 'channel', 'nearshore', 'inputs', 'simulation', 'summary']
+
+
+def _run(tmp_path, **options):
+    return Pipeline.run_estuary('Alsea_bay', cache_dir=str(tmp_path / 'cache'), **options)['computed']
+
+
+def test_params_rerun_simulation_only(tmp_path):
+    assert _run(tmp_path) == ALL
+    assert _run(tmp_path) == []
+    assert _run(tmp_path, params={'slr': 1.0}) == ['simulation', 'summary']
+    assert _run(tmp_path, params={'slr': 1.0}) == []
+
+
+def test_edited_source_reruns_downstream(tmp_path):
+    hydrology = tmp_path / 'Hydrology'
+    shutil.copytree(Pipeline.PATHS['hydrology'], hydrology)
+    paths = {'hydrology': str(hydrology)}
+    assert _run(tmp_path, paths=paths) == ALL
+    file = hydrology / 'Alsea_bay.txt'
+
+    #An earlier year: the hydrology table changes, the model inputs (last year) do not
+    file.write_text(file.read_text().replace('2011\t1626', '2011\t1700'))
+    assert _run(tmp_path, paths=paths) == ['hydrology', 'inputs']
+    #The last year sets Qr
+    file.write_text(file.read_text().replace('2015\t1219', '2015\t1300'))
+    assert _run(tmp_path, paths=paths) == ['hydrology', 'inputs', 'simulation', 'summary']
+
+
+def test_edited_code_reruns_stage(tmp_path, monkeypatch):
+    #Stages read a copy of Pipeline.py, and inputs also an extra file standing for its own code
+    code, extra = tmp_path / 'Pipeline.py', tmp_path / 'extra.py'
+    shutil.copy(Pipeline.__file__, code)
+    extra.write_text('#inputs\n')
+    for name, stage in Pipeline.STAGES.items():
+        assert 'Pipeline.py' in stage['code'], name
+        files = [str(code) if file == 'Pipeline.py' else file for file in stage['code']]
+        monkeypatch.setitem(Pipeline.STAGES, name, dict(stage, code=files + [str(extra)] * (name == 'inputs')))
+    assert _run(tmp_path) == ALL
+
+    #Same inputs from the edited code: the stages after it are reused
+    extra.write_text('#inputs, edited\n')
+    assert _run(tmp_path) == ['inputs']
+    #Pipeline.py holds the functions of every stage
+    code.write_text(code.read_text() + '\n#edited\n')
+    assert _run(tmp_path) == ALL
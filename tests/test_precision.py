@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Float32 storage: downcast deviation of results and stores
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pytest
+
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest_batch, downcast, merge_deviation, morquest_set_input
+from Store import ResultStore
+
+EPS32 = 2.0 ** -24                                                          #float32 rounding, relative
+BATCH = dict(morquest_set_input(**ALSEA_BAY), si=np.array([0.02, 0.05, 0.1, 0.2]), slr=np.array([0.5, 3, 1, 20]))
+
+
+def _relative(low, value):
+    exact = np.isfinite(value) & (value != 0)
+    return np.abs(low[exact].astype(float) - value[exact]) / np.abs(value[exact])
+
+
+def test_downcast_round_trip():
+    rng = np.random.default_rng(0)
+    series = {'wide': rng.standard_normal(1000) * 10.0 ** rng.uniform(-30, 30, 1000),
+              'mixed': np.array([0.0, np.nan, np.inf, 1e-50, 1.0, 3.0]),
+              'huge': np.array([1.0, 1e300])}
+    low, deviation = downcast(series)
+    assert all(value.dtype == np.float32 for value in low.values())
+    assert 0 < deviation['wide'] <= EPS32
+    assert deviation['wide'] == np.max(_relative(low['wide'], series['wide']))
+    assert deviation['mixed'] == 1.0                                        #1e-50 flushes to zero
+    assert deviation['huge'] == np.inf
+    np.testing.assert_array_equal(low['mixed'][:3], [0, np.nan, np.inf])
+    assert downcast(series, 'float64')[1] == {'wide': 0.0, 'mixed': 0.0, 'huge': 0.0}
+    assert merge_deviation({'a': 1e-8, 'b': 0.5}, {'a': 2e-8}) == {'a': 2e-8, 'b': 0.5}
+    with pytest.raises(ValueError):
+        downcast(series, 'float16')
+
+
+def test_float32_batch():
+    exact = Run_morquest_batch(BATCH)
+    low = Run_morquest_batch(BATCH, precision='float32')
+    assert set(low.deviation) == set(low.series)
+    for key, value in low.series.items():
+        assert value.dtype == np.float32
+        deviation = _relative(value, exact[key])
+        assert np.max(deviation, initial=0) <= low.deviation[key] <= EPS32, key
+    assert low.deviation['sedVout'] <= EPS32                                #formed in float64 before the cast
+    assert low.member(2).deviation == low.deviation
+
+
+def test_float32_store(tmp_path):
+    exact = Run_morquest_batch(BATCH)
+    with ResultStore(str(tmp_path), variables=['Ai', 'Vc', 'sedVd'], precision='float32') as store:
+        store.append(exact)
+        store.append(Run_morquest_batch(dict(BATCH, si=BATCH['si'] * 1.5)))
+    store = ResultStore(str(tmp_path))
+    assert store.precision == 'float32' and len(store) == 8
+    for key in ['Ai', 'Vc', 'sedVd']:
+        stored = store.read(key)[:4]
+        assert stored.dtype == np.float32
+        assert np.max(_relative(stored, exact[key]), initial=0) <= store.deviation[key] <= EPS32, key
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  In-memory results: optional persistence and output selection
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pytest
+
+from Benchmark import ALSEA_BAY
+from morQuest import MorquestResult, Run_morquest, Run_morquest_batch, morquest_set_input, output_spec
+
+INPUT = morquest_set_input(**ALSEA_BAY)
+EVENTS = {'drowned': None, 'half_Ai': ('Ai', '<=', 4e6)}
+
+
+class ListStore:
+    def __init__(self):
+        self.results = []
+
+    def append(self, result):
+        self.results.append(result)
+
+
+def _assert_same(loaded, result):
+    assert set(loaded.series) == set(result.series) and loaded.events == result.events
+    for key in result.series:
+        np.testing.assert_array_equal(loaded[key], result[key], err_msg=key)
+    for key in result.meta:
+        assert loaded[key] == result[key], key
+
+
+def test_no_file_unless_asked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = Run_morquest(INPUT)
+    assert isinstance(result, MorquestResult) and list(tmp_path.iterdir()) == []
+    assert result['Ai'].flags['C_CONTIGUOUS'] and result['Ai'].shape == (INPUT['dur'] + 1,)
+    assert result['dur'] == INPUT['dur'] and result['slrtype'] == 'linear'
+
+
+@pytest.mark.parametrize('name', ['output.npz', 'output.mat'])
+def test_file_round_trip(tmp_path, monkeypatch, name):
+    monkeypatch.chdir(tmp_path)
+    store = ListStore()
+    result = Run_morquest(INPUT, FileName=name, store=store, events=EVENTS)
+    assert store.results == [result]
+    _assert_same(MorquestResult.load(str(tmp_path / 'results' / name)), result)
+
+
+def test_batch_members_equal_single_runs():
+    batch = Run_morquest_batch(dict(INPUT, si=np.array([0.05, 0.1, 0.3])))
+    for i, si in enumerate([0.05, 0.1, 0.3]):
+        single = Run_morquest(dict(INPUT, si=si))
+        for key in single.series:
+            np.testing.assert_allclose(batch.member(i)[key], single[key], rtol=1e-12, atol=1e-6, err_msg=key)
+
+
+def test_output_selection():
+    full = Run_morquest(INPUT)
+    result = Run_morquest(INPUT, output={'variables': ['Ai', 'Vc'], 'stride': 7})
+    years = np.append(np.arange(0, INPUT['dur'] + 1, 7), INPUT['dur'])
+    assert list(result.series) == ['yr', 'Ai', 'Vc']
+    for key in result.series:
+        np.testing.assert_array_equal(result[key], full[key][years], err_msg=key)
+    picked = Run_morquest(INPUT, output={'years': [INPUT['dur'], 3, 3]})
+    np.testing.assert_array_equal(picked['yr'], [3, INPUT['dur']])
+    np.testing.assert_array_equal(picked['slrr'], full['slrr'][[3]])        #one rate per year up to dur - 1
+    assert output_spec(['Ai', 'yr', 'Ai'])['variables'] == ['Ai']
+
+
+@pytest.mark.parametrize('output', [['Xx'], {'stride': 0}, {'years': [-1]}, {'stride': 2, 'years': [1]},
+                                    {'every': 2}])
+def test_output_spec_errors(output):
+    with pytest.raises(ValueError):
+        output_spec(output, 50)
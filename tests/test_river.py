@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  River forcing: discharge and sediment series
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Forcing
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, Run_morquest_batch, morquest_set_input
+
+INPUT = morquest_set_input(**dict(ALSEA_BAY, dur=40))
+TT = np.arange(0, 41, 1.0)
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Series registered by a test stay in it
+    monkeypatch.setattr(Forcing, '_series', {})
+    monkeypatch.setattr(Forcing, '_cache', {})
+
+
+def test_linear_growth():
+    np.testing.assert_allclose(Forcing.river_forcing(None, 40.0, 0.01, TT), 40.0 * (1 + 0.01 * TT))
+    both = Forcing.river_forcing(None, np.array([40.0, 20.0]), np.array([0.01, -0.02]), TT)
+    assert both.shape == (41, 2)
+    np.testing.assert_allclose(both[:, 1], 20.0 * (1 - 0.02 * TT))
+
+
+def test_series_forms_agree():
+    values = 30 + 10 * np.sin(np.arange(41) / 5)
+    Forcing.register_series('discharge', values)
+    by_year = pd.Series(values, index=np.arange(1980, 2021))
+    iterator = iter(values)
+    forms = ['discharge', values, list(values), by_year, lambda t: 30 + 10 * np.sin(t / 5), iterator]
+    for form in forms:
+        np.testing.assert_allclose(Forcing.river_forcing(form, 0.0, 0.0, TT), values, rtol=1e-12)
+    half = pd.Series(values[::2], index=np.arange(1980, 2021, 2))           #every other year, interpolated
+    expected = np.interp(TT, TT[::2], values[::2])
+    np.testing.assert_allclose(Forcing.river_forcing(half, 0.0, 0.0, TT), expected)
+    np.testing.assert_allclose(Forcing.river_forcing(half, 0.0, 0.0, TT[:-4], start=1984), expected[4:])
+    with pytest.raises(ValueError):
+        Forcing.river_forcing(values[:20], 0.0, 0.0, TT)                    #too short
+    with pytest.raises(ValueError):
+        Forcing.river_forcing('unknown', 0.0, 0.0, TT)
+
+
+def test_constant_series_equals_constant_forcing():
+    reference = Run_morquest(INPUT)
+    result = Run_morquest(dict(INPUT, Qr_series=np.full(41, INPUT['Qr']), ssc_series=np.full(41, INPUT['ssc'])))
+    for key in reference.series:
+        np.testing.assert_array_equal(result[key], reference[key], err_msg=key)
+
+
+def test_series_drive_the_model():
+    Qr = INPUT['Qr'] * (1 + 0.5 * np.sin(np.arange(41) / 3))
+    result = Run_morquest(dict(INPUT, Qr_series=Qr))
+    np.testing.assert_allclose(result['Qssec'], Qr * INPUT['ssc'])
+    assert not np.allclose(result['Vd'], Run_morquest(INPUT)['Vd'])
+    # One series per batch member, and a named one shared by the batch
+    members = np.stack([Qr, 2 * Qr])
+    batch = Run_morquest_batch(dict(INPUT, si=np.array([0.05, 0.1]), Qr_series=members))
+    for i, si in enumerate([0.05, 0.1]):
+        single = Run_morquest(dict(INPUT, si=si, Qr_series=members[i]))
+        np.testing.assert_allclose(batch.member(i)['Vd'], single['Vd'], rtol=1e-12)
+    Forcing.register_series('wet', Qr)
+    shared = Run_morquest_batch(dict(INPUT, si=np.array([0.05, 0.1]), Qr_series='wet'))
+    np.testing.assert_allclose(shared.member(0)['Vd'], batch.member(0)['Vd'], rtol=1e-12)
+
+
+def test_named_and_shared_series(tmp_path):
+    values = np.linspace(10, 50, 41)
+    name = Forcing.name_series(values, TT)
+    assert name == Forcing.name_series(values.copy(), TT) != Forcing.name_series(values + 1, TT)
+    np.testing.assert_array_equal(Forcing.river_forcing(name, 0.0, 0.0, TT), values)
+    shared = Forcing.share_series([name, None, values], str(tmp_path))
+    assert list(shared) == [name] and (tmp_path / f'{name}.npy').exists()
+    assert isinstance(Forcing._series[name]['values'], np.memmap)
+    Forcing._series.clear()
+    Forcing._cache.clear()
+    Forcing.register_shared(shared)
+    np.testing.assert_array_equal(Forcing.river_forcing(name, 0.0, 0.0, TT), values)
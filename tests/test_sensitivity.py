@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Sensitivity analysis: Sobol and Morris indices against known values
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pytest
+
+import Sensitivity
+from Benchmark import ALSEA_BAY
+
+#Ishigami function (a = 7, b = 0.1) on [-pi, pi]^3 and its exact indices
+ISHIGAMI = {'si': (-np.pi, np.pi), 'fs': (-np.pi, np.pi), 'fis': (-np.pi, np.pi)}
+S1 = [0.3139, 0.4424, 0.0]
+ST = [0.5576, 0.4424, 0.2437]
+
+
+def _ishigami(input, names, X, variables, years):
+    return (np.sin(X[:, 0]) + 7 * np.sin(X[:, 1]) ** 2 + 0.1 * X[:, 2] ** 4 * np.sin(X[:, 0]))[:, None]
+
+
+def test_sobol_ishigami(monkeypatch):
+    monkeypatch.setattr(Sensitivity, '_evaluate', _ishigami)
+    result = Sensitivity.sobol_indices(ALSEA_BAY, ISHIGAMI, variables=['Ai'], chunk_size=1024, max_samples=2 ** 14,
+                                       tol=0.02)
+    assert result['converged'] and result['chunks'] < 16
+    np.testing.assert_allclose(result['S1'].to_numpy()[0], S1, atol=0.03)
+    np.testing.assert_allclose(result['ST'].to_numpy()[0], ST, atol=0.03)
+    assert (result['S1_conf'].to_numpy() < 0.02).all()
+
+
+def test_sobol_drops_failed_runs(monkeypatch):
+    def failing(input, names, X, variables, years):
+        return np.where(X[:, :1] > 3, np.nan, _ishigami(input, names, X, variables, years))
+    monkeypatch.setattr(Sensitivity, '_evaluate', failing)
+    result = list(Sensitivity.iter_sobol(ALSEA_BAY, ISHIGAMI, variables=['Ai'], chunk_size=256, max_samples=512))
+    assert [step['chunks'] for step in result] == [1, 2]
+    assert 0 < result[0]['n'].item() < result[1]['n'].item() < 512
+    assert np.isfinite(result[-1]['ST'].to_numpy()).all()
+
+
+def test_morris_linear(monkeypatch):
+    monkeypatch.setattr(Sensitivity, '_evaluate', lambda input, names, X, variables, years:
+                        (X @ np.array([1.0, -5.0, 0.0]))[:, None])
+    bounds = {'si': (0, 1), 'fs': (0, 2), 'fis': (0, 1)}
+    result = Sensitivity.morris_indices(ALSEA_BAY, bounds, variables=['Ai'], chunk_size=8, max_trajectories=64)
+    np.testing.assert_allclose(result['mu'].to_numpy()[0], [1, -10, 0], atol=1e-9)
+    np.testing.assert_allclose(result['mu_star'].to_numpy()[0], [1, 10, 0], atol=1e-9)
+    np.testing.assert_allclose(result['sigma'].to_numpy()[0], 0, atol=1e-6)            #sqrt of a rounding difference
+    assert result['converged'] and result['chunks'] == 4
+
+
+def test_model_inert_parameter():
+    # Vout only sets the offshore volume, lsys does not change Ai: their indices vanish
+    bounds = {'si': (0.05, 0.3), 'lsys': (3000, 8000), 'Vout': (0, 1e6)}
+    sobol = Sensitivity.sobol_indices(ALSEA_BAY, bounds, variables=['Ai', 'Vd'], years=20, chunk_size=128,
+                                      max_samples=256, tol=None)
+    assert sobol['n'].tolist() == [256, 256]
+    assert sobol['ST'].loc[('Ai', 20), 'si'] == pytest.approx(1, abs=0.05)
+    assert sobol['ST'].loc[('Ai', 20), 'lsys'] == 0 and (sobol['ST']['Vout'] == 0).all()
+    morris = Sensitivity.morris_indices(ALSEA_BAY, bounds, variables=['Ai', 'Vd'], years=20, chunk_size=16,
+                                        max_trajectories=32, tol=None)
+    assert (morris['mu_star']['Vout'] == 0).all() and morris['mu_star'].loc[('Ai', 20), 'lsys'] == 0
+    assert (morris['mu_star']['si'] > 0).all()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Result store: appended series, parameters and events read back
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import numpy as np
+
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, Run_morquest_batch, morquest_set_input
+from Store import ResultStore
+
+
+def _batch(**options):
+    return morquest_set_input(**dict(ALSEA_BAY, slr=np.array([0.5, 2.0, 80.0]), si=np.array([0.1, 0.1, 0.02]), dur=60),
+                              **options)
+
+
+def test_batch_round_trip(tmp_path):
+    result = Run_morquest_batch(_batch())
+    with ResultStore(str(tmp_path), chunk_size=2) as store:
+        store.append(result, ids=[7, 8, 9])
+        store.append(result.member(1))
+    store = ResultStore(str(tmp_path))
+    assert len(store) == 4 and len(store.manifest['chunks']) == 2
+    np.testing.assert_array_equal(store.read('Ai')[:3], result['Ai'])
+    np.testing.assert_array_equal(store.read('Vc', year=30), np.append(result['Vc'][:, 30], result['Vc'][1, 30]))
+    params = store.params()
+    assert list(params.index) == [7, 8, 9, 3]
+    np.testing.assert_array_equal(params['slr'], [0.5, 2.0, 80.0, 2.0])
+
+
+def test_result_without_series(tmp_path):
+    events = ['drowned', 'channel_empty']
+    batch = Run_morquest_batch(_batch(), events=events, events_only=True)
+    single = Run_morquest(morquest_set_input(**dict(ALSEA_BAY, slr=80, si=0.02, dur=60)), events=events,
+                          events_only=True)
+    with ResultStore(str(tmp_path)) as store:
+        store.append(batch)
+        store.append(single)
+    store = ResultStore(str(tmp_path))
+    assert store.variables == [] and len(store) == 4
+    table = store.events()
+    np.testing.assert_array_equal(table['drowned'], np.append(batch.events['drowned'], single.events['drowned']))
+    np.testing.assert_array_equal(store.params()['slr'], [0.5, 2.0, 80.0, 80.0])
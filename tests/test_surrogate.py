@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Emulator: accuracy on held-out runs, fallback to the model and persistence
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pytest
+
+from Benchmark import ALSEA_BAY
+from morQuest import Run_morquest, morquest_set_input
+from Surrogate import load_emulator, train_emulator
+
+BASE = dict(ALSEA_BAY, dur=30, slr=0.05)                                    #no drowning: smooth outputs
+BOUNDS = {'si': (0.05, 0.15), 'fis': (0, 1)}
+VARIABLES = ['Ai', 'Vc', 'sedVd']
+
+
+@pytest.fixture(scope='module')
+def emulator():
+    return train_emulator(BASE, BOUNDS, variables=VARIABLES, n_train=64, n_test=32, method='gp')
+
+
+def _model(**params):
+    return Run_morquest(morquest_set_input(**dict(BASE, **params)))
+
+
+def test_gp_accuracy(emulator):
+    assert (emulator.validation['rmse'] < 1e-3).all() and (emulator.validation['max'] < 1e-2).all()
+    mean, std = emulator.predict(si=0.08, fis=0.3, return_std=True)
+    exact = _model(si=0.08, fis=0.3)
+    for variable in VARIABLES:
+        assert mean[variable].shape == (31,) and (std[variable] >= 0).all()
+        scale = np.abs(exact[variable]).max()
+        np.testing.assert_allclose(mean[variable], exact[variable], rtol=1e-3, atol=1e-9 * scale)
+    assert emulator.fallbacks == 0
+
+
+def test_poly_accuracy():
+    emulator = train_emulator(BASE, BOUNDS, variables=VARIABLES, n_train=64, n_test=32, method='poly', degree=3)
+    assert (emulator.validation['rmse'] < 2e-2).all()
+    with pytest.raises(ValueError):
+        train_emulator(BASE, BOUNDS, variables=VARIABLES, n_train=8, n_test=0, method='poly', degree=3)
+
+
+def test_fallback_outside_bounds(emulator):
+    queries = {'si': np.array([0.1, 0.3]), 'fis': 0.5}
+    before = emulator.fallbacks
+    mean, std = emulator.predict(queries, return_std=True)
+    assert emulator.fallbacks == before + 1 and mean['Vc'].shape == (2, 31)
+    np.testing.assert_allclose(mean['Vc'][1], _model(si=0.3, fis=0.5)['Vc'], rtol=1e-12)
+    assert (std['Vc'][1] == 0).all() and (std['Vc'][0] > 0).any()
+    extrapolated = emulator.predict(queries, fallback=False)
+    assert not np.allclose(extrapolated['Vc'][1], mean['Vc'][1], rtol=1e-3)
+    with pytest.raises(ValueError):
+        emulator.predict(lsys=5000)                                         #not a parameter of the emulator
+
+
+def test_save_and_load(emulator, tmp_path):
+    emulator.save(str(tmp_path / 'emulator.npz'))
+    loaded = load_emulator(str(tmp_path / 'emulator.npz'))
+    assert loaded.names == emulator.names and loaded.method == 'gp'
+    queries = {'si': np.linspace(0.06, 0.14, 5), 'fis': np.linspace(0.9, 0.1, 5)}
+    expected, loaded_mean = emulator.predict(queries), loaded.predict(queries)
+    for variable in VARIABLES:
+        np.testing.assert_array_equal(loaded_mean[variable], expected[variable])
+    np.testing.assert_allclose(loaded.validation.to_numpy(), emulator.validation.to_numpy())
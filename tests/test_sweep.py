@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Sweep resume after a failed shard and after a merge killed halfway
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+import os
+
+import numpy as np
+import pytest
+
+import Store
+import Sweep
+from Benchmark import ALSEA_BAY
+
+SCENARIOS = {'slr': [0.5, 1.0, 2.0], 'ssc': [0.1, 1.0]}
+BASE = dict(ALSEA_BAY, dur=20)
+
+
+def _failing_shard(path, name, *args):
+    if name == 'shard-000001':
+        raise RuntimeError('worker killed')
+    return _run_shard(path, name, *args)
+
+
+_run_shard = Sweep._run_shard
+
+
+def _same(store, reference):
+    np.testing.assert_array_equal(store.read('Ai'), reference.read('Ai'))
+    assert store.params().equals(reference.params())
+
+
+@pytest.fixture(scope='module')
+def reference(tmp_path_factory):
+    return Sweep.run_sweep(str(tmp_path_factory.mktemp('reference')), SCENARIOS, base=BASE, shard_size=2,
+                           max_workers=2)
+
+
+def test_resume_after_failed_shard(tmp_path, reference, monkeypatch):
+    path = str(tmp_path)
+    monkeypatch.setattr(Sweep, '_run_shard', _failing_shard)
+    with pytest.raises(RuntimeError):
+        Sweep.run_sweep(path, SCENARIOS, base=BASE, shard_size=2, max_workers=2)
+    assert sorted(os.listdir(os.path.join(path, 'done'))) == ['shard-000000', 'shard-000002']
+
+    monkeypatch.setattr(Sweep, '_run_shard', _run_shard)
+    _same(Sweep.run_sweep(path, SCENARIOS, base=BASE, shard_size=2, max_workers=2), reference)
+
+
+def test_resume_after_killed_merge(tmp_path, reference, monkeypatch):
+    path = str(tmp_path)
+    replace, moves = os.replace, []
+
+    def killed(source, target):
+        #the merge dies after moving the first chunk of the second shard
+        if os.path.basename(str(target)).startswith('main-'):
+            moves.append(target)
+            if len(moves) == 2:
+                raise KeyboardInterrupt
+        replace(source, target)
+
+    monkeypatch.setattr(Store.os, 'replace', killed)
+    with pytest.raises(KeyboardInterrupt):
+        Sweep.run_sweep(path, SCENARIOS, base=BASE, shard_size=2, max_workers=2)
+    monkeypatch.setattr(Store.os, 'replace', replace)
+    assert 'pending' in Store.ResultStore(path).manifest
+
+    store = Sweep.run_sweep(path, SCENARIOS, base=BASE, shard_size=2, max_workers=2)
+    _same(store, reference)
+    assert len(store) == 6 and os.listdir(os.path.join(path, 'shards')) == []
+    with pytest.raises(ValueError):
+        Sweep.run_sweep(path, dict(SCENARIOS, ssc=[0.2]), base=BASE, shard_size=2, max_workers=2)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Tide gauge records: missing values, monthly statistics and tidal range
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Tidal
+
+
+@pytest.fixture
+def gauge(tmp_path, monkeypatch):
+    # Daily levels of 1980-1990 with missing days; the cache goes to tmp_path/results/cache
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('1980-01-01', '1990-12-31', freq='D')
+    data = np.array(2400 + 10 * (dates.year - 1980) + rng.integers(-600, 600, len(dates)))
+    data[rng.random(len(dates)) < 0.1] = Tidal.SENTINEL
+    data[dates.year == 1983] = Tidal.SENTINEL                              #a year without data
+    table = pd.DataFrame({'Year': dates.year, 'month': dates.month, 'day': dates.day, 'data': data})
+    table.to_csv(tmp_path / 'gauge.csv', header=False, index=False)
+    return str(tmp_path / 'gauge.csv'), table
+
+
+def test_read_station_drops_missing_days(gauge):
+    path, table = gauge
+    levels = Tidal.read_station(path)
+    valid = table[table['data'] != Tidal.SENTINEL]
+    assert len(levels) == len(valid) and (levels['data'] != Tidal.SENTINEL).all()
+    np.testing.assert_array_equal(levels['data'], valid['data'])
+    dates = pd.to_datetime(dict(year=valid['Year'], month=valid['month'], day=valid['day']))
+    np.testing.assert_array_equal(levels['date'].to_numpy(), dates.to_numpy())
+    chunks = list(Tidal.read_station(path, chunksize=1000))
+    assert len(chunks) == 5
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), levels)
+
+
+@pytest.mark.parametrize('chunksize', [100, 100000])
+def test_monthly_range(gauge, chunksize):
+    path, table = gauge
+    monthly = Tidal.monthly_range(path, chunksize=chunksize, cache_dir=None)
+    valid = table[table['data'] != Tidal.SENTINEL]
+    expected = valid.groupby(['Year', 'month'])['data'].agg(['min', 'max', 'count']).reset_index()
+    assert 1983 not in monthly['Year'].values and len(monthly) == len(expected) == 120
+    np.testing.assert_array_equal(monthly['min'], expected['min'])
+    np.testing.assert_array_equal(monthly['max'], expected['max'])
+    np.testing.assert_array_equal(monthly['n'], expected['count'])
+    np.testing.assert_allclose(monthly['mean'], (expected['min'] + expected['max']) / 2)
+
+
+def test_tidal_range_and_estuary_station(gauge, monkeypatch):
+    path, table = gauge
+    monkeypatch.setitem(Tidal.ESTUARY_STATIONS, 'Test_bay', path)
+    yearly = Tidal.yearly_range(Tidal.monthly_range(path))
+    tidal = Tidal.tidal_range('Test_bay', years=[1981, 1985, 1990])
+    assert tidal.columns.tolist() == ['Year', 'Tidal Range (mm)'] and tidal['Year'].tolist() == [1981, 1985, 1990]
+    assert tidal['Tidal Range (mm)'][0] == pytest.approx(yearly['mean'][:3].mean())   #centered 3-year mean
+    assert np.isnan(tidal['Tidal Range (mm)'][2])                         #no year after the last
+    pd.testing.assert_frame_equal(Tidal.analyze_tidal_data(selection='Test_bay', plot=False),
+                                  Tidal.tidal_range('Test_bay'))
+    summary = Tidal.station_summary([path])
+    assert summary.loc[path, 'first'] == 1980 and summary.loc[path, 'last'] == 1990
+    assert summary.loc[path, 'days'] == (table['data'] != Tidal.SENTINEL).sum()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+# Project:  MorQuestCode
+# Purpose:  Uncertainty propagation: streaming quantiles and statistics
+# Author:   Mishel Reyes, # mreyec@uni.pe
+###############################################################################
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+###############################################################################
+
+
+
+import numpy as np
+import pytest
+
+from Benchmark import ALSEA_BAY
+from Uncertainty import P2Quantiles, StreamingStats, propagate
+
+PROBS = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def _stream(n=20000, seed=1):
+    # Normal, uniform, exponential and lognormal cells, with some missing values in the last one
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.normal(3, 2, n), rng.uniform(-1, 1, n), rng.exponential(5, n), rng.lognormal(0, 1, n)])
+    X[rng.random(n) < 0.1, 3] = np.nan
+    return X
+
+
+def test_p2_matches_exact_quantiles():
+    X = _stream()
+    p2 = P2Quantiles(PROBS, X.shape[1], backend='python')
+    p2.update_many(X)
+    exact = np.nanquantile(X, PROBS, axis=0)
+    spread = np.nanquantile(X, 0.95, axis=0) - np.nanquantile(X, 0.05, axis=0)
+    assert (np.abs(p2.quantiles() - exact) < 0.01 * spread).all()
+    np.testing.assert_array_equal(p2.count, np.isfinite(X).sum(axis=0))
+
+
+def test_p2_backends_agree():
+    pytest.importorskip('numba')
+    X = _stream(5000)
+    X[:, 1] = np.nan
+    X[:3, 1] = [2.0, 1.0, 3.0]                                             #cell with fewer than five values
+    python, numba = P2Quantiles(PROBS, X.shape[1], backend='python'), P2Quantiles(PROBS, X.shape[1], backend='numba')
+    assert python.kernel is None and numba.kernel is not None
+    for chunk in np.array_split(X, 7):
+        python.update_many(chunk)
+        numba.update_many(chunk)
+    np.testing.assert_allclose(numba.quantiles(), python.quantiles(), rtol=1e-12)
+    np.testing.assert_array_equal(python.quantiles()[:, 1], np.quantile([2.0, 1.0, 3.0], PROBS))
+
+
+def test_streaming_stats():
+    X = _stream(3000)
+    stats = StreamingStats(X.shape[1], PROBS, backend='python')
+    for chunk in np.array_split(X, 5):
+        stats.update(chunk)
+    summary = stats.summary()
+    np.testing.assert_array_equal(summary['n'], np.isfinite(X).sum(axis=0))
+    np.testing.assert_allclose(summary['mean'], np.nanmean(X, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(summary['std'], np.nanstd(X, axis=0, ddof=1), rtol=1e-10)
+    np.testing.assert_array_equal(summary['min'], np.nanmin(X, axis=0))
+    np.testing.assert_array_equal(summary['max'], np.nanmax(X, axis=0))
+
+
+def test_propagate_chunks():
+    distributions = {'si': [0.05, 0.1, 0.2], 'lsys': lambda rng, size: rng.uniform(3000, 8000, size)}
+    out = propagate(dict(ALSEA_BAY, dur=30), distributions, variables=['Ai', 'Vc'], n_samples=500, chunk_size=128)
+    assert set(out) == {'Ai', 'Vc'} and len(out['Ai']) == 31
+    table = out['Ai']
+    assert (table['n'] == 500).all() and table.loc[0, 'std'] == 0
+    assert (table['min'] <= table['p5']).all() and (table['p5'] <= table['p50']).all()
+    assert (table['p50'] <= table['p95']).all() and (table['p95'] <= table['max']).all()